@@ -0,0 +1,208 @@
+import os
+import numpy as np
+import pandas as pd
+
+FLUSH_ROWS = 50000  # Liczba buforowanych wierszy, po której następuje zapis do pliku
+FORMATS = ("csv", "parquet")
+
+SECOND_COLUMNS = ["Time (s)", "Avg Speed (km/h)", "Traffic Density"]
+TRAJECTORY_COLUMNS = ["frame", "time_s", "id", "type", "x", "y", "width", "height", "angle",
+                      "speed_kmh", "avg_speed_kmh", "altitude_m"]
+
+
+def analytics_format(path):
+    """
+    Format pliku na podstawie rozszerzenia (.parquet lub .pq - Parquet, pozostałe - CSV)
+    """
+    return "parquet" if os.path.splitext(path)[1].lower() in (".parquet", ".pq") else "csv"
+
+
+def trajectory_path(path):
+    """
+    Ścieżka pliku trajektorii obok pliku statystyk (np. DJI_0005.csv -> DJI_0005.tracks.csv)
+    """
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.tracks{extension}"
+
+
+class TableWriter:
+    """
+    Buforowany zapis jednej tabeli - kolumny są gromadzone w pamięci i dopisywane do pliku paczkami.
+    CSV jest dopisywany przez pandas, a Parquet zapisywany jako katalog plików part-NNNNN.parquet
+    (jeden kompletny plik na paczkę - przerwanie przetwarzania nie uszkadza zapisanych danych)
+    """
+    def __init__(self, path, columns, file_format="csv", flush_rows=FLUSH_ROWS, state=None):
+        """
+        Args:
+            path: Ścieżka pliku CSV lub katalogu Parquet (istniejące dane są zastępowane)
+            columns: Nazwy kolumn w kolejności zapisu
+            file_format: "csv" albo "parquet"
+            flush_rows: Liczba buforowanych wierszy, po której następuje zapis
+            state: Stan z get_state - kontynuacja zapisu od punktu kontrolnego
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown analytics format: {file_format}")
+        self.parquet = None
+        if file_format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ValueError("Parquet output requires pyarrow - install it or use CSV")
+            self.parquet = pyarrow
+        self.path = path
+        self.columns = columns
+        self.file_format = file_format
+        self.flush_rows = flush_rows
+        self.chunks = []    # Bufor - lista słowników kolumn
+        self.buffered_rows = 0
+        self.written_rows = 0
+        self.parts = 0  # Liczba zapisanych plików Parquet
+
+        if state is not None:
+            self._restore(state)
+        elif file_format == "csv":
+            pd.DataFrame(columns=columns).to_csv(path, index=False)   # Usuwanie zawartości i zapis nagłówka
+        else:
+            if os.path.isfile(path):
+                os.remove(path)
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+
+    def _part_path(self, index):
+        return os.path.join(self.path, f"part-{index:05d}.parquet")
+
+    def append(self, **columns):
+        """
+        Dodanie wierszy - tablice o jednakowej długości dla każdej kolumny
+        """
+        rows = len(next(iter(columns.values())))
+        if rows == 0:
+            return
+        self.chunks.append(columns)
+        self.buffered_rows += rows
+        if self.buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def _columns(self):
+        """
+        Połączenie zbuforowanych paczek kolumna po kolumnie
+        """
+        return [np.concatenate([np.asarray(chunk[name]) for chunk in self.chunks]) for name in self.columns]
+
+    def flush(self):
+        """
+        Zapis zbuforowanych wierszy do pliku
+        """
+        if not self.chunks:
+            return
+        data = pd.DataFrame(dict(zip(self.columns, self._columns())))
+        if self.file_format == "csv":
+            data.to_csv(self.path, mode="a", header=False, index=False)
+        else:
+            table = self.parquet.Table.from_pandas(data, preserve_index=False)
+            part_path = self._part_path(self.parts)
+            tmp_path = os.path.join(self.path, f".{os.path.basename(part_path)}.tmp")  # Pliki z kropką są pomijane przy odczycie
+            self.parquet.parquet.write_table(table, tmp_path)
+            os.replace(tmp_path, part_path)
+            self.parts += 1
+        self.written_rows += len(data)
+        self.chunks = []
+        self.buffered_rows = 0
+
+    def get_state(self):
+        """
+        Zapis bufora i położenie zapisu (rozmiar pliku CSV lub liczba plików Parquet) - punkt kontrolny
+        nie przechowuje wierszy, tylko położenie w pliku
+        """
+        self.flush()
+        position = os.path.getsize(self.path) if self.file_format == "csv" else self.parts
+        return {"position": position, "written_rows": self.written_rows}
+
+    def _restore(self, state):
+        """
+        Usunięcie danych zapisanych po punkcie kontrolnym
+        """
+        position = state["position"]
+        if self.file_format == "csv":
+            if not os.path.isfile(self.path) or os.path.getsize(self.path) < position:
+                raise ValueError(f"Cannot resume: {self.path} is missing or shorter than at the checkpoint "
+                                 f"- remove the checkpoint to start from the beginning")
+            with open(self.path, "r+b") as file:
+                file.truncate(position)
+        else:
+            if not all(os.path.isfile(self._part_path(index)) for index in range(position)):
+                raise ValueError(f"Cannot resume: parts of {self.path} written before the checkpoint are missing "
+                                 f"- remove the checkpoint to start from the beginning")
+            self.parts = position
+            os.makedirs(self.path, exist_ok=True)   # Punkt kontrolny przed zapisem pierwszego pliku
+            for name in os.listdir(self.path):
+                if name.startswith("part-") and int(name[5:10]) >= self.parts:
+                    os.remove(os.path.join(self.path, name))
+        self.written_rows = state["written_rows"]
+
+    def close(self):
+        self.flush()
+
+
+class AnalyticsSink:
+    """
+    Zapis wyników analizy: statystyki co sekundę nagrania oraz pełne trajektorie pojazdów (pozycja w każdej klatce,
+    w której została zmierzona). Wiersze są buforowane, dzięki czemu zapis nie otwiera pliku w każdej sekundzie nagrania
+    """
+    def __init__(self, output_file, trajectory_file=None, file_format=None, flush_rows=FLUSH_ROWS, state=None):
+        """
+        Args:
+            output_file: Plik statystyk co sekundę (czas, średnia prędkość, liczba pojazdów)
+            trajectory_file: Plik trajektorii pojazdów (None - bez zapisu trajektorii)
+            file_format: "csv" albo "parquet" (domyślnie na podstawie rozszerzenia output_file)
+            flush_rows: Liczba buforowanych wierszy trajektorii, po której następuje zapis
+            state: Stan z get_state - kontynuacja zapisu od punktu kontrolnego
+        """
+        state = state or {}
+        file_format = file_format or analytics_format(output_file)
+        # Statystyki co sekundę są małe - zapisywane co minutę nagrania, aby plik był aktualny w trakcie przetwarzania
+        self.seconds = TableWriter(output_file, SECOND_COLUMNS, file_format, flush_rows=60, state=state.get("seconds"))
+        self.trajectories = None
+        if trajectory_file:
+            self.trajectories = TableWriter(trajectory_file, TRAJECTORY_COLUMNS, file_format, flush_rows,
+                                            state=state.get("trajectories"))
+
+    def add_second(self, seconds, avg_speed, traffic):
+        self.seconds.append(**{"Time (s)": [seconds], "Avg Speed (km/h)": [avg_speed], "Traffic Density": [traffic]})
+
+    def add_trajectories(self, frame_idx, seconds, ids, types, positions, speeds, avg_speeds, altitude):
+        """
+        Dodanie pozycji pojazdów zmierzonych w jednej klatce
+        Args:
+            ids: Identyfikatory pojazdów
+            types: Typy pojazdów ("small" lub "large")
+            positions: Tablica pozycji (x, y, szerokość, wysokość, kąt)
+            speeds: Prędkości chwilowe w km/h
+            avg_speeds: Prędkości uśrednione w km/h
+            altitude: Wysokość drona nad terenem w metrach
+        """
+        if self.trajectories is None or len(ids) == 0:
+            return
+        x, y, width, height, angle = np.asarray(positions, dtype=float).T
+        self.trajectories.append(frame=np.full(len(ids), frame_idx), time_s=np.full(len(ids), seconds),
+                                 id=ids, type=types, x=x, y=y, width=width, height=height, angle=angle,
+                                 speed_kmh=speeds, avg_speed_kmh=avg_speeds, altitude_m=np.full(len(ids), altitude))
+
+    def flush(self):
+        self.seconds.flush()
+        if self.trajectories is not None:
+            self.trajectories.flush()
+
+    def get_state(self):
+        state = {"seconds": self.seconds.get_state()}
+        if self.trajectories is not None:
+            state["trajectories"] = self.trajectories.get_state()
+        return state
+
+    def close(self):
+        self.seconds.close()
+        if self.trajectories is not None:
+            self.trajectories.close()
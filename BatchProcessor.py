@@ -0,0 +1,198 @@
+import functools
+import itertools
+import os
+import time
+import multiprocessing
+from VideoEncoder import VideoEncoder, segment_path
+from VideoProcessor import VideoProcessor, load_model, IMGSZ
+from DetectorBackend import export_model
+from FramePipeline import FramePipeline
+
+VIDEO_EXTENSIONS = (".mp4", ".mov")
+
+_worker_model = None    # Model YOLO załadowany raz w każdym procesie roboczym
+
+
+def find_flights(directory):
+    """
+    Wyszukanie par nagranie + plik SRT w katalogu (nagrania bez pliku SRT są pomijane)
+    """
+    files = {name.lower(): name for name in os.listdir(directory)}
+    flights = []
+    for lower_name, name in sorted(files.items()):
+        stem, extension = os.path.splitext(lower_name)
+        if extension not in VIDEO_EXTENSIONS:
+            continue
+        if stem + ".srt" not in files:
+            print(f"Skipping {name}: no .srt file")
+            continue
+        flights.append(os.path.join(directory, name))
+    return flights
+
+
+def process_video(video_processor, output_path=None, pipeline=False, verbose=True, encoder_options=None):
+    """
+    Przetworzenie całego nagrania (po wznowieniu od klatki punktu kontrolnego), zwraca liczbę przetworzonych klatek
+    Args:
+        encoder_options: Dodatkowe argumenty VideoEncoder (backend, proxy_scale, decimation, drop_frames)
+    """
+    output_writer = None
+    if output_path:
+        output_writer = VideoEncoder(   # Kodowanie w osobnym wątku
+            segment_path(output_path, video_processor.start_frame),  # Po wznowieniu zapis do kolejnego fragmentu
+            video_processor.fps,
+            (video_processor.frame_width, video_processor.frame_height),
+            profiler=video_processor.profiler,
+            **(encoder_options or {})
+        )
+
+    total_frames = video_processor.get_total_frame_count()   # None - strumień na żywo
+    frame_pipeline = None
+    if pipeline:
+        frame_pipeline = FramePipeline(video_processor, output_writer)  # Zapis nagrania odbywa się w ostatnim etapie potoku
+    processed = 0
+    progress_interval = max(1, round(video_processor.fps))  # Postęp wypisywany co sekundę nagrania
+    try:
+        frame_numbers = range(video_processor.start_frame, total_frames) if total_frames is not None else itertools.count()
+        for frame_count in frame_numbers:
+            if frame_pipeline:
+                frame, is_frame_available = frame_pipeline.process_frame()
+            else:
+                frame, is_frame_available = video_processor.process_frame()
+            if not is_frame_available:
+                break
+
+            if output_writer and not frame_pipeline:
+                with video_processor.profiler.stage("write"):
+                    output_writer.write(frame)
+
+            processed += 1
+            if verbose and (processed % progress_interval == 0 or frame_count + 1 == total_frames):
+                print(f"Processed frame {frame_count + 1}/{total_frames or '?'} {_stage_report(video_processor.profiler)}")
+    finally:
+        try:
+            if frame_pipeline:
+                frame_pipeline.stop()
+            if output_writer:
+                output_writer.release()
+                stats = output_writer.stats()
+                if stats["frames_dropped"] and verbose:
+                    print(f"Encoder dropped {stats['frames_dropped']} frames (max queue depth {stats['max_queue_depth']})")
+        finally:
+            video_processor.finish()    # Statystyki, trajektorie i punkt kontrolny zapisywane także po błędzie kodera
+    return processed
+
+
+def _stage_report(profiler):
+    """
+    Krótkie podsumowanie średnich czasów etapów (ms) do wypisania w trakcie przetwarzania
+    """
+    summary = profiler.summary()["stages"]
+    return " | ".join(f"{name} {stats['p50_ms']:.1f}" for name, stats in summary.items())
+
+
+def _worker_model_for(model_path, backend="torch", int8=False, calibration_video=None):
+    """
+    Model YOLO procesu roboczego ładowany przy pierwszym nagraniu (błąd ładowania kończy tylko bieżące zadanie)
+    """
+    global _worker_model
+    if _worker_model is None:
+        _worker_model = load_model(model_path, backend=backend, int8=int8, calibration_video=calibration_video)
+    return _worker_model
+
+
+def prepare_model(model_path, calibration_video, backend="torch", int8=False):
+    """
+    Eksport modelu w procesie głównym przed uruchomieniem puli - procesy robocze odczytują go z pamięci podręcznej
+    """
+    if backend != "torch":
+        print(f"Preparing the {backend}{' INT8' if int8 else ''} model...")
+        export_model(model_path, backend, IMGSZ, int8, calibration_video)
+
+
+def _process_job(job):
+    """
+    Przetworzenie jednego nagrania w procesie roboczym (błędy są zwracane, a nie zgłaszane)
+    """
+    video_path, output_dir, options = job
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    start = time.perf_counter()
+    try:
+        video_processor = VideoProcessor(
+            video_path,
+            options["drone_model"],
+            options["start_altitude"],
+            model_path=options["model_path"],
+            # Model procesu ładowany dopiero przy pierwszej klatce brakującej w pamięci podręcznej detekcji
+            model_loader=functools.partial(_worker_model_for, options["model_path"],
+                                           options["processor_options"].get("backend", "torch"),
+                                           options["processor_options"].get("int8", False), video_path),
+            output_file=os.path.join(output_dir, name + "." + options["analytics_format"]),
+            stats_path=os.path.join(output_dir, name + ".stats.json"),
+            overlay=options["save_video"],
+            **options["processor_options"]
+        )
+        output_path = os.path.join(output_dir, name + ".mp4") if options["save_video"] else None
+        frames = process_video(video_processor, output_path, options["pipeline"], verbose=False,
+                               encoder_options=options["encoder_options"])
+        return video_path, frames, time.perf_counter() - start, None
+    except Exception as e:
+        return video_path, 0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def run_batch(input_dir, output_dir, drone_model, model_path, workers=1, start_altitude=None,
+              save_video=True, pipeline=False, encoder_options=None, analytics_format="csv", **processor_options):
+    """
+    Przetworzenie wszystkich nagrań z katalogu w puli procesów, każde nagranie zapisuje własny plik CSV i nagranie wynikowe
+    Args:
+        input_dir: Katalog z parami nagranie + plik SRT
+        output_dir: Katalog na wyniki (<nazwa nagrania>.csv, .tracks.csv z trajektoriami, .mp4 i .stats.json ze statystykami wydajności)
+        workers: Liczba procesów roboczych (każdy ładuje model raz)
+        save_video: Zapis nagrania z naniesionymi pojazdami
+        encoder_options: Argumenty VideoEncoder (np. pomniejszona kopia do przeglądania: proxy_scale, decimation)
+        analytics_format: Format plików wyników analizy ("csv" lub "parquet")
+        processor_options: Dodatkowe argumenty VideoProcessor (batch_size, detection_stride, ...)
+    Returns:
+        Lista nagrań zakończonych błędem (ścieżka, opis błędu)
+    """
+    flights = find_flights(input_dir)
+    if not flights:
+        print(f"No video/SRT pairs found in {input_dir}")
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+
+    options = {
+        "drone_model": drone_model,
+        "start_altitude": start_altitude,
+        "model_path": model_path,
+        "save_video": save_video,
+        "pipeline": pipeline,
+        "encoder_options": encoder_options or {},
+        "analytics_format": analytics_format,
+        "processor_options": processor_options,
+    }
+    prepare_model(model_path, flights[0], processor_options.get("backend", "torch"), processor_options.get("int8", False))
+    jobs = [(video_path, output_dir, options) for video_path in flights]
+    workers = max(1, min(workers, len(jobs)))
+    print(f"Processing {len(jobs)} videos with {workers} workers...")
+
+    start = time.perf_counter()
+    total_frames = 0
+    failures = []
+    context = multiprocessing.get_context("spawn")  # Bezpieczne dla CUDA i MPS
+    with context.Pool(workers) as pool:
+        for done, (video_path, frames, seconds, error) in enumerate(pool.imap_unordered(_process_job, jobs), 1):
+            name = os.path.basename(video_path)
+            if error:
+                failures.append((video_path, error))
+                print(f"[{done}/{len(jobs)}] {name} failed after {seconds:.1f} s: {error}")
+                continue
+            total_frames += frames
+            print(f"[{done}/{len(jobs)}] {name}: {frames} frames in {seconds:.1f} s ({frames / max(seconds, 1e-9):.1f} fps)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Batch completed: {len(jobs) - len(failures)}/{len(jobs)} videos, {total_frames} frames in {elapsed:.1f} s "
+          f"({total_frames / max(elapsed, 1e-9):.1f} fps aggregate)")
+    for video_path, error in failures:
+        print(f"Failed: {video_path}: {error}")
+    return failures
@@ -0,0 +1,407 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from VideoProcessor import VideoProcessor, DRONES, IMGSZ, CONFIDENCE, load_model
+from DetectorBackend import sample_frames
+from TiledDetection import rotated_intersection
+from BatchProcessor import process_video
+from DetectionCache import VEHICLE_CLASSES, DEFAULT_DETECTION_CACHE
+from Telemetry import load_telemetry, align_to_frames, altitudes
+from Replay import save_clip, truth_path, write_tracks
+
+SMALL_SIZE = (4.5, 1.8) # Wymiary samochodu osobowego w metrach
+LARGE_SIZE = (10.0, 2.5)    # Wymiary samochodu ciężarowego w metrach
+LANE_WIDTH = 3.5    # Szerokość pasa ruchu w metrach
+SMALL_COLOR = (255, 255, 255)   # Kolory pojazdów w nagraniu syntetycznym (BGR)
+LARGE_COLOR = (0, 215, 255)
+LANE_COLOR = (150, 150, 150)
+BACKGROUND = 60
+PARITY_IOU = 0.5    # Minimalne IoU ramek uznawanych za tę samą detekcję w porównaniu silników wnioskowania
+
+
+def _write_srt(srt_path, frames, fps, latitude, longitude, altitude):
+    """
+    Zapis telemetrii w formacie pliku SRT drona DJI (dron zawisa w miejscu)
+    """
+    with open(srt_path, "w") as file:
+        for i in range(frames):
+            start, end = i / fps, (i + 1) / fps
+            timecodes = []
+            for seconds in (start, end):
+                milliseconds = int(round(seconds * 1000))
+                hours, milliseconds = divmod(milliseconds, 3600000)
+                minutes, milliseconds = divmod(milliseconds, 60000)
+                seconds, milliseconds = divmod(milliseconds, 1000)
+                timecodes.append(f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}")
+            file.write(
+                f"{i + 1}\n{timecodes[0]} --> {timecodes[1]}\n"
+                f"<font size=\"28\">FrameCnt: {i + 1}, DiffTime: {int(1000 / fps)}ms\n"
+                f"[iso: 100] [shutter: 1/1000.0] [fnum: 1.7] [ev: 0] [focal_len: 24.00] "
+                f"[latitude: {latitude:.6f}] [longitude: {longitude:.6f}] "
+                f"[rel_alt: {altitude:.3f} abs_alt: {altitude + 200:.3f}] [ct: 5500] </font>\n\n"
+            )
+
+
+def generate_flight(directory, width=1920, height=1080, seconds=10, fps=30, vehicles=20, altitude=60.0,
+                    drone_model="DJI mini 4 pro", tilt=8.0, seed=0, name="synthetic"):
+    """
+    Wygenerowanie syntetycznego nagrania z góry (obrócone prostokąty poruszające się po pasach ruchu) oraz pliku SRT
+    Args:
+        directory: Katalog na nagranie, plik SRT, opis prawdziwych wartości (.json) i prawdziwe trajektorie
+                   pojazdów w formacie Replay.COLUMNS (.gt.txt)
+        vehicles: Liczba pojazdów w nagraniu (pojazdy opuszczające kadr wracają po drugiej stronie z nowym identyfikatorem)
+        altitude: Wysokość drona w metrach - wyznacza GSD, a więc rozmiar pojazdów w pikselach
+        tilt: Kąt nachylenia pasów ruchu w stopniach
+    Returns:
+        Ścieżka do nagrania i słownik z prawdziwymi wartościami (GSD, położenie i prędkości pasów)
+    """
+    rng = np.random.default_rng(seed)
+    drone = DRONES[drone_model]
+    # Skala pikseli taka sama jak w CarContainer (poziome i pionowe GSD)
+    gsd = np.array([
+        altitude * drone["sensor_width"] / (drone["focal_length"] * width),
+        altitude * drone["sensor_height"] / (drone["focal_length"] * height),
+    ])
+    frames = int(seconds * fps)
+    extent = np.array([width, height]) * gsd    # Wymiary kadru w metrach
+
+    # Pasy ruchu równomiernie w środkowej części kadru, na przemian w przeciwnych kierunkach (współrzędne w metrach)
+    lanes = int(np.clip(extent[1] * 0.7 // (LANE_WIDTH * 1.5), 1, 8))
+    lane_y = extent[1] / 2 + (np.arange(lanes) - (lanes - 1) / 2) * LANE_WIDTH * 1.5
+    lane_speeds = rng.uniform(30, 90, lanes) * np.where(np.arange(lanes) % 2, -1, 1)  # km/h
+    direction = np.array([np.cos(np.radians(tilt)), np.sin(np.radians(tilt))])
+    normal = np.array([-direction[1], direction[0]])
+    period = extent[0] / direction[0] + LARGE_SIZE[0] * 2   # Długość drogi, po której pojazd wraca na początek
+
+    lane_of = np.arange(vehicles) % lanes
+    per_lane = np.bincount(lane_of, minlength=lanes)
+    order = np.array([np.sum(lane_of[:i] == lane_of[i]) for i in range(vehicles)])
+    offsets = order * period / np.maximum(per_lane[lane_of], 1) + rng.uniform(0, period / 20, vehicles)
+    large = rng.random(vehicles) < 0.2
+    sizes = np.where(large[:, None], LARGE_SIZE, SMALL_SIZE)
+    steps = lane_speeds[lane_of] / 3.6 / fps    # Przesunięcie w metrach na klatkę
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2
+
+    os.makedirs(directory, exist_ok=True)
+    video_path = os.path.join(directory, name + ".mp4")
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    background = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+    truth_rows, truth_ids = [], {}  # Prawdziwe trajektorie; (pojazd, okrążenie) -> identyfikator
+    for y in (lane_y[:-1] + lane_y[1:]) / 2:
+        center = np.array([extent[0] / 2, y])
+        start, end = (center - direction * period / 2) / gsd, (center + direction * period / 2) / gsd
+        cv2.line(background, tuple(start.astype(int)), tuple(end.astype(int)), LANE_COLOR, max(1, int(0.15 / gsd[0])))
+    for i in range(frames):
+        frame = background.copy()
+        distance = (offsets + steps * i) % period - period / 2
+        centers = np.stack([extent[0] / 2 + distance * direction[0], lane_y[lane_of] + distance * direction[1]], axis=1)
+        laps = np.floor((offsets + steps * i) / period).astype(int)
+        pixels = centers / gsd
+        for vehicle in np.flatnonzero(np.all((pixels >= 0) & (pixels < (width, height)), axis=1)):
+            car_id = truth_ids.setdefault((vehicle, laps[vehicle]), len(truth_ids) + 1)
+            truth_rows.append((i + 1, car_id, *pixels[vehicle], sizes[vehicle][0] / gsd[0], sizes[vehicle][1] / gsd[1],
+                               tilt, 1.0, 9 if large[vehicle] else 10, abs(lane_speeds[lane_of[vehicle]])))
+        for center, (length, breadth), is_large in zip(centers, sizes, large):
+            points = center + corners[:, :1] * length * direction + corners[:, 1:] * breadth * normal
+            cv2.fillPoly(frame, [np.round(points / gsd).astype(np.int32)], LARGE_COLOR if is_large else SMALL_COLOR)
+        writer.write(frame)
+    writer.release()
+
+    _write_srt(os.path.join(directory, name + ".srt"), frames, fps, 50.061, 19.937, altitude)
+    write_tracks(truth_path(video_path), np.array(truth_rows).reshape(-1, 10))
+    truth = {
+        "gsd": gsd.tolist(),
+        "lane_y": lane_y.tolist(),  # Położenie pasów w metrach na osi pionowej środka kadru
+        "lane_speeds": np.abs(lane_speeds).tolist(),
+        "tilt": tilt,
+        "vehicles": vehicles,
+    }
+    with open(os.path.join(directory, name + ".json"), "w") as file:
+        json.dump(truth, file, indent=2)
+    return video_path, truth
+
+
+class StubDetector:
+    """
+    Deterministyczny detektor dla nagrań syntetycznych - zwraca obrócone prostokąty narysowane w klatce
+    (prawdziwe położenia z dokładnością do kompresji nagrania) bez uruchamiania modelu
+    """
+    def __init__(self, min_area=20):
+        self.min_area = min_area
+
+    def _boxes(self, mask, vehicle_type):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        detections = []
+        for contour in contours:
+            if cv2.contourArea(contour) < self.min_area:
+                continue
+            (x, y), (width, height), angle = cv2.minAreaRect(contour)
+            if height > width:  # Dłuższy bok jako szerokość, tak jak w modelu OBB
+                width, height, angle = height, width, angle - 90
+            detections.append(((x, y, width, height, angle), vehicle_type))
+        return detections
+
+    def __call__(self, frames):
+        results = []
+        for frame in frames:
+            small = cv2.inRange(frame, (215, 215, 215), (255, 255, 255))
+            large = cv2.inRange(frame, (0, 160, 200), (90, 255, 255))
+            results.append(self._boxes(small, 'small') + self._boxes(large, 'large'))
+        return results
+
+
+def record_clip(video_path, detector, clip_path, drone_model="DJI mini 4 pro"):
+    """
+    Zapis detekcji detektora dla wszystkich klatek nagrania jako klipu Replay (wraz z prawdziwymi trajektoriami
+    nagrania syntetycznego) - strojenie parametrów śledzenia bez ponownego dekodowania nagrania
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Failed to open the video")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    meta = {
+        "fps": fps,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        **DRONES[drone_model],
+        "video": os.path.basename(video_path),
+    }
+    class_ids = {vehicle_type: class_id for class_id, vehicle_type in VEHICLE_CLASSES.items()}
+    detections = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        found = detector([frame])[0]
+        xywhr = np.array([(*position[:4], np.radians(position[4])) for position, _ in found]).reshape(-1, 5)
+        detections.append((xywhr, np.ones(len(found)), np.array([class_ids[vehicle_type] for _, vehicle_type in found], dtype=int)))
+    cap.release()
+    telemetry = align_to_frames(load_telemetry(os.path.splitext(video_path)[0] + ".srt"), len(detections), fps)
+    save_clip(clip_path, meta, altitudes(telemetry), detections)
+    if os.path.isfile(truth_path(video_path)):
+        shutil.copy(truth_path(video_path), truth_path(clip_path))
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(video_path, truth=None, detector=None, model_path=None, drone_model="DJI mini 4 pro",
+                  output_path=None, pipeline=False, **processor_options):
+    """
+    Przetworzenie nagrania od początku do końca z pomiarem wydajności
+    Args:
+        truth: Prawdziwe wartości nagrania syntetycznego (do wyznaczenia błędu prędkości)
+        detector: Detektor zastępujący model YOLO (None - model z model_path)
+        processor_options: Argumenty VideoProcessor - domyślnie bez pamięci podręcznej detekcji (odczyt detekcji
+                           poprzedniego przebiegu zawyżałby wynik)
+    Returns:
+        Słownik z wynikami (klatki na sekundę, czasy etapów, szczytowe zużycie pamięci, błąd prędkości)
+    """
+    processor_options.setdefault("detection_cache_dir", None)
+    with tempfile.TemporaryDirectory() as directory:
+        video_processor = VideoProcessor(
+            video_path, drone_model, None, model_path,
+            detector=detector,
+            output_file=os.path.join(directory, "traffic_analysis.csv"),
+            **processor_options
+        )
+        # Błąd uśrednionej prędkości względem prędkości pasa ruchu, na którym znajduje się pojazd
+        errors = []
+        if truth:
+            gsd = np.array(truth["gsd"])
+            normal = np.array([-np.sin(np.radians(truth["tilt"])), np.cos(np.radians(truth["tilt"]))])
+            center_x = video_processor.frame_width * gsd[0] / 2
+            lane_offsets = np.array(truth["lane_y"]) * normal[1]    # Odległość pasów od prostej przez środek kadru
+            lane_speeds = np.array(truth["lane_speeds"])
+            container = video_processor.car_container
+            track = video_processor.track
+
+            def track_and_compare(*args, **kwargs):
+                track(*args, **kwargs)
+                if video_processor.current_frame_idx % round(video_processor.fps) == 0:
+                    for car in container.cars:
+                        if car.real_speed > 0:
+                            offset = (np.array(car.position[:2]) * gsd - (center_x, 0)) @ normal
+                            lane = np.argmin(np.abs(lane_offsets - offset))
+                            errors.append(abs(car.real_speed - lane_speeds[lane]))
+            video_processor.track = track_and_compare
+
+        start = time.perf_counter()
+        frames = process_video(video_processor, output_path, pipeline, verbose=False)
+        elapsed = time.perf_counter() - start
+        stats = video_processor.collect_stats()   # Czasy etapów mierzone przez VideoProcessor
+
+    return {
+        "revision": _git_revision(),
+        "platform": platform.platform(),
+        "video": os.path.basename(video_path),
+        "resolution": [video_processor.frame_width, video_processor.frame_height],
+        "detector": "stub" if detector is not None else "yolo",
+        "options": dict(processor_options, pipeline=pipeline),
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / max(elapsed, 1e-9), 2),
+        "detector_frames": video_processor.detected_frames,
+        "stages": stats["stages"],
+        "tracking": stats["counters"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),   # ru_maxrss w KB (Linux)
+        "speed_mae_kmh": round(float(np.mean(errors)), 3) if errors else None,
+        "speed_samples": len(errors),
+    }
+
+
+def match_detections(baseline, candidate, iou_threshold=PARITY_IOU):
+    """
+    Przypisanie ramek (xywhr) dwóch modeli o największym łącznym IoU, zwraca pary indeksów z IoU >= iou_threshold
+    """
+    if len(baseline) == 0 or len(candidate) == 0:
+        return []
+    iou = np.zeros((len(baseline), len(candidate)))
+    for i, box in enumerate(baseline):
+        for j, other in enumerate(candidate):
+            intersection = rotated_intersection(box, other)
+            if intersection:
+                iou[i, j] = intersection / (box[2] * box[3] + other[2] * other[3] - intersection)
+    rows, cols = linear_sum_assignment(-iou)
+    return [(i, j) for i, j in zip(rows, cols) if iou[i, j] >= iou_threshold]
+
+
+def detection_parity(baseline, candidate, frames):
+    """
+    Zgodność detekcji modelu (np. ONNX INT8) z detekcjami modelu bazowego PyTorch na tych samych klatkach
+    Returns:
+        Słownik z liczbą detekcji, odsetkiem detekcji odnalezionych przez model (recall) i zgodnych z modelem bazowym
+        (precision), zgodnością klas, średnim przesunięciem środka ramki i czasem wnioskowania obu modeli
+    """
+    counts = {"baseline": 0, "candidate": 0, "matched": 0, "same_class": 0}
+    offsets = []
+    seconds = {"baseline": 0.0, "candidate": 0.0}
+    for frame in frames:
+        arrays = {}
+        for name, model in (("baseline", baseline), ("candidate", candidate)):
+            start = time.perf_counter()
+            result = model([frame], conf=CONFIDENCE, imgsz=IMGSZ, stream=False, verbose=False)[0].cpu().numpy()
+            seconds[name] += time.perf_counter() - start
+            xywhr, _, classes = VideoProcessor._result_arrays(result)
+            arrays[name] = (xywhr, classes)
+            counts[name] += len(xywhr)
+        (baseline_xywhr, baseline_classes), (candidate_xywhr, candidate_classes) = arrays["baseline"], arrays["candidate"]
+        for i, j in match_detections(baseline_xywhr, candidate_xywhr):
+            counts["matched"] += 1
+            counts["same_class"] += int(baseline_classes[i] == candidate_classes[j])
+            offsets.append(float(np.hypot(*(baseline_xywhr[i, :2] - candidate_xywhr[j, :2]))))
+    recall = counts["matched"] / max(counts["baseline"], 1)
+    precision = counts["matched"] / max(counts["candidate"], 1)
+    return {
+        "frames": len(frames),
+        "baseline_detections": counts["baseline"],
+        "candidate_detections": counts["candidate"],
+        "matched": counts["matched"],
+        "recall": round(recall, 4),
+        "precision": round(precision, 4),
+        "f1": round(2 * recall * precision / max(recall + precision, 1e-9), 4),
+        "class_agreement": round(counts["same_class"] / max(counts["matched"], 1), 4),
+        "mean_center_offset_px": round(float(np.mean(offsets)), 3) if offsets else None,
+        "baseline_ms": round(seconds["baseline"] * 1000 / max(len(frames), 1), 2),
+        "candidate_ms": round(seconds["candidate"] * 1000 / max(len(frames), 1), 2),
+    }
+
+
+def compare(results, baseline):
+    """
+    Porównanie wyników z wynikami poprzedniej wersji
+    """
+    print(f"fps: {baseline['fps']} -> {results['fps']} ({results['fps'] / max(baseline['fps'], 1e-9) - 1:+.1%})")
+    for stage, stats in results["stages"].items():
+        if stage in baseline.get("stages", {}):
+            before = baseline["stages"][stage]["mean_ms"]
+            print(f"{stage}: {before} -> {stats['mean_ms']} ms ({stats['mean_ms'] / max(before, 1e-9) - 1:+.1%})")
+    print(f"peak RSS: {baseline['peak_rss_mb']} -> {results['peak_rss_mb']} MB")
+    if results.get("speed_mae_kmh") is not None and baseline.get("speed_mae_kmh") is not None:
+        print(f"speed MAE: {baseline['speed_mae_kmh']} -> {results['speed_mae_kmh']} km/h")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark on synthetic drone footage.")
+    parser.add_argument("--width", type=int, default=1920, help="Synthetic video width.")
+    parser.add_argument("--height", type=int, default=1080, help="Synthetic video height.")
+    parser.add_argument("--seconds", type=float, default=10, help="Synthetic video length in seconds.")
+    parser.add_argument("--fps", type=int, default=30, help="Synthetic video frame rate.")
+    parser.add_argument("--vehicles", type=int, default=20, help="Number of vehicles in the synthetic video.")
+    parser.add_argument("--altitude", type=float, default=60.0, help="Drone altitude in meters (sets vehicle size in pixels).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic video.")
+    parser.add_argument("--video_path", type=str, required=False, help="Benchmark an existing video (with .srt) instead of a synthetic one.")
+    parser.add_argument("--detector", choices=["stub", "yolo"], default="stub", help="Ground-truth stub detector or the YOLO model.")
+    parser.add_argument("--model_path", type=str, default="models/drone7liten-obb-dota_and_data22.pt", help="Path to the YOLO model.")
+    parser.add_argument("--backend", choices=["torch", "onnx", "openvino"], default="torch", help="Inference backend of the YOLO model.")
+    parser.add_argument("--int8", action="store_true", help="Use the INT8 quantized model (onnx and openvino backends).")
+    parser.add_argument("--parity_frames", type=int, default=0, help="Compare detections of the backend with PyTorch on N frames of the video.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of frames passed to the detector in one call.")
+    parser.add_argument("--detection_stride", type=int, default=1, help="Maximum number of frames between detector runs.")
+    parser.add_argument("--pipeline", action="store_true", help="Run the staged frame pipeline.")
+    parser.add_argument("--detection_cache", action="store_true", help="Reuse cached detections of the video (measures cached re-runs, not the detector).")
+    parser.add_argument("--analytics_only", action="store_true", help="Skip drawing the overlay.")
+    parser.add_argument("--write_video", action="store_true", help="Include video encoding in the measurement.")
+    parser.add_argument("--output", type=str, default="benchmark.json", help="Path of the JSON results file.")
+    parser.add_argument("--baseline", type=str, required=False, help="Results of a previous run to compare against.")
+    parser.add_argument("--clip", type=str, required=False, help="Also save stub detections and ground truth of the synthetic video as a Replay.py clip (.npz or .txt).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        truth = None
+        video_path = args.video_path
+        if not video_path:
+            print("Generating synthetic video...")
+            video_path, truth = generate_flight(
+                directory, args.width, args.height, args.seconds, args.fps, args.vehicles, args.altitude, seed=args.seed
+            )
+        results = run_benchmark(
+            video_path, truth,
+            detector=StubDetector() if args.detector == "stub" else None,
+            model_path=args.model_path,
+            output_path=os.path.join(directory, "output.mp4") if args.write_video else None,
+            pipeline=args.pipeline,
+            batch_size=args.batch_size,
+            detection_stride=args.detection_stride,
+            overlay=not args.analytics_only,
+            backend=args.backend,
+            int8=args.int8,
+            detection_cache_dir=DEFAULT_DETECTION_CACHE if args.detection_cache else None
+        )
+        if args.parity_frames and args.detector == "yolo":
+            print("Comparing detections with the PyTorch model...")
+            results["parity"] = detection_parity(
+                load_model(args.model_path),
+                load_model(args.model_path, backend=args.backend, int8=args.int8, calibration_video=video_path),
+                sample_frames(video_path, args.parity_frames)
+            )
+        if args.clip:
+            record_clip(video_path, StubDetector(), args.clip)
+    results["synthetic"] = None if args.video_path else {
+        "seconds": args.seconds, "fps": args.fps, "vehicles": args.vehicles, "altitude": args.altitude, "seed": args.seed
+    }
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
-import cv2
+from collections import deque
 import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import connected_components
 from Car import Car
+from OverlayRenderer import OverlayRenderer
+from MotionModel import QuadraticMotionModel
+from TrackStore import TrackStore, VEHICLE_TYPES, HISTORY, window_fps
+
+NEAR_THRESHOLD = 20 # Próg odległości dla pojazdów śledzonych bez przerw
+FAR_THRESHOLD = 30  # Próg odległości dla nowych lub zgubionych pojazdów
+NEAR_MIN_POSITIONS = 5  # Liczba pozycji w historii, powyżej której pojazd śledzony bez przerw ma węższy próg
+REGION_FRACTION = 0.95  # Część kadru (wokół środka), w której śledzone są pojazdy
+COUNTED_SPEED = 10  # Prędkość uśredniona (km/h), od której pojazd jest liczony
 
 class CarContainer:
     """
     Kontener do śledzenia i zarządzania wykrytymi pojazdami
     """
-    def __init__(self, fps, frame_width, frame_height, focal_length, sensor_width, sensor_height, max_frames_missing=3):
+    def __init__(self, fps, frame_width, frame_height, focal_length, sensor_width, sensor_height, max_frames_missing=3, motion_model=None,
+                 archive=None, memory_budget=None, near_threshold=NEAR_THRESHOLD, far_threshold=FAR_THRESHOLD,
+                 near_min_positions=NEAR_MIN_POSITIONS, region_fraction=REGION_FRACTION, counted_speed=COUNTED_SPEED,
+                 history=HISTORY, degree=2):
         """
         Args:
             fps: Liczba klatek na sekundę
@@ -16,9 +32,34 @@ class CarContainer:
             sensor_width: Szerokość sensora kamery w milimetrach
             sensor_height: Wysokość sensora kamery w milimetrach
             max_frames_missing: Maksymalna liczba klatek, w których pojazd może być zgubiony
+            motion_model: Model ruchu pojazdów (domyślnie QuadraticMotionModel, opcjonalnie KalmanMotionModel)
+            archive: TrackArchive na historie prędkości zakończonych pojazdów i starsze historie śledzonych pojazdów
+                     (None - w pamięci przechowywane są tylko ostatnie prędkości)
+            memory_budget: Maksymalny rozmiar historii prędkości w pamięci w bajtach (None - bez ograniczenia liczby miejsc)
+            near_threshold: Próg odległości (piksele) dla pojazdów śledzonych bez przerw
+            far_threshold: Próg odległości (piksele) dla nowych lub zgubionych pojazdów
+            near_min_positions: Liczba pozycji w historii, powyżej której stosowany jest near_threshold
+            region_fraction: Część kadru (wokół środka), w której śledzone są pojazdy
+            counted_speed: Prędkość uśredniona (km/h), od której pojazd jest liczony i rysowany
+            history: Długość okna pozycji i prędkości (aproksymacja ruchu i uśrednianie prędkości)
+            degree: Stopień wielomianu domyślnego modelu ruchu
         """
-        self.cars = []  # Lista śledzonych pojazdów
+        if motion_model is None:
+            motion_model = QuadraticMotionModel(history, degree)
+        self.store = TrackStore(history=history, motion_model=motion_model, memory_budget=memory_budget)   # Stan śledzonych pojazdów w postaci tablic
+        self.near_threshold = near_threshold
+        self.far_threshold = far_threshold
+        self.near_min_positions = near_min_positions
+        self.region_fraction = region_fraction
+        self.counted_speed = counted_speed
+        self.archive = archive
+        if archive is not None:
+            self.store.spill = self._spill_history
+        self.car_views = {} # Obiekty Car dla zajętych wierszy magazynu
+        self.display_positions = {} # Przewidywane pozycje (x, y) rysowane w klatkach bez detekcji
+        self.renderer = OverlayRenderer()   # Rysowanie z zapamiętanymi napisami
         self.fps = fps
+        self.frame_times = deque(maxlen=history)    # Czasy ostatnich klatek strumienia na żywo (puste - stałe fps)
         self.frame_width = frame_width
         self.frame_height = frame_height
         self.focal_length = focal_length
@@ -28,14 +69,24 @@ class CarContainer:
         self.max_frames_missing = max_frames_missing
         self.next_id = 1
         self.car_counter = 0
+        self.track_stats = {"associations": 0, "new_tracks": 0, "dropped_tracks": 0}   # Liczniki narastające
         self.region = self._get_centered_region()   
 
+    @property
+    def cars(self):
+        """
+        Lista śledzonych pojazdów w kolejności dodania
+        """
+        slots = self.store.active_slots()
+        slots = slots[np.argsort(self.store.ids[slots], kind="stable")]
+        return [self.car_views[slot] for slot in slots]
+
     def _get_centered_region(self):
         """
         Obliczanie regionu nagrania, w którym będą śledzone pojazdy
         """
-        region_width = int(self.frame_width * 0.95)
-        region_height = int(self.frame_height * 0.95)
+        region_width = int(self.frame_width * self.region_fraction)
+        region_height = int(self.frame_height * self.region_fraction)
         x1 = (self.frame_width - region_width) // 2
         y1 = (self.frame_height - region_height) // 2
         return ((x1, y1), (x1 + region_width, y1 + region_height))
@@ -45,116 +96,295 @@ class CarContainer:
             return int(height * aspect_ratio), height
         return width, int(width / aspect_ratio)
 
+    def calculate_gsd(self, drone_real_height):
+        """
+        Poziome i pionowe GSD (metry na piksel) dla podanej wysokości drona
+        """
+        gsd_horizontal = (drone_real_height * self.sensor_width) / (self.focal_length * self.frame_width)
+        gsd_vertical = (drone_real_height * self.sensor_height) / (self.focal_length * self.frame_height)
+        return gsd_horizontal, gsd_vertical
+
     def update_drone_height(self, drone_real_height):
         """
         Aktualizacja wysokości drona i obliczanie GSD
         """
         self.drone_real_height = drone_real_height
-        self.gsd_horizontal = (drone_real_height * self.sensor_width) / (self.focal_length * self.frame_width)
-        self.gsd_vertical = (drone_real_height * self.sensor_height) / (self.focal_length * self.frame_height)
+        self.gsd_horizontal, self.gsd_vertical = self.calculate_gsd(drone_real_height)
         Car.scale = np.array([self.gsd_horizontal, self.gsd_vertical])
 
     def update_or_add_car(self, new_position, vehicle_type):
         """
         Aktualizacja pozycji istniejącego pojazdu lub dodanie nowego
         """
+        self.update_cars([(new_position, vehicle_type)])
+
+    def update_cars(self, detections):
+        """
+        Przypisanie wszystkich detekcji z klatki do śledzonych pojazdów (algorytm węgierski) i dodanie nowych pojazdów
+        Args:
+            detections: Lista (pozycja, typ pojazdu) dla jednej klatki
+        """
+        self.display_positions.clear()
         (x1, y1), (x2, y2) = self.region
-        x_center, y_center = new_position[:2]
-        if not (x1 <= x_center <= x2 and y1 <= y_center <= y2): # Sprawdzenie, czy pojazd znajduje się w regionie śledzenia
+        # Sprawdzenie, czy pojazd znajduje się w regionie śledzenia
+        detections = [
+            (position, vehicle_type) for position, vehicle_type in detections
+            if x1 <= position[0] <= x2 and y1 <= position[1] <= y2
+        ]
+        if not detections:
             return
-        
-        for car in self.cars:
+
+        store = self.store
+        assigned = {}
+        cars = self.cars
+        if cars:
+            detected_xy = np.array([position[:2] for position, _ in detections], dtype=float)
+            slots = np.array([car.slot for car in cars])
+            predicted_xy = store.predict_positions(slots)  # Jedno przewidywanie na pojazd
             # Ustawienie progu odległości w zależności od liczby zgubionych pozycji i ilości pozycji w historii
-            distance_threshold = 20 if car.frames_since_seen <=1 and len(car.positions_history) > 5 else 30
-            # Sprawdzenie, czy nowa pozycja znajduje się w pobliżu przewidywanej pozycji
-            if np.linalg.norm(np.array(new_position[:2]) - np.array(car.predict_next_position()[:2])) < distance_threshold:
-                car.update_position(new_position)    # Sprawdzenie, czy nowa pozycja znajduje się w pobliżu przewidywanej pozycji
-                car.calculate_speed(self.fps)   # Obliczanie prędkości
-                # Sprawdzenie, czy pojazd został wykryty i czy jego prędkość jest większa niż 10 km/h
-                if not car.is_detected and car.real_speed > 10:
-                    car.is_detected = True
-                    self.car_counter += 1   # Zwiększenie licznika pojazdów
-                return
-            
-        # Dodanie nowego pojazdu
-        new_car = Car(new_position, vehicle_type)
-        new_car.id = self.next_id
-        self.next_id += 1
-        self.cars.append(new_car)
+            near = (store.frames_since_seen[slots] <= 1) & (store.position_counts[slots] > self.near_min_positions)
+            thresholds = np.where(near, self.near_threshold, self.far_threshold)
+            for det_idx, car_idx in self._assign(detected_xy, predicted_xy, thresholds):
+                assigned[det_idx] = cars[car_idx]
+            self.track_stats["associations"] += len(assigned)
+
+        updated_slots = []
+        updated_positions = []
+        for det_idx, (position, vehicle_type) in enumerate(detections):
+            car = assigned.get(det_idx)
+            if car is not None:
+                updated_slots.append(car.slot)
+                updated_positions.append(position)
+                continue
+            # Dodanie nowego pojazdu
+            new_car = Car(position, vehicle_type, store)
+            new_car.id = self.next_id
+            self.next_id += 1
+            self.car_views[new_car.slot] = new_car
+            self.track_stats["new_tracks"] += 1
+
+        if updated_slots:
+            updated_slots = np.array(updated_slots)
+            store.update_positions(updated_slots, updated_positions)    # Aktualizacja pozycji przypisanych pojazdów
+            self._update_speeds(updated_slots)
+
+    def _assign(self, detected_xy, predicted_xy, thresholds):
+        """
+        Optymalne przypisanie detekcji do przewidywanych pozycji z bramkowaniem progami odległości.
+        Pary w zasięgu progu wyszukiwane są drzewem k-d, ich graf dzielony jest na spójne składowe (zwykle
+        pojedyncze pojazdy lub małe grupy), a algorytm węgierski rozwiązywany jest osobno dla każdej składowej
+        """
+        pairs = cKDTree(detected_xy).sparse_distance_matrix(cKDTree(predicted_xy), thresholds.max(), output_type="ndarray")
+        gated = pairs["v"] < thresholds[pairs["j"]]
+        det_idx, car_idx, distances = pairs["i"][gated], pairs["j"][gated], pairs["v"][gated]
+        if len(det_idx) == 0:
+            return []
+        detections_count = len(detected_xy)
+        graph = coo_matrix((np.ones(len(det_idx)), (det_idx, detections_count + car_idx)),
+                           shape=(detections_count + len(predicted_xy),) * 2)
+        components, labels = connected_components(graph, directed=False)
+
+        # Składowe z jedną parą (najczęstszy przypadek) przypisywane bez optymalizacji
+        edge_labels = labels[det_idx]
+        single = np.bincount(edge_labels, minlength=components)[edge_labels] == 1
+        assignments = list(zip(det_idx[single].tolist(), car_idx[single].tolist()))
+
+        # Pozostałe składowe - algorytm węgierski dla każdej osobno
+        order = np.flatnonzero(~single)
+        order = order[np.argsort(edge_labels[order], kind="stable")]
+        for edges in np.split(order, np.flatnonzero(np.diff(edge_labels[order])) + 1):
+            if len(edges) == 0:
+                continue
+            rows, cols = np.unique(det_idx[edges]), np.unique(car_idx[edges])
+            cost = np.full((len(rows), len(cols)), 1e9)
+            cost[np.searchsorted(rows, det_idx[edges]), np.searchsorted(cols, car_idx[edges])] = distances[edges]
+            row_ind, col_ind = linear_sum_assignment(cost)
+            assignments.extend(
+                (int(rows[r]), int(cols[c])) for r, c in zip(row_ind, col_ind)
+                if cost[r, c] < 1e9
+            )
+        return assignments
+
+    def propagate_cars(self, measure=None):
+        """
+        Obsługa klatki bez detekcji - pozycje pojazdów są przewidywane modelem ruchu i używane tylko do rysowania,
+        a brakujące pozycje uzupełnia aproksymacja przy kolejnej detekcji (tak jak dla zgubionych pojazdów)
+        Args:
+            measure: Opcjonalna funkcja measure(slots) zwracająca zmierzone pozycje (x, y) i maskę poprawnych pomiarów
+        """
+        store = self.store
+        slots = np.flatnonzero(store.active & (store.frames_since_seen > 0))
+        if len(slots) == 0:
+            return
+        predicted_xy = store.predict_positions(slots)
+        if measure is not None:
+            # Pomiar jest przyjmowany tylko dla pojazdów widocznych w poprzedniej klatce i zgodnych z przewidywaniem
+            measured_xy, valid = measure(slots)
+            valid &= (store.frames_since_seen[slots] == 1)
+            valid &= np.linalg.norm(measured_xy - predicted_xy, axis=1) < self.near_threshold
+            if valid.any():
+                positions = store.current_positions(slots[valid]).copy()
+                positions[:, :2] = measured_xy[valid]
+                store.update_positions(slots[valid], positions)
+                self._update_speeds(slots[valid])
+                slots, predicted_xy = slots[~valid], predicted_xy[~valid]
+        self.display_positions.update(zip(slots.tolist(), map(tuple, predicted_xy.tolist())))
+
+    def set_frame_time(self, frame_time):
+        """
+        Czas bieżącej klatki w sekundach - przy odrzucaniu klatek strumienia na żywo prędkości liczone są
+        z rzeczywistego czasu okna pozycji, a nie ze stałego fps (wywoływane przed aktualizacją pojazdów)
+        """
+        self.frame_times.append(frame_time)
+
+    def _update_speeds(self, slots):
+        """
+        Obliczanie prędkości zaktualizowanych pojazdów i zliczanie pojazdów
+        """
+        store = self.store
+        store.calculate_speeds(slots, window_fps(self.frame_times, store.history, self.fps), Car.scale)
+        # Sprawdzenie, czy pojazd został wykryty i czy jego prędkość jest większa niż counted_speed
+        detected = slots[~store.is_detected[slots] & (store.real_speed[slots] > self.counted_speed)]
+        store.is_detected[detected] = True
+        self.car_counter += len(detected)   # Zwiększenie licznika pojazdów
 
     def remove_missing_cars(self):
         """
         Usuwanie pojazdów, które zniknęły
         """
-        self.cars = [
-            car for car in self.cars
-            if car.frames_since_seen < self.max_frames_missing  # Warunek usunięcia
-        ]
+        removed = self.store.remove_missing(self.max_frames_missing)
+        for slot in removed:
+            del self.car_views[slot]
+        self.track_stats["dropped_tracks"] += len(removed)
 
     def increment_missing_frames(self):
         """
         Zwiększa licznik zgubionych pozycji każdego pojazdu.
         """
-        for car in self.cars:
-            car.increment_frames_since_seen()
+        self.store.increment_missing_frames()
 
-    def draw_cars(self, frame):
+    def _detected_slots(self):
+        """
+        Indeksy wykrytych pojazdów w kolejności dodania
+        """
+        store = self.store
+        slots = np.flatnonzero(store.active & store.is_detected)
+        return slots[np.argsort(store.ids[slots], kind="stable")]
+
+    def _display_position(self, slot):
+        position = self.car_views[slot].position
+        if slot in self.display_positions:
+            return self.display_positions[slot] + position[2:]
+        return position
+
+    def get_draw_state(self):
+        """
+        Zapamiętanie stanu potrzebnego do rysowania, niezależnego od dalszych aktualizacji pojazdów
+        """
+        store = self.store
+        cars = [
+            (int(store.ids[slot]), VEHICLE_TYPES[store.types[slot]], self._display_position(slot),
+             store.get_approximated(slot).copy(), float(store.real_speed[slot]), int(store.frames_since_seen[slot]))
+            for slot in self._detected_slots()
+        ]
+        return self.drone_real_height, self.car_counter, cars
+
+    def draw_cars(self, frame, draw_state=None, resolution_scale=1.0):
         """
         Rysowanie pojazdów na klatce nagrania
+        Args:
+            resolution_scale: Stosunek rozdzielczości klatki do rozdzielczości nagrania (rysowanie na pomniejszonej klatce)
         """
-        scale = 2
-
-        # Rysowanie wysokości drona
-        text = f"Altitude: {self.drone_real_height:.1f} m"
-        cv2.putText(frame, text, (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (255, 255, 255), 6 * scale, cv2.LINE_AA)
-        cv2.putText(frame, text, (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (189, 114, 0), 2 * scale, cv2.LINE_AA)
-
-        # Rysowanie licznika pojazdów
-        text = f"Car Counter: {self.car_counter}"
-        cv2.putText(frame, text, (600, 80), cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (255, 255, 255), 6 * scale, cv2.LINE_AA)
-        cv2.putText(frame, text, (600, 80), cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (189, 114, 0), 2 * scale, cv2.LINE_AA)    
-        
-        # Rysowanie ramek i ściezki ruchu dla pojazdów
-        for car in self.cars:
-            if not car.is_detected:
-               continue
-
-            # Rysowanie ścieżki ruchu pojazdu
-            if len(car.approximated_positions) > 1:
-                points = [tuple(map(int, pos[:2])) for pos in car.approximated_positions]
-                for p1, p2 in zip(points[:-1], points[1:]):
-                    cv2.line(frame, p1, p2, [48, 172, 119], 3 * scale)
-
-            x_center, y_center, width, height, theta = map(float, car.position)
-            rect = ((x_center, y_center), (width, height), theta)
-            box_points = cv2.boxPoints(rect).astype(int)    # Konwersja z (x, y, szerokość, wysokość, kąt) na pozycje wierzchołków prostokąta 
-            color = [189, 114, 0] if car.vehicle_type == 'small' else [25, 83, 217]
-            cv2.drawContours(frame, [box_points], 0, color, 3 * scale)
-
-            #Przygotowanie danych o pojazdach
-            car_data = f"ID: {car.id} | Speed: {car.real_speed:.0f} km/h"
-            additional_info = f"Type: {car.vehicle_type} Lost: {car.frames_since_seen}"
-            
-            car_data_position = (int(x_center - 300), int(y_center - 60 * scale))
-            additional_info_position = (int(x_center - 300), int(y_center - 30 * scale))
-            
-            # Wyświetlanie danych o pojazdach
-            cv2.putText(frame, car_data, car_data_position, cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (255, 255, 255), 6 * scale, cv2.LINE_AA)
-            cv2.putText(frame, car_data, car_data_position, cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, color, 2 * scale, cv2.LINE_AA)
-
-            cv2.putText(frame, additional_info, additional_info_position, cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, (255, 255, 255), 6 * scale, cv2.LINE_AA)
-            cv2.putText(frame, additional_info, additional_info_position, cv2.FONT_HERSHEY_SIMPLEX, 1 * scale, color, 2 * scale, cv2.LINE_AA)
-
-        return frame
+        if draw_state is None:
+            draw_state = self.get_draw_state()
+        return self.renderer.draw(frame, draw_state, resolution_scale)
+
+    def get_measured_tracks(self):
+        """
+        Pojazdy z pozycją zmierzoną w bieżącej klatce: identyfikatory, typy, pozycje, prędkości chwilowe i uśrednione
+        """
+        store = self.store
+        slots = np.flatnonzero(store.active & (store.frames_since_seen == 0))
+        slots = slots[np.argsort(store.ids[slots], kind="stable")]
+        types = np.array(VEHICLE_TYPES)[store.types[slots]]
+        return store.ids[slots], types, store.current_positions(slots), store.speed[slots], store.real_speed[slots]
+
+    def is_tracked(self, car_id):
+        """
+        Sprawdzenie, czy pojazd jest nadal śledzony (historia prędkości pojazdu, który opuścił kadr, już się nie zmienia)
+        """
+        store = self.store
+        return bool(np.any(store.active & (store.ids == car_id)))
 
     def get_car_by_id(self, car_id):
-        return next((car for car in self.cars if car.id == car_id and car.is_detected), None)
+        store = self.store
+        slots = np.flatnonzero(store.active & store.is_detected & (store.ids == car_id))
+        return self.car_views[slots[0]] if len(slots) else None
 
 
+    def _spill_history(self, slot, speeds, final):
+        """
+        Zapis starszej lub zakończonej historii prędkości pojazdu do archiwum
+        """
+        self.archive.append(int(self.store.ids[slot]), int(self.store.types[slot]), speeds, final)
+
     def get_speed_history(self, car_id):
+        """
+        Pełna historia prędkości uśrednionej pojazdu - część zapisana w archiwum jest odczytywana z dysku,
+        również dla pojazdów, których śledzenie zostało zakończone
+        """
         car = self.get_car_by_id(car_id)
-        return car.real_speed_history if car else None
+        archived = self.archive.read(car_id).tolist() if self.archive is not None else []
+        if car is None:
+            return archived or None
+        return archived + car.real_speed_history
+
+    def get_state(self):
+        """
+        Stan śledzenia do zapisu punktu kontrolnego
+        """
+        display_slots = np.array(list(self.display_positions), dtype=np.int64)
+        display_xy = np.array(list(self.display_positions.values()), dtype=float).reshape(-1, 2)
+        return {
+            "store": self.store.get_state(),
+            "next_id": self.next_id,
+            "car_counter": self.car_counter,
+            "track_stats": dict(self.track_stats),
+            "display_slots": display_slots,
+            "display_xy": display_xy,
+        }
+
+    def set_state(self, state):
+        """
+        Odtworzenie stanu śledzenia z punktu kontrolnego
+        """
+        self.store.set_state(state["store"])
+        self.car_views = {int(slot): Car.view(self.store, int(slot)) for slot in self.store.active_slots()}
+        self.display_positions = {int(slot): tuple(xy) for slot, xy in zip(state["display_slots"], state["display_xy"].tolist())}
+        self.next_id = state["next_id"]
+        self.car_counter = state["car_counter"]
+        self.track_stats = {name: state["track_stats"].get(name, 0) for name in self.track_stats}  # Bez usuniętych liczników
+
+    def close(self):
+        """
+        Zapis historii wszystkich śledzonych pojazdów do archiwum i zamknięcie pliku
+        """
+        if self.archive is None:
+            return
+        for slot in np.flatnonzero(self.store.active & (self.store.real_speed_totals > 0)):
+            self.store.spill_history(slot, final=True)
+        self.archive.close()
+
+    def get_average_speed(self, min_history=2):
+        """
+        Średnia prędkość i liczba wykrytych pojazdów z co najmniej min_history pomiarami prędkości uśrednionej
+        """
+        store = self.store
+        slots = [slot for slot in self._detected_slots() if store.real_speed_totals[slot] > min_history]
+        if not slots:
+            return 0.0, 0
+        return float(np.mean(store.real_speed[slots])), len(slots)
 
     def get_traffic_density(self):
-        detected_cars = [car for car in self.cars if car.is_detected]
-        return len(detected_cars) / max(1, self.fps)
+        detected_cars = np.count_nonzero(self.store.active & self.store.is_detected)
+        return detected_cars / max(1, self.fps)
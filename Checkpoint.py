@@ -0,0 +1,62 @@
+import json
+import os
+import numpy as np
+
+CHECKPOINT_VERSION = 2 # 2 - wyniki analizy zapisywane przed punktem kontrolnym (bez buforowanych wierszy)
+CHECKPOINT_INTERVAL = 5 # Domyślny odstęp pomiędzy punktami kontrolnymi w sekundach
+
+_SCALARS = "__state__"  # Nazwa tablicy z wartościami skalarnymi zapisanymi jako JSON
+
+
+def _split(state, prefix, arrays):
+    """
+    Rozdzielenie zagnieżdżonego słownika stanu na tablice NumPy (klucze "a/b/c") i wartości skalarne (JSON)
+    """
+    scalars = {}
+    for key, value in state.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            scalars[key] = _split(value, name + "/", arrays)
+        elif isinstance(value, np.ndarray):
+            arrays[name] = value
+        elif isinstance(value, np.generic):
+            scalars[key] = value.item()
+        else:
+            scalars[key] = value
+    return scalars
+
+
+def save_checkpoint(path, state):
+    """
+    Atomowy zapis stanu przetwarzania - plik tymczasowy zastępuje poprzedni punkt kontrolny dopiero po pełnym zapisie
+    Args:
+        state: Zagnieżdżony słownik tablic NumPy i wartości zapisywalnych w JSON
+    """
+    arrays = {}
+    scalars = _split(dict(state, version=CHECKPOINT_VERSION), "", arrays)
+    arrays[_SCALARS] = np.array(json.dumps(scalars))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **arrays)    # Bez kompresji - zapis ma być tani
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Odczyt stanu zapisanego przez save_checkpoint
+    """
+    with np.load(path, allow_pickle=False) as data:
+        state = json.loads(str(data[_SCALARS]))
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {path}")
+        for name in data.files:
+            if name == _SCALARS:
+                continue
+            *parents, key = name.split("/")
+            target = state
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[key] = data[name]
+    return state
@@ -0,0 +1,170 @@
+import glob
+import hashlib
+import json
+import math
+import os
+import uuid
+from threading import Lock
+import numpy as np
+from DetectorBackend import weights_hash
+
+DEFAULT_DETECTION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "carspeed", "detections")
+# Wiersz pliku detekcji: obrócona ramka (środek, wymiary, kąt w radianach), pewność i klasa
+ROW_DTYPE = np.dtype([("xywhr", "<f4", (5,)), ("conf", "<f4"), ("cls", "u1")])
+HASH_CHUNKS = 16    # Liczba fragmentów nagrania uwzględnianych w skrócie zawartości
+HASH_CHUNK_SIZE = 1024 * 1024
+VEHICLE_CLASSES = {9: 'large', 10: 'small'}  # Klasy modelu odpowiadające pojazdom
+
+
+def arrays_to_detections(xywhr, classes):
+    """
+    Zamiana tablic detekcji na listę (pozycja, typ pojazdu) - kąt w stopniach, pominięte klasy inne niż pojazdy
+    """
+    detections = []
+    for (x_center, y_center, width, height, theta), class_id in zip(xywhr, classes):
+        vehicle_type = VEHICLE_CLASSES.get(int(class_id))
+        if not vehicle_type:
+            continue
+        position = (x_center, y_center, width, height, math.degrees(theta))
+        detections.append((position, vehicle_type))
+    return detections
+
+
+def video_hash(video_path):
+    """
+    Skrót zawartości nagrania z jego rozmiaru i fragmentów rozłożonych równomiernie w pliku
+    (odczyt całego wielogigabajtowego nagrania trwałby dłużej niż ponowna analiza)
+    """
+    size = os.path.getsize(video_path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(video_path, "rb") as file:
+        for offset in np.linspace(0, max(size - HASH_CHUNK_SIZE, 0), HASH_CHUNKS).astype(np.int64):
+            file.seek(int(offset))
+            digest.update(file.read(HASH_CHUNK_SIZE))
+    return digest.hexdigest()[:16]
+
+
+def cache_key(video_path, model_path, conf, imgsz, **options):
+    """
+    Klucz pamięci podręcznej - zawartość nagrania, wagi modelu, próg pewności, rozdzielczość wejściowa
+    i pozostałe ustawienia wpływające na detekcje (silnik wnioskowania, kafle)
+    """
+    key = dict(options, video=video_hash(video_path), weights=weights_hash(model_path), conf=conf, imgsz=imgsz)
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class DetectionCache:
+    """
+    Trwała pamięć podręczna surowych detekcji (xywhr, pewność, klasa) kolejnych klatek nagrania.
+    Każde przetwarzanie dopisuje własną część (part-*.rows z wierszami i part-*.index.npz z indeksem klatek),
+    więc fragmenty jednego nagrania mogą być przetwarzane równolegle. Wiersze odczytywane są z plików mapowanych
+    w pamięci z dostępem do dowolnej klatki
+    """
+    def __init__(self, directory, total_frames):
+        """
+        Args:
+            directory: Katalog pamięci podręcznej nagrania (DEFAULT_DETECTION_CACHE/<nazwa nagrania>-<cache_key>)
+            total_frames: Liczba klatek nagrania
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.frame_parts = np.full(total_frames, -1, dtype=np.int32)   # Część zawierająca detekcje klatki (-1 - brak)
+        self.frame_starts = np.zeros(total_frames, dtype=np.int64)
+        self.frame_counts = np.zeros(total_frames, dtype=np.int32)
+        self.parts = []
+        self.frame_count = None # Rzeczywista liczba klatek nagrania (znana, jeżeli przetwarzanie doszło do końca)
+        for index_path in sorted(glob.glob(os.path.join(directory, "part-*.index.npz"))):
+            self._load_part(index_path[:-len(".index.npz")])
+
+        # Część zapisywana przez bieżące przetwarzanie
+        self.name = os.path.join(directory, f"part-{uuid.uuid4().hex[:12]}")
+        self.file = None
+        self.rows = 0
+        self.new_frames, self.new_starts, self.new_counts = [], [], []
+        self.saved_frames = 0   # Liczba klatek zapisanych w indeksie bieżącej części
+        self.lock = Lock()  # put (wątek detekcji) i flush (punkt kontrolny w wątku śledzenia) w trybie potokowym
+
+    def _load_part(self, name):
+        with np.load(name + ".index.npz") as index:
+            frames, starts, counts = index["frames"], index["starts"], index["counts"]
+            frame_count = int(index["frame_count"])
+        rows = os.path.getsize(name + ".rows") // ROW_DTYPE.itemsize if os.path.exists(name + ".rows") else 0
+        # Pominięcie klatek spoza nagrania, niekompletnych wierszy i klatek zapisanych już w innej części
+        valid = (frames < len(self.frame_parts)) & (starts + counts <= rows)
+        frames, starts, counts = frames[valid], starts[valid], counts[valid]
+        valid = self.frame_parts[frames] < 0
+        self.frame_parts[frames[valid]] = len(self.parts)
+        self.frame_starts[frames[valid]] = starts[valid]
+        self.frame_counts[frames[valid]] = counts[valid]
+        self.parts.append(np.memmap(name + ".rows", dtype=ROW_DTYPE, mode="r", shape=(rows,)) if rows else None)
+        if frame_count >= 0:
+            self.frame_count = frame_count
+
+    def __len__(self):
+        return int(np.count_nonzero(self.frame_parts >= 0))
+
+    def is_complete(self):
+        """
+        Sprawdzenie, czy zapisane są detekcje wszystkich klatek nagrania (np. po przetwarzaniu z odstępem między
+        detekcjami brakuje klatek bez detekcji)
+        """
+        return (self.frame_count is not None and self.frame_count <= len(self.frame_parts)
+                and bool(np.all(self.frame_parts[:self.frame_count] >= 0)))
+
+    def get(self, frame_idx):
+        """
+        Detekcje klatki (xywhr, pewność, klasa) lub None, jeżeli klatka nie była przetwarzana przez model
+        """
+        if frame_idx >= len(self.frame_parts) or self.frame_parts[frame_idx] < 0:
+            return None
+        start = self.frame_starts[frame_idx]
+        rows = self.parts[self.frame_parts[frame_idx]][start:start + self.frame_counts[frame_idx]] \
+            if self.frame_counts[frame_idx] else np.zeros(0, dtype=ROW_DTYPE)
+        return rows["xywhr"].astype(float), rows["conf"].astype(float), rows["cls"].astype(int)
+
+    def put(self, frame_idx, xywhr, confidences, classes):
+        """
+        Dopisanie detekcji klatki do bieżącej części
+        """
+        rows = np.zeros(len(xywhr), dtype=ROW_DTYPE)
+        rows["xywhr"], rows["conf"], rows["cls"] = xywhr, confidences, classes
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.name + ".rows", "ab")
+            self.file.write(rows.tobytes())
+            self.new_frames.append(frame_idx)
+            self.new_starts.append(self.rows)
+            self.new_counts.append(len(rows))
+            self.rows += len(rows)
+
+    def flush(self, frame_count=None):
+        """
+        Zapis indeksu bieżącej części (atomowo - niekompletny indeks nigdy nie jest odczytywany)
+        Args:
+            frame_count: Rzeczywista liczba klatek nagrania, jeżeli przetwarzanie doszło do końca
+        """
+        with self.lock:
+            # Spójny stan indeksu - wiersze wszystkich klatek indeksu są zapisane w pliku przed zapisem indeksu
+            if len(self.new_frames) == self.saved_frames and frame_count in (None, self.frame_count):
+                return
+            if frame_count is not None:
+                self.frame_count = frame_count
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())    # Pod blokadą - close może równolegle zamknąć plik
+            frames = np.array(self.new_frames, dtype=np.int64)
+            starts = np.array(self.new_starts, dtype=np.int64)
+            counts = np.array(self.new_counts, dtype=np.int32)
+            saved_frame_count = -1 if self.frame_count is None else self.frame_count
+        tmp_path = f"{self.name}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, frames=frames, starts=starts, counts=counts, frame_count=saved_frame_count)
+        os.replace(tmp_path, self.name + ".index.npz")
+        with self.lock:
+            self.saved_frames = max(self.saved_frames, len(frames))
+
+    def close(self, frame_count=None):
+        self.flush(frame_count)
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
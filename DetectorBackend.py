@@ -0,0 +1,177 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+import yaml
+
+BACKENDS = ("torch", "onnx", "openvino")
+DEFAULT_MODEL_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "carspeed", "models")
+CALIBRATION_FRAMES = 64 # Liczba klatek nagrania używanych do kalibracji kwantyzacji INT8
+WARMUP_RUNS = 2 # Liczba wywołań modelu przy ładowaniu (alokacja pamięci i optymalizacja grafu poza pomiarem)
+LETTERBOX_COLOR = 114   # Kolor wypełnienia klatki do kwadratu (jak w ultralytics)
+
+
+def weights_hash(model_path):
+    """
+    Skrót SHA-256 pliku wag modelu - klucz wyeksportowanych modeli w pamięci podręcznej
+    """
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def exported_path(model_path, backend, imgsz, int8=False, cache_dir=DEFAULT_MODEL_CACHE):
+    """
+    Ścieżka wyeksportowanego modelu w pamięci podręcznej (plik .onnx lub katalog OpenVINO)
+    """
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    name = f"{stem}-{weights_hash(model_path)}-{imgsz}" + ("-int8" if int8 else "")
+    if backend == "onnx":
+        return os.path.join(cache_dir, name + ".onnx")
+    if backend == "openvino":
+        return os.path.join(cache_dir, name + "_openvino_model")    # Przyrostek rozpoznawany przez ultralytics
+    raise ValueError(f"Unknown detector backend: {backend}")
+
+
+def sample_frames(video_path, count=CALIBRATION_FRAMES):
+    """
+    Klatki rozłożone równomiernie w całym nagraniu (kalibracja kwantyzacji i porównanie detekcji)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Failed to open the video: {video_path}")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for index in np.unique(np.linspace(0, max(total_frames - 1, 0), count).astype(int)):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+def letterbox(frame, imgsz):
+    """
+    Tensor wejściowy modelu (1, 3, imgsz, imgsz) float32 RGB - skalowanie z zachowaniem proporcji i wypełnieniem
+    do kwadratu, tak jak przy wnioskowaniu ultralytics dla modeli wyeksportowanych
+    """
+    height, width = frame.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+    left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+    frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(LETTERBOX_COLOR,) * 3)
+    return np.ascontiguousarray(frame[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+
+class FrameCalibrationReader:
+    """
+    Dane kalibracyjne kwantyzacji statycznej ONNX Runtime (interfejs CalibrationDataReader) z klatek nagrania
+    """
+    def __init__(self, input_name, frames, imgsz):
+        self.input_name = input_name
+        self.frames = iter(frames)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        frame = next(self.frames, None)
+        return None if frame is None else {self.input_name: letterbox(frame, self.imgsz)}
+
+    def rewind(self):
+        pass
+
+
+def _quantize_onnx(path, frames, imgsz):
+    """
+    Kwantyzacja statyczna INT8 (wagi i aktywacje warstw splotowych) skalibrowana na klatkach nagrania
+    """
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    quantized_path = os.path.splitext(path)[0] + "-int8.onnx"
+    source = onnx.load(path)
+    reader = FrameCalibrationReader(source.graph.input[0].name, frames, imgsz)
+    # Tylko sploty - dekodowanie ramek w głowicy modelu pozostaje w float32
+    quantize_static(path, quantized_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                    weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8, op_types_to_quantize=["Conv"])
+    quantized = onnx.load(quantized_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)  # Klasy, stride i imgsz odczytywane przez ultralytics
+    onnx.save(quantized, quantized_path)
+    return quantized_path
+
+
+def _calibration_dataset(directory, frames, names):
+    """
+    Zbiór danych z klatek nagrania w formacie ultralytics (kalibracja NNCF przy eksporcie OpenVINO INT8)
+    """
+    images = os.path.join(directory, "calibration", "images")
+    os.makedirs(images, exist_ok=True)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(images, f"{i:05d}.jpg"), frame)
+    data = os.path.join(directory, "calibration.yaml")
+    with open(data, "w") as file:
+        yaml.safe_dump({"path": os.path.join(directory, "calibration"), "train": "images", "val": "images",
+                        "names": dict(names)}, file)
+    return data
+
+
+def export_model(model_path, backend, imgsz, int8=False, calibration_video=None,
+                 calibration_frames=CALIBRATION_FRAMES, cache_dir=DEFAULT_MODEL_CACHE):
+    """
+    Jednorazowy eksport modelu YOLO OBB do ONNX lub OpenVINO (opcjonalnie INT8) do pamięci podręcznej
+    Args:
+        backend: "onnx" lub "openvino"
+        imgsz: Rozdzielczość wejściowa modelu
+        int8: Kwantyzacja INT8 kalibrowana na klatkach nagrania calibration_video
+        calibration_frames: Liczba klatek kalibracyjnych
+    Returns:
+        Ścieżka wyeksportowanego modelu (model istniejący w pamięci podręcznej nie jest eksportowany ponownie)
+    """
+    target = exported_path(model_path, backend, imgsz, int8, cache_dir)
+    if os.path.exists(target):
+        return target
+    if int8 and not calibration_video:
+        raise ValueError("INT8 quantization requires a calibration video")
+    from ultralytics import YOLO
+
+    os.makedirs(cache_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".export-", dir=cache_dir)
+    try:
+        weights = os.path.join(work_dir, os.path.basename(model_path))
+        shutil.copy(model_path, weights)    # Ultralytics zapisuje wynik eksportu obok pliku wag
+        model = YOLO(weights, task="obb")
+        frames = sample_frames(calibration_video, calibration_frames) if int8 else None
+        if backend == "onnx":
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=False)   # Dowolny rozmiar paczki
+            if int8:
+                exported = _quantize_onnx(exported, frames, imgsz)
+        else:
+            data = _calibration_dataset(work_dir, frames, model.names) if int8 else None
+            exported = model.export(format="openvino", imgsz=imgsz, int8=int8, data=data)
+        # Zapis pod docelową nazwą dopiero po pełnym eksporcie (równoległy eksport w innym procesie nie psuje wyniku)
+        try:
+            os.rename(exported, target)
+        except OSError:
+            if not os.path.exists(target):
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return target
+
+
+def warm_up(model, imgsz, conf, batch_size=1, runs=WARMUP_RUNS):
+    """
+    Wywołania modelu na pustych klatkach przy ładowaniu - pierwsza klatka nagrania nie płaci za inicjalizację
+    """
+    frames = [np.full((imgsz, imgsz, 3), LETTERBOX_COLOR, dtype=np.uint8)] * batch_size
+    for _ in range(runs):
+        model(frames, conf=conf, imgsz=imgsz, stream=False, verbose=False)
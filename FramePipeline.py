@@ -0,0 +1,227 @@
+from threading import Thread, Event, Condition
+from queue import Queue, Empty, Full
+
+_END = object()    # Znacznik końca nagrania przekazywany między etapami
+_DEFERRED = object()   # Detekcja klatki wykonywana w etapie śledzenia (odstęp między detekcjami zależy od śledzenia)
+
+
+class _StageError:
+    """
+    Wyjątek z etapu potoku przekazywany dalej do odbiorcy klatek
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+class FramePipeline:
+    """
+    Potokowe przetwarzanie nagrania: dekodowanie -> detekcja -> śledzenie -> rysowanie -> zapis.
+    Każdy etap działa w osobnym wątku, a etapy są połączone ograniczonymi kolejkami
+    """
+    def __init__(self, video_processor, output_writer=None, queue_size=4):
+        """
+        Args:
+            video_processor: Obiekt VideoProcessor z otwartym nagraniem
+            output_writer: Opcjonalny obiekt zapisu nagrania (cv2.VideoWriter)
+            queue_size: Maksymalna liczba klatek oczekujących pomiędzy etapami
+        """
+        self.video_processor = video_processor
+        self.output_writer = output_writer
+        self.queue_size = queue_size
+        self.stop_event = Event()
+        self.drain_event = Event()  # Koniec odczytu - klatki w kolejkach są przetwarzane i zapisywane do końca
+        self.written = Condition()
+        self.tracked_frames = 0
+        self.written_frames = 0 # Klatki przekazane do zapisu (etap zapisu)
+        self.threads = []
+        self.output_queue = None
+        self.finished = False
+
+    def start(self):
+        """
+        Uruchomienie wątków wszystkich etapów
+        """
+        if self.threads:
+            return
+        vp = self.video_processor
+        decoded = Queue(maxsize=self.queue_size)
+        detected = Queue(maxsize=self.queue_size)
+        tracked = Queue(maxsize=self.queue_size)
+        rendered = Queue(maxsize=self.queue_size)
+        self.output_queue = Queue(maxsize=self.queue_size)
+
+        stages = [
+            (self._decode_stage, (decoded,)),
+            (self._detect_stage, (decoded, detected)),
+            (self._map_stage, (detected, tracked, self._track)),
+            (self._map_stage, (tracked, rendered, lambda item: vp.render(*item))),
+            (self._map_stage, (rendered, self.output_queue, self._encode)),
+        ]
+        for target, args in stages:
+            thread = Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _track(self, item):
+        """
+        Etap śledzenia - wykonywany sekwencyjnie, w kolejności klatek
+        """
+        frame, detections = item
+        vp = self.video_processor
+        if vp.checkpoint_due() and self._wait_written():
+            vp.save_checkpoint()    # Wszystkie śledzone klatki zostały zapisane - po wznowieniu nagranie jest ciągłe
+        if detections is _DEFERRED:
+            # Decyzja o detekcji po śledzeniu poprzedniej klatki (jak w przetwarzaniu sekwencyjnym)
+            detections = vp.detect_batch([frame], [vp.current_frame_idx])[0] if vp.is_keyframe() else None
+        vp.track(detections, frame)
+        self.tracked_frames += 1
+        return frame, vp.car_container.get_draw_state() if vp.overlay else None
+
+    def _wait_written(self):
+        """
+        Oczekiwanie, aż etapy rysowania i zapisu przekażą do zapisu wszystkie śledzone klatki
+        Returns:
+            False, jeżeli potok został zatrzymany
+        """
+        with self.written:
+            while self.written_frames < self.tracked_frames:
+                if self.stop_event.is_set():
+                    return False
+                self.written.wait(0.1)
+        return True
+
+    def _encode(self, frame):
+        if self.output_writer:
+            with self.video_processor.profiler.stage("write"):
+                self.output_writer.write(frame)
+        with self.written:
+            self.written_frames += 1
+            self.written.notify_all()
+        return frame
+
+    def _put(self, queue, item):
+        """
+        Wstawienie elementu do kolejki z blokowaniem (przeciwciśnienie) do momentu zatrzymania potoku
+        """
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, queue):
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return _END
+
+    def _decode_stage(self, out_queue):
+        try:
+            while not self.stop_event.is_set() and not self.drain_event.is_set():
+                frame = self.video_processor.read_frame()
+                if frame is None:
+                    break
+                if not self._put(out_queue, frame):
+                    return
+        except Exception as e:
+            self._put(out_queue, _StageError(e))
+            return
+        self._put(out_queue, _END)
+
+    def _detect_stage(self, in_queue, out_queue):
+        """
+        Etap detekcji - klatki zbierane są w paczki o rozmiarze batch_size i przetwarzane jednym wywołaniem modelu.
+        Przy detection_stride > 1 odstęp między detekcjami zależy od stanu śledzenia, więc klatki kluczowe
+        wybierane są i przetwarzane w etapie śledzenia
+        """
+        batch_size = getattr(self.video_processor, "batch_size", 1)
+        deferred = getattr(self.video_processor, "detection_stride", 1) > 1
+        frame_idx = getattr(self.video_processor, "start_frame", 0)  # Indeks kolejnej klatki w nagraniu
+        finished = False
+        while not finished:
+            frames = []
+            while len(frames) < batch_size:
+                item = self._get(in_queue)
+                if item is _END or isinstance(item, _StageError):
+                    finished = True
+                    break
+                frames.append(item)
+            if frames and deferred:
+                for frame in frames:
+                    if not self._put(out_queue, (frame, _DEFERRED)):
+                        return
+            elif frames:
+                try:
+                    # Model przetwarza tylko klatki kluczowe, pozostałe otrzymują detekcje None
+                    keyframes = [self.video_processor.is_keyframe() for _ in frames]
+                    indices = [frame_idx + i for i, key in enumerate(keyframes) if key]
+                    frame_idx += len(frames)
+                    keyframe_detections = iter(self.video_processor.detect_batch([f for f, key in zip(frames, keyframes) if key], indices) if indices else [])
+                    detections = [next(keyframe_detections) if key else None for key in keyframes]
+                except Exception as e:
+                    self._put(out_queue, _StageError(e))
+                    return
+                for result in zip(frames, detections):
+                    if not self._put(out_queue, result):
+                        return
+        self._put(out_queue, item)  # Przekazanie końca nagrania lub błędu do kolejnego etapu
+
+    def _map_stage(self, in_queue, out_queue, function):
+        while True:
+            item = self._get(in_queue)
+            if item is _END or isinstance(item, _StageError):
+                self._put(out_queue, item)  # Przekazanie końca nagrania lub błędu do kolejnego etapu
+                return
+            try:
+                result = function(item)
+            except Exception as e:
+                self._put(out_queue, _StageError(e))
+                return
+            if not self._put(out_queue, result):
+                return
+
+    def process_frame(self):
+        """
+        Pobranie kolejnej przetworzonej klatki - ten sam interfejs co VideoProcessor.process_frame
+        """
+        if self.finished:
+            return None, False
+        self.start()
+        item = self._get(self.output_queue)
+        if item is _END:
+            self.finished = True
+            return None, False
+        if isinstance(item, _StageError):
+            self.finished = True
+            self.stop()
+            raise item.error
+        return item, True
+
+    def __iter__(self):
+        while True:
+            frame, is_frame_available = self.process_frame()
+            if not is_frame_available:
+                return
+            yield frame
+
+    def stop(self):
+        """
+        Zatrzymanie wszystkich etapów i oczekiwanie na zakończenie wątków. Przed zatrzymaniem odczyt jest kończony,
+        a klatki już odczytane przechodzą przez wszystkie etapy, więc punkt kontrolny zapisany w VideoProcessor.finish
+        odpowiada ostatniej zapisanej klatce
+        """
+        if self.threads and not self.finished:
+            self.drain_event.set()
+            item = None
+            while item is not _END and not isinstance(item, _StageError):
+                item = self._get(self.output_queue) # Klatki wyjściowe są pomijane (przetwarzanie zatrzymane)
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+        self.finished = True
+        self.video_processor.unwritten_frames = self.tracked_frames - self.written_frames
@@ -1,8 +1,17 @@
 import requests
 import pyproj
 import math
+import os
+import io
+import tempfile
+import json
 import numpy as np
 
+WCS_URL = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/NMT/GRID1/WCS/DigitalTerrainModel"
+TILE_SIZE = 256 # Rozmiar kafla numerycznego modelu terenu w metrach (siatka 1 m w EPSG:2180)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "carspeed", "dtm")
+GRID_CHUNK_SIZE = 4 * 1024 ** 2  # Rozmiar fragmentu tekstu wczytywanego jednorazowo z pliku ASCII Grid
+
 def transform_coordinates(coordinates, source_epsg="EPSG:4326", target_epsg="EPSG:2180"):
     """
     Przekształcanie współrzędnych z jednego układu na inny
@@ -29,11 +38,10 @@ def calculate_dimensions(bbox):
     height = math.ceil(bbox_height)
     return width, height
 
-def generate_wcs_url(bbox, width, height, coverage_id="DTM_PL-EVRF2007-NH", crs="EPSG:2180"):
+def generate_wcs_url(bbox, width, height, coverage_id="DTM_PL-EVRF2007-NH", crs="EPSG:2180", base_url=WCS_URL):
     """
     Generowanie URL w celu pobrania danych wysokości
     """
-    base_url = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/NMT/GRID1/WCS/DigitalTerrainModel"
     params = {
         "SERVICE": "WCS",
         "VERSION": "1.0.0",
@@ -49,36 +57,253 @@ def generate_wcs_url(bbox, width, height, coverage_id="DTM_PL-EVRF2007-NH", crs=
     response_url = f"{base_url}?" + "&".join([f"{key}={value}" for key, value in params.items()])
     return response_url
 
-def download_ascii_grid(url, output_file="heights.asc"):
+def read_ascii_grid(file):
     """
-    Pobranie numerycznego modelu terenu z podanego URL i zapis do pliku
+    Wczytanie nagłówka i macierzy wysokości z otwartego pliku ASCII Grid.
+    Dane są parsowane fragmentami bezpośrednio do tablicy float32, a wartości nodata zamieniane na NaN
     """
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(output_file, "w") as file:
-            file.write(response.text)
-        print(f"Downloaded NMT")
-    else:
-        raise Exception(f"Download error: {response.status_code}, {response.text}")
+    header = {}
+    line = file.readline()
+    while line:
+        parts = line.split()
+        if parts and not parts[0][0].isalpha():  # Pierwsza linia danych
+            break
+        if parts:
+            header[parts[0].lower()] = float(parts[1])
+        line = file.readline()
+
+    # Ujednolicenie georeferencji do lewego dolnego narożnika
+    cellsize = header["cellsize"]
+    if "xllcenter" in header:
+        header["xllcorner"] = header.pop("xllcenter") - cellsize / 2
+    if "yllcenter" in header:
+        header["yllcorner"] = header.pop("yllcenter") - cellsize / 2
+
+    rows, cols = int(header["nrows"]), int(header["ncols"])
+    data = np.empty(rows * cols, dtype=np.float32)
+    filled = 0
+    remainder = line    # Pierwsza linia danych została już odczytana
+    while True:
+        chunk = file.read(GRID_CHUNK_SIZE)
+        text = remainder + chunk
+        if chunk:
+            split = max(text.rfind(" "), text.rfind("\n"))  # Ostatnia liczba może być niepełna
+            text, remainder = text[:split + 1], text[split + 1:]
+        values = np.fromstring(text, dtype=np.float32, sep=" ")
+        data[filled:filled + len(values)] = values
+        filled += len(values)
+        if not chunk:
+            break
+    if filled != rows * cols:
+        raise ValueError(f"Expected {rows * cols} values in ASCII Grid, got {filled}")
+
+    data = data.reshape(rows, cols)
+    if "nodata_value" in header:
+        data[data == np.float32(header["nodata_value"])] = np.nan
+    return header, data
+
+def load_ascii_grid(file_path):
+    """
+    Wczytanie pliku ASCII Grid z jednorazową konwersją do formatu binarnego (.npy odczytywany przez mmap)
+    """
+    binary_path = file_path + ".npy"
+    header_path = file_path + ".json"
+    if (os.path.isfile(binary_path) and os.path.isfile(header_path)
+            and os.path.getmtime(binary_path) >= os.path.getmtime(file_path)):
+        with open(header_path, 'r') as file:
+            header = json.load(file)
+        return header, np.load(binary_path, mmap_mode='r')
+
+    with open(file_path, 'r') as file:
+        header, data = read_ascii_grid(file)
+    try:
+        # Zapis atomowy, nagłówek przed macierzą - przerwany zapis nie pozostawia niepełnego pliku .npy,
+        # a aktualny plik .npy zawsze ma odpowiadający mu nagłówek
+        _replace_file(header_path, lambda file: file.write(json.dumps(header).encode()))
+        _replace_file(binary_path, lambda file: np.save(file, data))
+    except OSError as e:
+        print(f"Could not save binary grid: {e}")
+    return header, data
 
-def parse_ascii_grid(file_path, coordinates, bbox):
+def _replace_file(path, write):
     """
-    Przypisanie wysokości odpowiednio dla listy lokalizacji drona
+    Zapis do pliku tymczasowego w tym samym katalogu i zastąpienie nim pliku docelowego
     """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
     try:
-        with open(file_path, 'r') as file:
-            header = {}
-            for _ in range(6):
-                line = file.readline().strip()
-                key, value = line.split()
-                header[key.lower()] = float(value)
-            data = np.loadtxt(file) # Wczytanie danych wysokości w formie macierzy
-        heights = []
-        for x, y in coordinates:
-            col = int(math.floor(x - bbox[0]))
-            row = int(math.floor(bbox[3] - y))
-            heights.append(data[row, col])  # Pobranie wysokości dla danej współrzędnej
-        return heights
-    except Exception as e:
-        print(f"Error parsing ASCII Grid file: {e}")
-        return []
\ No newline at end of file
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def sample_grid(header, data, coordinates, interpolate=False):
+    """
+    Odczyt wysokości dla wszystkich współrzędnych jednocześnie (najbliższa komórka lub interpolacja dwuliniowa)
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    rows, cols = data.shape
+    cellsize = header["cellsize"]
+    x_min = header["xllcorner"]
+    y_max = header["yllcorner"] + rows * cellsize
+    col = (coordinates[:, 0] - x_min) / cellsize
+    row = (y_max - coordinates[:, 1]) / cellsize
+    if not interpolate:
+        row = np.clip(np.floor(row).astype(int), 0, rows - 1)
+        col = np.clip(np.floor(col).astype(int), 0, cols - 1)
+        return np.asarray(data[row, col], dtype=float)
+
+    # Interpolacja pomiędzy środkami czterech sąsiednich komórek
+    col = np.clip(col - 0.5, 0, cols - 1)
+    row = np.clip(row - 0.5, 0, rows - 1)
+    col0 = np.minimum(np.floor(col).astype(int), max(cols - 2, 0))
+    row0 = np.minimum(np.floor(row).astype(int), max(rows - 2, 0))
+    col1 = np.minimum(col0 + 1, cols - 1)
+    row1 = np.minimum(row0 + 1, rows - 1)
+    dx = col - col0
+    dy = row - row0
+    top = data[row0, col0] * (1 - dx) + data[row0, col1] * dx
+    bottom = data[row1, col0] * (1 - dx) + data[row1, col1] * dx
+    return np.asarray(top * (1 - dy) + bottom * dy, dtype=float)
+
+
+class WcsTileFetcher:
+    """
+    Pobieranie kafli numerycznego modelu terenu z usługi WCS (adres można podmienić np. na lokalny serwer testowy)
+    """
+    def __init__(self, base_url=WCS_URL, timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def __call__(self, bbox, width, height):
+        url = generate_wcs_url(bbox, width, height, base_url=self.base_url)
+        response = requests.get(url, timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception(f"Download error: {response.status_code}, {response.text}")
+        _, data = read_ascii_grid(io.StringIO(response.text))
+        return data
+
+
+class DirectoryTileFetcher:
+    """
+    Odczyt kafli z lokalnego katalogu z plikami ASCII Grid nazwanymi {x_min}_{y_min}.asc (np. dane testowe).
+    Pliki są wczytywane przez load_ascii_grid, więc każdy jest parsowany tylko raz
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, bbox, width, height):
+        _, data = load_ascii_grid(os.path.join(self.directory, f"{int(bbox[0])}_{int(bbox[1])}.asc"))
+        return data
+
+
+class TerrainCache:
+    """
+    Trwała pamięć podręczna numerycznego modelu terenu w postaci kafli .npy na stałej siatce EPSG:2180.
+    Brakujące kafle są pobierane, a najdawniej używane usuwane po przekroczeniu limitu rozmiaru
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 ** 2, fetcher=None, tile_size=TILE_SIZE):
+        """
+        Args:
+            cache_dir: Katalog z zapisanymi kaflami
+            max_bytes: Maksymalny łączny rozmiar kafli na dysku
+            fetcher: Funkcja fetcher(bbox, width, height) zwracająca macierz wysokości (domyślnie WcsTileFetcher)
+            tile_size: Rozmiar kafla w metrach
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher if fetcher is not None else WcsTileFetcher()
+        self.tile_size = tile_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _tile_path(self, tile_x, tile_y):
+        return os.path.join(self.cache_dir, f"{self.tile_size}_{tile_x}_{tile_y}.npy")
+
+    def tile_index(self, x, y):
+        return int(math.floor(x / self.tile_size)), int(math.floor(y / self.tile_size))
+
+    def get_tile(self, tile_x, tile_y):
+        """
+        Macierz wysokości kafla (wiersz 0 odpowiada północnej krawędzi), pobierana tylko gdy brak jej w pamięci podręcznej
+        """
+        path = self._tile_path(tile_x, tile_y)
+        if os.path.isfile(path):
+            os.utime(path)  # Oznaczenie kafla jako ostatnio używanego
+            return np.load(path, mmap_mode='r')
+
+        size = self.tile_size
+        bbox = (tile_x * size, tile_y * size, (tile_x + 1) * size, (tile_y + 1) * size)
+        data = np.asarray(self.fetcher(bbox, size, size), dtype=np.float32)
+        if data.shape != (size, size):
+            raise ValueError(f"Unexpected tile shape {data.shape} for tile {tile_x}, {tile_y}")
+
+        # Zapis atomowy - równoległe przebiegi nie odczytają niepełnego pliku
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            np.save(file, data)
+        os.replace(tmp_path, path)
+        self._evict()
+        return np.load(path, mmap_mode='r')
+
+    def _evict(self):
+        """
+        Usuwanie najdawniej używanych kafli po przekroczeniu limitu rozmiaru
+        """
+        tiles = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                tiles.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in tiles)
+        for _, size, name in sorted(tiles):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def read_bbox(self, bbox):
+        """
+        Złożenie macierzy wysokości dla obszaru z kafli, zwraca (macierz, (x_min, y_max))
+        """
+        x_min, y_min = math.floor(bbox[0]), math.floor(bbox[1])
+        x_max, y_max = math.ceil(bbox[2]), math.ceil(bbox[3])
+        data = np.empty((y_max - y_min, x_max - x_min), dtype=np.float32)
+        tile_x_min, tile_y_min = self.tile_index(x_min, y_min)
+        tile_x_max, tile_y_max = self.tile_index(x_max - 1, y_max - 1)
+        size = self.tile_size
+        for tile_x in range(tile_x_min, tile_x_max + 1):
+            for tile_y in range(tile_y_min, tile_y_max + 1):
+                tile = self.get_tile(tile_x, tile_y)
+                # Część wspólna kafla i obszaru w metrach
+                left, right = max(x_min, tile_x * size), min(x_max, (tile_x + 1) * size)
+                bottom, top = max(y_min, tile_y * size), min(y_max, (tile_y + 1) * size)
+                data[y_max - top:y_max - bottom, left - x_min:right - x_min] = \
+                    tile[(tile_y + 1) * size - top:(tile_y + 1) * size - bottom, left - tile_x * size:right - tile_x * size]
+        return data, (x_min, y_max)
+
+    def heights_at(self, coordinates, interpolate=False):
+        """
+        Wysokości terenu dla listy współrzędnych (x, y) w EPSG:2180
+        """
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        if interpolate:  # Interpolacja wymaga sąsiednich komórek, więc korzysta z obszaru złożonego z kafli
+            x_min, y_min = coordinates.min(axis=0) - 1
+            x_max, y_max = coordinates.max(axis=0) + 1
+            data, (left, top) = self.read_bbox((x_min, y_min, x_max, y_max))
+            header = {"cellsize": 1.0, "xllcorner": left, "yllcorner": top - data.shape[0]}
+            return sample_grid(header, data, coordinates, interpolate=True).tolist()
+
+        heights = np.empty(len(coordinates))
+        size = self.tile_size
+        tiles = np.floor(coordinates / size).astype(int)
+        for tile_x, tile_y in set(map(tuple, tiles)):
+            mask = (tiles[:, 0] == tile_x) & (tiles[:, 1] == tile_y)
+            tile = self.get_tile(tile_x, tile_y)
+            cols = np.floor(coordinates[mask, 0] - tile_x * size).astype(int)
+            rows = np.floor((tile_y + 1) * size - coordinates[mask, 1]).astype(int)
+            heights[mask] = tile[np.clip(rows, 0, size - 1), np.clip(cols, 0, size - 1)]
+        return heights.tolist()
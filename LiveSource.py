@@ -0,0 +1,99 @@
+import time
+from threading import Condition, Event, Thread
+import cv2
+
+LIVE_FPS = 30   # Liczba klatek na sekundę przyjmowana, gdy strumień jej nie podaje
+STOP_TIMEOUT = 2.0  # Czas oczekiwania (s) na zakończenie wątku odczytu zablokowanego na strumieniu
+
+
+class LatestFrameGrabber:
+    """
+    Odczyt strumienia na żywo (RTSP, UDP, potok) w osobnym wątku - przechowywana jest tylko najnowsza klatka,
+    a klatki nieodebrane przed nadejściem kolejnej są odrzucane, więc opóźnienie nie rośnie, gdy przetwarzanie
+    jest wolniejsze niż źródło. Plik jest odtwarzany w tempie nagrania (test trybu na żywo)
+    """
+    def __init__(self, cap, realtime=False, fps=LIVE_FPS):
+        """
+        Args:
+            cap: Otwarty cv2.VideoCapture
+            realtime: Wstrzymywanie odczytu do chwili wynikającej ze znacznika czasu klatki (odtwarzanie pliku)
+            fps: Liczba klatek na sekundę źródła (odstęp klatek, gdy strumień nie podaje znaczników czasu)
+        """
+        self.cap = cap
+        self.realtime = realtime
+        self.fps = fps
+        self.condition = Condition()
+        self.stop_event = Event()
+        self.frame = None
+        self.capture_time = None    # Chwila odebrania klatki (time.monotonic) - początek pomiaru opóźnienia
+        self.stream_time = None # Czas klatki w sekundach od początku strumienia - do obliczania prędkości
+        self.sequence = 0   # Numer ostatniej odebranej klatki źródła
+        self.returned = 0   # Numer ostatniej klatki zwróconej przez read
+        self.frames_dropped = 0 # Klatki zastąpione nowszą przed odczytem
+        self.ended = False
+        self.error = None
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        start = None
+        stream_timestamps = True    # Znaczniki czasu strumienia (CAP_PROP_POS_MSEC) rosną - w przeciwnym razie czas odbioru
+        previous = None
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                now = time.monotonic()
+                if start is None:
+                    start = now
+                stream_time = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if stream_timestamps and previous is not None and stream_time <= previous:
+                    stream_timestamps = False
+                if not stream_timestamps:
+                    stream_time = self.sequence / self.fps if self.realtime else now - start
+                previous = stream_time
+                if self.realtime:
+                    delay = start + stream_time - now
+                    if delay > 0 and self.stop_event.wait(delay):
+                        break
+                    now = time.monotonic()
+                with self.condition:
+                    if self.sequence > self.returned:
+                        self.frames_dropped += 1
+                    self.frame, self.capture_time, self.stream_time = frame, now, stream_time
+                    self.sequence += 1
+                    self.condition.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.ended = True
+                self.condition.notify_all()
+
+    def read(self):
+        """
+        Najnowsza klatka, która nie była jeszcze zwrócona (oczekiwanie na kolejną klatkę źródła)
+        Returns:
+            (klatka, chwila odebrania, czas klatki w strumieniu, numer klatki źródła od 0) lub None na końcu strumienia
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > self.returned or self.ended)
+            if self.sequence == self.returned:
+                if self.error:
+                    raise self.error
+                return None
+            self.returned = self.sequence
+            return self.frame, self.capture_time, self.stream_time, self.sequence - 1
+
+    def stats(self):
+        """
+        Liczba klatek odebranych ze źródła i odrzuconych oraz udział odrzuconych klatek
+        """
+        with self.condition:
+            grabbed, dropped = self.sequence, self.frames_dropped
+        return {"frames_grabbed": grabbed, "frames_dropped": dropped, "drop_rate": round(dropped / max(grabbed, 1), 4)}
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(STOP_TIMEOUT)  # Odczyt strumienia sieciowego może być zablokowany do przekroczenia czasu
@@ -0,0 +1,152 @@
+import numpy as np
+
+
+class QuadraticMotionModel:
+    """
+    Model ruchu pojazdu - dopasowanie wielomianu 2. stopnia do okna ostatnich pozycji.
+    Ponieważ czasy próbek w oknie zależą tylko od liczby pozycji i liczby zgubionych klatek,
+    wynik dopasowania jest liniową kombinacją pozycji, a wagi są liczone raz i zapamiętywane
+    """
+    def __init__(self, history=10, degree=2):
+        """
+        Args:
+            history: Długość okna pozycji
+            degree: Stopień dopasowywanego wielomianu
+        """
+        self.history = history
+        self.degree = degree
+        self._smoothing_cache = {}
+        self._prediction_cache = {}
+
+    def _fit_weights(self, fit_times, eval_times):
+        """
+        Macierz wag (len(eval_times), len(fit_times)) przeliczająca pozycje na wartości dopasowania w chwilach eval_times
+        """
+        fit_matrix = np.vander(np.asarray(fit_times, dtype=float), self.degree + 1)
+        eval_matrix = np.vander(np.asarray(eval_times, dtype=float), self.degree + 1)
+        return eval_matrix @ np.linalg.pinv(fit_matrix)
+
+    def smoothing_weights(self, count, frames_since_seen):
+        """
+        Wagi aproksymowanych pozycji (history x history, wyrównane do ostatnich pozycji okna)
+        """
+        key = (int(count), int(frames_since_seen))
+        weights = self._smoothing_cache.get(key)
+        if weights is not None:
+            return weights
+
+        count, frames_since_seen = key
+        weights = np.zeros((self.history, self.history))
+        if count < 3:   # Za mało danych - aproksymowane pozycje równe pozycjom
+            block = np.eye(count)
+        else:
+            fit_times = np.arange(count)
+            if count > 3:
+                fit_times[-1] += frames_since_seen - 1  # Zwiększenie o zgubione pozycje
+            eval_times = np.arange(count) + frames_since_seen - 1   # Odpowiednie wyrównanie o zgubione pozycje
+            block = self._fit_weights(fit_times, eval_times)
+        weights[self.history - count:, self.history - count:] = block
+        self._smoothing_cache[key] = weights
+        return weights
+
+    def prediction_weights(self, count, frames_since_seen):
+        """
+        Wagi przewidywanej pozycji w kolejnej klatce (wektor długości history wyrównany do ostatnich pozycji)
+        """
+        key = (int(count), int(frames_since_seen))
+        weights = self._prediction_cache.get(key)
+        if weights is not None:
+            return weights
+
+        count, frames_since_seen = key
+        weights = np.zeros(self.history)
+        if count < 2:   # Za mało danych - pozycja bez zmian
+            weights[-1] = 1.0
+        elif count == 2:    # Pozycja powiększona o różnicę dwóch ostatnich pozycji
+            weights[-2:] = [-1.0, 2.0]
+        else:
+            fit_times = np.arange(count)
+            next_time_index = fit_times[-1] + frames_since_seen
+            weights[self.history - count:] = self._fit_weights(fit_times, [next_time_index])[0]
+        self._prediction_cache[key] = weights
+        return weights
+
+    def _stack(self, weights_function, counts, frames_since_seen):
+        """
+        Zebranie wag dla wielu pojazdów (wagi liczone raz dla każdej unikalnej pary)
+        """
+        keys = np.stack([counts, frames_since_seen], axis=1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        weights = np.stack([weights_function(count, missing) for count, missing in unique_keys])
+        return weights[inverse.reshape(-1)]
+
+    def smooth(self, windows, counts, frames_since_seen):
+        """
+        Aproksymowane pozycje (x, y) dla wielu pojazdów
+        Args:
+            windows: Tablica (pojazdy, history, 2) ostatnich pozycji wyrównanych do końca okna
+            counts: Liczba poprawnych pozycji w oknie dla każdego pojazdu
+            frames_since_seen: Liczba zgubionych klatek dla każdego pojazdu
+        """
+        weights = self._stack(self.smoothing_weights, counts, frames_since_seen)
+        return np.einsum("kij,kjd->kid", weights, windows)
+
+    def predict(self, windows, counts, frames_since_seen):
+        """
+        Przewidywane pozycje (x, y) w kolejnej klatce dla wielu pojazdów
+        """
+        weights = self._stack(self.prediction_weights, counts, frames_since_seen)
+        return np.einsum("kj,kjd->kd", weights, windows)
+
+
+class KalmanMotionModel(QuadraticMotionModel):
+    """
+    Model ruchu ze stałym przyspieszeniem oparty o filtr Kalmana.
+    Przy stałych szumach wzmocnienia filtru nie zależą od pomiarów, więc estymata jest liniową
+    kombinacją pozycji w oknie i może korzystać z tych samych zapamiętanych wag
+    """
+    def __init__(self, history=10, process_noise=1.0, measurement_noise=4.0):
+        """
+        Args:
+            history: Długość okna pozycji
+            process_noise: Wariancja szumu procesu (zmiany przyspieszenia, piksele/klatkę^3)
+            measurement_noise: Wariancja błędu detekcji pozycji (piksele^2)
+        """
+        super().__init__(history=history)
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+    def _transition(self, dt):
+        return np.array([[1.0, dt, dt * dt / 2], [0.0, 1.0, dt], [0.0, 0.0, 1.0]])
+
+    def _fit_weights(self, fit_times, eval_times):
+        """
+        Filtr Kalmana wykonany na macierzy wag - stan jest przechowywany jako kombinacja liniowa pomiarów
+        """
+        fit_times = np.asarray(fit_times, dtype=float)
+        count = len(fit_times)
+        observation = np.array([1.0, 0.0, 0.0])
+
+        state = np.zeros((3, count))  # Stan (pozycja, prędkość, przyspieszenie) jako funkcja pomiarów
+        state[0, 0] = 1.0
+        covariance = np.diag([self.measurement_noise, 1e4, 1e2])
+        states = [state.copy()]
+        for i in range(1, count):
+            dt = fit_times[i] - fit_times[i - 1]
+            transition = self._transition(dt)
+            noise = self.process_noise * np.outer([dt ** 3 / 6, dt ** 2 / 2, dt], [dt ** 3 / 6, dt ** 2 / 2, dt])
+            state = transition @ state
+            covariance = transition @ covariance @ transition.T + noise
+
+            gain = covariance @ observation / (observation @ covariance @ observation + self.measurement_noise)
+            innovation = -observation @ state
+            innovation[i] += 1.0
+            state = state + np.outer(gain, innovation)
+            covariance = covariance - np.outer(gain, observation @ covariance)
+            states.append(state.copy())
+
+        weights = []
+        for eval_time in eval_times:
+            i = max(0, np.searchsorted(fit_times, eval_time, side="right") - 1)  # Ostatni pomiar nie późniejszy niż eval_time
+            weights.append((self._transition(eval_time - fit_times[i]) @ states[i])[0])
+        return np.array(weights)
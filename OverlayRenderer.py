@@ -0,0 +1,137 @@
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+OUTLINE_COLOR = (255, 255, 255)
+HUD_COLOR = (189, 114, 0)
+PATH_COLOR = (48, 172, 119)
+VEHICLE_COLORS = {'small': (189, 114, 0), 'large': (25, 83, 217)}
+MAX_SPRITE_BYTES = 64 * 1024 * 1024 # Maksymalny rozmiar zapamiętanych napisów w bajtach
+
+
+class OverlayRenderer:
+    """
+    Rysowanie informacji o pojazdach na klatce. Napisy są renderowane raz do obrazków z kanałem alfa
+    i ponownie tylko przy zmianie treści (np. zaokrąglonej prędkości), ścieżki i ramki rysowane są jednym wywołaniem
+    """
+    def __init__(self, scale=2, max_sprite_bytes=MAX_SPRITE_BYTES):
+        """
+        Args:
+            scale: Skala napisów i grubości linii dla klatki w rozdzielczości źródłowej
+            max_sprite_bytes: Maksymalny rozmiar zapamiętanych napisów w bajtach (najdawniej używane są usuwane)
+        """
+        self.scale = scale
+        self.max_sprite_bytes = max_sprite_bytes
+        self.sprites = OrderedDict()
+        self.sprite_bytes = 0   # Rozmiar zapamiętanych napisów w bajtach
+
+    def _sprite(self, lines, color, font_scale, thickness, line_height):
+        """
+        Obrazek napisu (kilka linii) z obramowaniem - kolory przemnożone przez alfa i odwrotność alfa (1 kanał)
+        """
+        key = (lines, color, font_scale, thickness, line_height)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        outline = thickness * 3
+        sizes = [cv2.getTextSize(line, FONT, font_scale, outline)[0] for line in lines]
+        _, baseline = cv2.getTextSize(lines[0], FONT, font_scale, outline)
+        ascent = max(height for _, height in sizes) + outline
+        width = max(width for width, _ in sizes) + outline * 2
+        height = ascent + line_height * (len(lines) - 1) + baseline + outline
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        alpha = np.zeros((height, width), dtype=np.uint8)
+        for i, line in enumerate(lines):
+            origin = (outline, ascent + i * line_height)
+            cv2.putText(image, line, origin, FONT, font_scale, OUTLINE_COLOR, outline, cv2.LINE_AA)
+            cv2.putText(alpha, line, origin, FONT, font_scale, 255, outline, cv2.LINE_AA)
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (outline, ascent + i * line_height), FONT, font_scale, color, thickness, cv2.LINE_AA)
+
+        sprite = (image, 255 - alpha, (outline, ascent))  # Położenie początku tekstu w obrazku
+        self.sprites[key] = sprite
+        self.sprite_bytes += image.nbytes + alpha.nbytes
+        while self.sprite_bytes > self.max_sprite_bytes and len(self.sprites) > 1:
+            removed_image, removed_alpha, _ = self.sprites.popitem(last=False)[1]
+            self.sprite_bytes -= removed_image.nbytes + removed_alpha.nbytes
+        return sprite
+
+    def _blit(self, frame, sprite, x, y):
+        """
+        Nałożenie napisu na klatkę - (x, y) to początek linii bazowej pierwszej linii tekstu, tak jak w cv2.putText
+        """
+        image, inverse_alpha, (origin_x, origin_y) = sprite
+        height, width = image.shape[:2]
+        x0, y0 = int(x) - origin_x, int(y) - origin_y
+        frame_height, frame_width = frame.shape[:2]
+        left, top = max(x0, 0), max(y0, 0)
+        right, bottom = min(x0 + width, frame_width), min(y0 + height, frame_height)
+        if left >= right or top >= bottom:
+            return
+        roi = frame[top:bottom, left:right]
+        crop = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+        # Mieszanie z kanałem alfa: klatka * (1 - alfa) + napis (kolory napisu już przemnożone przez alfa),
+        # jeden zapamiętany kanał alfa rozszerzany na kanały koloru tylko na czas nałożenia
+        blended = cv2.multiply(roi, cv2.cvtColor(inverse_alpha[crop], cv2.COLOR_GRAY2BGR), scale=1 / 255)
+        cv2.add(blended, image[crop], dst=roi)
+
+    def _boxes(self, positions):
+        """
+        Wierzchołki obróconych prostokątów (x, y, szerokość, wysokość, kąt w stopniach) - odpowiednik cv2.boxPoints
+        """
+        x, y, width, height, theta = positions.T
+        cos, sin = np.cos(np.radians(theta)), np.sin(np.radians(theta))
+        corners = np.array([[-0.5, 0.5], [-0.5, -0.5], [0.5, -0.5], [0.5, 0.5]])
+        dx = corners[None, :, 0] * width[:, None]
+        dy = corners[None, :, 1] * height[:, None]
+        points = np.stack([x[:, None] + dx * cos[:, None] - dy * sin[:, None],
+                           y[:, None] + dx * sin[:, None] + dy * cos[:, None]], axis=2)
+        return points.astype(np.int32)
+
+    def draw(self, frame, draw_state, resolution_scale=1.0):
+        """
+        Rysowanie stanu pojazdów na klatce
+        Args:
+            draw_state: Stan zwracany przez CarContainer.get_draw_state
+            resolution_scale: Stosunek rozdzielczości klatki do rozdzielczości źródłowej (rysowanie na pomniejszonej klatce)
+        """
+        drone_real_height, car_counter, cars = draw_state
+        scale = self.scale * resolution_scale
+        font_scale = round(1 * scale, 2)
+        thickness = max(1, round(2 * scale))
+        line_width = max(1, round(3 * scale))
+        line_height = round(30 * scale)
+
+        # Wysokość drona i licznik pojazdów
+        self._blit(frame, self._sprite((f"Altitude: {drone_real_height:.1f} m",), HUD_COLOR, font_scale, thickness, line_height),
+                   20 * resolution_scale, 80 * resolution_scale)
+        self._blit(frame, self._sprite((f"Car Counter: {car_counter}",), HUD_COLOR, font_scale, thickness, line_height),
+                   600 * resolution_scale, 80 * resolution_scale)
+        if not cars:
+            return frame
+
+        # Ścieżki ruchu wszystkich pojazdów jednym wywołaniem
+        paths = [np.round(approximated[:, :2] * resolution_scale).astype(np.int32)
+                 for _, _, _, approximated, _, _ in cars if len(approximated) > 1]
+        if paths:
+            cv2.polylines(frame, paths, False, PATH_COLOR, line_width)
+
+        # Ramki pojazdów - jedno wywołanie dla każdego typu pojazdu
+        positions = np.array([position for _, _, position, _, _, _ in cars], dtype=float)
+        positions[:, :4] *= resolution_scale
+        boxes = self._boxes(positions)
+        types = np.array([vehicle_type for _, vehicle_type, _, _, _, _ in cars])
+        for vehicle_type, color in VEHICLE_COLORS.items():
+            selected = boxes[types == vehicle_type]
+            if len(selected):
+                cv2.polylines(frame, list(selected), True, color, line_width)
+
+        # Opisy pojazdów - napis odtwarzany tylko przy zmianie zaokrąglonej prędkości lub stanu
+        for (car_id, vehicle_type, _, _, real_speed, frames_since_seen), (x_center, y_center) in zip(cars, positions[:, :2]):
+            lines = (f"ID: {car_id} | Speed: {real_speed:.0f} km/h", f"Type: {vehicle_type} Lost: {frames_since_seen}")
+            sprite = self._sprite(lines, VEHICLE_COLORS[vehicle_type], font_scale, thickness, line_height)
+            self._blit(frame, sprite, x_center - 300 * resolution_scale, y_center - 60 * scale)
+        return frame
@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, Thread, Event, get_ident
+import numpy as np
+
+WINDOW = 1024   # Liczba ostatnich pomiarów, z których liczone są percentyle
+QUANTILES = (50, 95, 99)
+
+
+class StageStats:
+    """
+    Czasy wykonania jednego etapu - bufor cykliczny ostatnich pomiarów oraz sumy od początku
+    """
+    def __init__(self, window=WINDOW):
+        self.samples = np.zeros(window)
+        self.head = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples[self.head] = seconds
+        self.head = (self.head + 1) % len(self.samples)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        recent = self.samples[:min(self.count, len(self.samples))]
+        percentiles = np.percentile(recent, QUANTILES) if len(recent) else np.zeros(len(QUANTILES))
+        summary = {"count": self.count, "total_s": round(self.total, 6), "mean_ms": round(self.total / max(self.count, 1) * 1000, 4)}
+        for quantile, value in zip(QUANTILES, percentiles):
+            summary[f"p{quantile}_ms"] = round(float(value) * 1000, 4)
+        summary["max_ms"] = round(self.max * 1000, 4)
+        return summary
+
+
+class StackSampler:
+    """
+    Próbkujący profiler - wątek co interval sekund zapisuje stos wywołań obserwowanych wątków
+    (wynik w formacie "collapsed stacks" do narzędzi generujących wykresy płomieniowe)
+    """
+    def __init__(self, interval=0.005, thread_ids=None):
+        """
+        Args:
+            interval: Odstęp pomiędzy próbkami w sekundach
+            thread_ids: Identyfikatory próbkowanych wątków (domyślnie wszystkie poza wątkiem próbkującym)
+        """
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.stop_event = Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def _run(self):
+        own_id = get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def export(self, path):
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Pomiar czasu etapów przetwarzania (zegar monotoniczny) oraz liczniki śledzenia,
+    z eksportem do JSON, CSV i pliku tekstowego Prometheus (node exporter textfile collector)
+    """
+    def __init__(self, window=WINDOW, enabled=True):
+        """
+        Args:
+            window: Liczba ostatnich pomiarów każdego etapu używana do percentyli
+            enabled: Wyłączenie pomiarów (stage i record nic nie robią)
+        """
+        self.window = window
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}  # Wartości narastające
+        self.gauges = {}    # Wartości chwilowe
+        self.sampler = None
+        self.started = time.monotonic()
+        self.lock = Lock()  # Etapy potoku mierzone są w różnych wątkach
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Pomiar czasu bloku with jako etapu name
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(self.window)
+            stats.add(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def start_sampling(self, interval=0.005):
+        """
+        Uruchomienie próbkującego profilera stosu wywołań
+        """
+        if self.sampler is None:
+            self.sampler = StackSampler(interval)
+        self.sampler.start()
+
+    def stop_sampling(self):
+        if self.sampler:
+            self.sampler.stop()
+
+    def summary(self):
+        with self.lock:
+            stages = {name: stats.summary() for name, stats in self.stages.items()}
+            counters = dict(self.counters)
+        return {
+            "uptime_s": round(time.monotonic() - self.started, 3),
+            "stages": stages,
+            "counters": counters,
+            "gauges": dict(self.gauges),
+        }
+
+    def _write_atomic(self, path, write):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline="") as file:
+            write(file)
+        os.replace(tmp_path, path)  # Odczyt pliku w trakcie zapisu nie zwróci niepełnych danych
+
+    def export_json(self, path):
+        summary = self.summary()
+        self._write_atomic(path, lambda file: json.dump(summary, file, indent=2))
+
+    def export_csv(self, path):
+        """
+        Zapis statystyk etapów (jeden wiersz na etap) oraz liczników (kolumna count)
+        """
+        summary = self.summary()
+        fields = ["name", "count", "total_s", "mean_ms"] + [f"p{q}_ms" for q in QUANTILES] + ["max_ms"]
+
+        def write(file):
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            for name, stats in summary["stages"].items():
+                writer.writerow(dict(stats, name=name))
+            for name, value in {**summary["counters"], **summary["gauges"]}.items():
+                writer.writerow({"name": name, "count": value})
+        self._write_atomic(path, write)
+
+    def export_prometheus(self, path, prefix="carspeed", labels=None):
+        """
+        Zapis w formacie tekstowym Prometheus - etapy jako summary w sekundach, liczniki jako counter, wartości chwilowe jako gauge
+        Args:
+            labels: Dodatkowe etykiety wszystkich metryk (np. {"video": "DJI_0005"})
+        """
+        summary = self.summary()
+        label_text = ",".join(f'{key}="{value}"' for key, value in (labels or {}).items())
+
+        def with_labels(*extra):
+            text = ",".join(filter(None, [label_text, *extra]))
+            return f"{{{text}}}" if text else ""
+
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for name, stats in summary["stages"].items():
+            stage_label = f'stage="{name}"'
+            for quantile in QUANTILES:
+                quantile_label = f'quantile="{quantile / 100}"'
+                lines.append(f"{prefix}_stage_seconds{with_labels(stage_label, quantile_label)} {stats[f'p{quantile}_ms'] / 1000}")
+            lines.append(f"{prefix}_stage_seconds_sum{with_labels(stage_label)} {stats['total_s']}")
+            lines.append(f"{prefix}_stage_seconds_count{with_labels(stage_label)} {stats['count']}")
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total{with_labels()} {value}")
+        for name, value in summary["gauges"].items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name}{with_labels()} {value}")
+        self._write_atomic(path, lambda file: file.write("\n".join(lines) + "\n"))
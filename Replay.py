@@ -0,0 +1,353 @@
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from CarContainer import CarContainer, COUNTED_SPEED
+from DetectionCache import arrays_to_detections
+
+# Kolumny plików tekstowych detekcji i prawdziwych trajektorii (jak w formacie MOT, ramki obrócone):
+# numer klatki (od 1), identyfikator (-1 dla detekcji), środek, wymiary, kąt w stopniach, pewność, klasa, prędkość
+COLUMNS = ("frame", "id", "x", "y", "width", "height", "angle", "conf", "class", "speed_kmh")
+# Parametry CarContainer, które mogą być przeszukiwane
+TRACKER_PARAMETERS = ("near_threshold", "far_threshold", "near_min_positions", "region_fraction", "counted_speed",
+                      "max_frames_missing", "history", "degree")
+MAX_FRAMES_MISSING = 10 # Domyślna liczba klatek, po której zgubiony pojazd przestaje być śledzony (jak w VideoProcessor)
+MATCH_FRACTION = 0.5    # Maksymalna odległość środków (część długości prawdziwej ramki) przy przypisaniu do pojazdu
+
+_clips = {} # Klipy wczytane w procesie roboczym (wiele konfiguracji na tym samym klipie)
+
+
+def clip_stem(path):
+    return path[:-len(".npz")] if path.endswith(".npz") else os.path.splitext(path)[0]
+
+
+def truth_path(path):
+    """
+    Plik prawdziwych trajektorii klipu (<nazwa klipu>.gt.txt)
+    """
+    return clip_stem(path) + ".gt.txt"
+
+
+def read_tracks(path):
+    """
+    Odczyt pliku tekstowego w formacie COLUMNS (brakujące końcowe kolumny jako NaN)
+    """
+    table = pd.read_csv(path, header=None, names=COLUMNS, comment="#", skipinitialspace=True)
+    return table.sort_values("frame", kind="stable").reset_index(drop=True)
+
+
+def write_tracks(path, table):
+    """
+    Zapis wierszy w formacie COLUMNS (DataFrame lub słownik kolumn)
+    """
+    table = pd.DataFrame(table, columns=COLUMNS).astype({"frame": int, "id": int, "class": int})
+    table.to_csv(path, header=False, index=False, float_format="%.3f")
+
+
+def _frame_index(frames, frame_count):
+    """
+    Początek i liczba wierszy każdej klatki w wierszach posortowanych według klatki
+    """
+    counts = np.bincount(frames, minlength=frame_count)[:frame_count]
+    return np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64), counts
+
+
+def load_clip(path):
+    """
+    Wczytanie klipu detekcji (.npz lub tekstowy z metadanymi <nazwa>.meta.json) i prawdziwych trajektorii (jeżeli istnieją)
+    Returns:
+        Słownik z metadanymi nagrania (fps, rozdzielczość, parametry kamery), wysokościami drona w kolejnych klatkach,
+        detekcjami (xywhr, pewność, klasa) z indeksem klatek oraz prawdziwymi trajektoriami (None - brak)
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            clip = {key: data[key] for key in ("detected", "starts", "counts", "xywhr", "conf", "cls", "altitudes")}
+    else:
+        with open(clip_stem(path) + ".meta.json") as file:
+            meta = json.load(file)
+        table = read_tracks(path)
+        frames = table["frame"].to_numpy(dtype=np.int64) - 1
+        frame_count = int(meta.get("frame_count") or (frames.max() + 1 if len(frames) else 0))
+        table, frames = table[frames < frame_count], frames[frames < frame_count]
+        starts, counts = _frame_index(frames, frame_count)
+        xywhr = table[["x", "y", "width", "height", "angle"]].to_numpy(dtype=float)
+        xywhr[:, 4] = np.radians(xywhr[:, 4])
+        clip = {
+            "detected": np.ones(frame_count, dtype=bool),    # Klatka bez wierszy - brak pojazdów
+            "starts": starts, "counts": counts, "xywhr": xywhr,
+            "conf": table["conf"].fillna(1.0).to_numpy(dtype=float),
+            "cls": table["class"].to_numpy(dtype=int),
+            "altitudes": np.asarray(meta.pop("altitudes", [meta.get("altitude", 0.0)] * frame_count), dtype=float),
+        }
+    clip["meta"] = meta
+    clip["name"] = os.path.basename(clip_stem(path))
+    clip["truth"] = read_tracks(truth_path(path)) if os.path.isfile(truth_path(path)) else None
+    return clip
+
+
+def save_clip(path, meta, altitudes, detections):
+    """
+    Zapis klipu detekcji
+    Args:
+        path: Plik .npz lub tekstowy (.txt, .csv) - w pliku tekstowym klatki bez detekcji modelu nie są odróżniane
+              od klatek bez pojazdów
+        meta: fps, width, height, focal_length, sensor_width, sensor_height
+        altitudes: Wysokość drona w kolejnych klatkach
+        detections: Lista (xywhr, pewność, klasa) kolejnych klatek lub None dla klatek bez detekcji modelu
+    """
+    frame_count = len(detections)
+    detected = np.array([arrays is not None for arrays in detections], dtype=bool)
+    empty = (np.zeros((0, 5)), np.zeros(0), np.zeros(0, dtype=int))
+    arrays = [arrays if arrays is not None else empty for arrays in detections]
+    counts = np.array([len(xywhr) for xywhr, _, _ in arrays], dtype=np.int64)
+    xywhr = np.concatenate([np.asarray(a[0], dtype=float).reshape(-1, 5) for a in arrays] or [empty[0]])
+    confidences = np.concatenate([np.asarray(a[1], dtype=float) for a in arrays] or [empty[1]])
+    classes = np.concatenate([np.asarray(a[2], dtype=int) for a in arrays] or [empty[2]])
+    meta = dict(meta, frame_count=frame_count)
+    if path.endswith(".npz"):
+        np.savez_compressed(path, meta=json.dumps(meta), detected=detected, counts=counts,
+                            starts=np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64),
+                            xywhr=xywhr.astype(np.float32), conf=confidences.astype(np.float32),
+                            cls=classes.astype(np.uint8), altitudes=np.asarray(altitudes, dtype=float))
+        return
+    with open(clip_stem(path) + ".meta.json", "w") as file:
+        json.dump(dict(meta, altitudes=[float(altitude) for altitude in altitudes]), file)
+    write_tracks(path, {
+        "frame": np.repeat(np.arange(1, frame_count + 1), counts), "id": -1,
+        "x": xywhr[:, 0], "y": xywhr[:, 1], "width": xywhr[:, 2], "height": xywhr[:, 3],
+        "angle": np.degrees(xywhr[:, 4]), "conf": confidences, "class": classes, "speed_kmh": -1,
+    })
+
+
+def export_clip(video_processor, path):
+    """
+    Zapis detekcji przetworzonego nagrania z pamięci podręcznej detekcji VideoProcessor jako klipu do odtwarzania
+    (klatki, w których model nie był uruchamiany, są w klipie przewidywane modelem ruchu)
+    """
+    cache = video_processor.detection_cache
+    if cache is None:
+        raise ValueError("Exporting a replay clip requires the detection cache")
+    frame_count = cache.frame_count or video_processor.video_frames or video_processor.total_frames
+    meta = {
+        "fps": video_processor.fps,
+        "width": video_processor.frame_width,
+        "height": video_processor.frame_height,
+        "focal_length": video_processor.focal_length,
+        "sensor_width": video_processor.sensor_width,
+        "sensor_height": video_processor.sensor_height,
+        "video": os.path.basename(video_processor.video_path),
+    }
+    save_clip(path, meta, video_processor.real_altitudes[:frame_count], [cache.get(i) for i in range(frame_count)])
+
+
+def replay(clip, **tracker_options):
+    """
+    Śledzenie pojazdów na detekcjach klipu bez dekodowania nagrania i bez modelu - aktualizacje CarContainer
+    w tej samej kolejności co VideoProcessor.track
+    Args:
+        tracker_options: Parametry CarContainer (TRACKER_PARAMETERS)
+    Returns:
+        Tablica (klatka, identyfikator, x, y, prędkość uśredniona) pojazdów zmierzonych w kolejnych klatkach,
+        liczba policzonych pojazdów i czas śledzenia w sekundach
+    """
+    meta = clip["meta"]
+    container = CarContainer(
+        meta["fps"], meta["width"], meta["height"],
+        meta["focal_length"], meta["sensor_width"], meta["sensor_height"],
+        **dict({"max_frames_missing": MAX_FRAMES_MISSING}, **tracker_options)
+    )
+    detected, starts, counts = clip["detected"], clip["starts"], clip["counts"]
+    xywhr, classes, altitudes = clip["xywhr"], clip["cls"], clip["altitudes"]
+    measured = []
+    start = time.perf_counter()
+    for i in range(len(detected)):
+        container.update_drone_height(altitudes[min(i, len(altitudes) - 1)])
+        container.increment_missing_frames()
+        if detected[i]:
+            rows = slice(starts[i], starts[i] + counts[i])
+            container.update_cars(arrays_to_detections(xywhr[rows], classes[rows]))
+        else:
+            container.propagate_cars()
+        container.remove_missing_cars()
+        ids, _, positions, _, real_speeds = container.get_measured_tracks()
+        if len(ids):
+            measured.append(np.column_stack([np.full(len(ids), i + 1), ids, positions[:, :2], real_speeds]))
+    elapsed = time.perf_counter() - start
+    measured = np.concatenate(measured) if measured else np.zeros((0, 5))
+    return measured, container.car_counter, elapsed
+
+
+def score_tracks(measured, truth, car_counter, match_fraction=MATCH_FRACTION):
+    """
+    Porównanie trajektorii z prawdziwymi trajektoriami - w każdej klatce pojazdy przypisywane są do prawdziwych
+    pojazdów (algorytm węgierski) w odległości do match_fraction długości prawdziwej ramki
+    Returns:
+        Przełączenia identyfikatorów (prawdziwy pojazd przypisany do innego identyfikatora niż wcześniej),
+        błąd liczby pojazdów (względem prawdziwych pojazdów szybszych niż COUNTED_SPEED), kwadraty błędów prędkości
+        uśrednionej oraz liczby przypisań, prawdziwych i zmierzonych pozycji
+    """
+    truth_frames = truth["frame"].to_numpy(dtype=np.int64)
+    truth_ids = truth["id"].to_numpy(dtype=np.int64)
+    truth_xy = truth[["x", "y"]].to_numpy(dtype=float)
+    gates = match_fraction * np.maximum(truth["width"].to_numpy(dtype=float), truth["height"].to_numpy(dtype=float))
+    truth_speeds = truth["speed_kmh"].to_numpy(dtype=float)
+    order = np.argsort(measured[:, 0], kind="stable")
+    measured = measured[order]
+    measured_frames = measured[:, 0].astype(np.int64)
+
+    last_ids = {}   # Prawdziwy identyfikator -> ostatnio przypisany identyfikator
+    id_switches, matches, squared_errors, speed_samples = 0, 0, 0.0, 0
+    for frame in np.unique(truth_frames):
+        truth_rows = slice(*np.searchsorted(truth_frames, [frame, frame + 1]))
+        measured_rows = slice(*np.searchsorted(measured_frames, [frame, frame + 1]))
+        if measured_rows.start == measured_rows.stop:
+            continue
+        distances = np.linalg.norm(truth_xy[truth_rows, None] - measured[None, measured_rows, 2:4], axis=2)
+        valid = distances <= gates[truth_rows, None]
+        rows, cols = linear_sum_assignment(np.where(valid, distances, distances.max() + 1e6))
+        keep = valid[rows, cols]
+        rows, cols = rows[keep] + truth_rows.start, cols[keep] + measured_rows.start
+        matches += len(rows)
+        for truth_id, car_id in zip(truth_ids[rows], measured[cols, 1].astype(np.int64)):
+            if last_ids.get(truth_id, car_id) != car_id:
+                id_switches += 1
+            last_ids[truth_id] = car_id
+        speeds = measured[cols, 4]
+        with_speed = (speeds > 0) & np.isfinite(truth_speeds[rows]) & (truth_speeds[rows] >= 0)
+        squared_errors += float(np.sum((speeds[with_speed] - truth_speeds[rows][with_speed]) ** 2))
+        speed_samples += int(np.count_nonzero(with_speed))
+
+    mean_speeds = truth.groupby("id")["speed_kmh"].mean()
+    true_count = int((mean_speeds > COUNTED_SPEED).sum())
+    return {
+        "id_switches": id_switches,
+        "count_error": int(car_counter) - true_count,
+        "squared_speed_errors": squared_errors,
+        "speed_samples": speed_samples,
+        "matches": matches,
+        "truth_positions": len(truth),
+        "measured_positions": len(measured),
+    }
+
+
+def evaluate(clip, params):
+    """
+    Odtworzenie klipu z parametrami params i ocena wyniku (bez prawdziwych trajektorii - tylko liczba pojazdów i czas)
+    """
+    measured, car_counter, elapsed = replay(clip, **params)
+    result = {"clip": clip["name"], "frames": len(clip["detected"]), "seconds": elapsed, "car_counter": car_counter}
+    if clip["truth"] is not None:
+        result.update(score_tracks(measured, clip["truth"], car_counter))
+    return result
+
+
+def _evaluate_job(job):
+    """
+    Ocena jednej konfiguracji na jednym klipie w procesie roboczym (klip wczytywany raz na proces)
+    """
+    config_index, params, clip_path = job
+    if clip_path not in _clips:
+        _clips[clip_path] = load_clip(clip_path)
+    return config_index, evaluate(_clips[clip_path], params)
+
+
+def parameter_grid(grid):
+    """
+    Wszystkie kombinacje wartości parametrów, np. {"near_threshold": [15, 20], "history": [8, 10]} - 4 konfiguracje
+    """
+    unknown = set(grid) - set(TRACKER_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown tracker parameters: {', '.join(sorted(unknown))}")
+    names = sorted(grid)
+    values = [grid[name] if isinstance(grid[name], (list, tuple)) else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def summarize(params, results):
+    """
+    Wyniki konfiguracji zsumowane po wszystkich klipach
+    """
+    frames = sum(result["frames"] for result in results)
+    seconds = sum(result["seconds"] for result in results)
+    summary = dict(params, clips=len(results), frames=frames, fps=round(frames / max(seconds, 1e-9), 1),
+                   car_counter=sum(result["car_counter"] for result in results))
+    scored = [result for result in results if "id_switches" in result]
+    if scored:
+        samples = sum(result["speed_samples"] for result in scored)
+        summary.update(
+            id_switches=sum(result["id_switches"] for result in scored),
+            count_error=sum(abs(result["count_error"]) for result in scored),
+            speed_rmse_kmh=round(np.sqrt(sum(result["squared_speed_errors"] for result in scored) / samples), 3)
+            if samples else None,
+            recall=round(sum(result["matches"] for result in scored) / max(sum(result["truth_positions"] for result in scored), 1), 4),
+            precision=round(sum(result["matches"] for result in scored) / max(sum(result["measured_positions"] for result in scored), 1), 4),
+        )
+    return summary
+
+
+def sweep(clip_paths, grid, workers=1, output=None, sort_by=("id_switches", "count_error", "speed_rmse_kmh")):
+    """
+    Ocena wszystkich kombinacji parametrów śledzenia na klipach w puli procesów
+    Args:
+        clip_paths: Klipy detekcji (.npz lub tekstowe) z prawdziwymi trajektoriami <nazwa>.gt.txt
+        grid: Słownik parametr -> lista wartości (parameter_grid)
+        output: Opcjonalny plik wyników (.csv lub .json)
+        sort_by: Kolumny, według których sortowane są konfiguracje (od najlepszej)
+    Returns:
+        DataFrame z jednym wierszem na konfigurację
+    """
+    configs = parameter_grid(grid)
+    jobs = [(index, params, path) for path in clip_paths for index, params in enumerate(configs)]
+    results = [[] for _ in configs]
+    workers = max(1, min(workers, len(jobs)))
+    print(f"Evaluating {len(configs)} configurations on {len(clip_paths)} clips with {workers} workers...")
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    # Zadania uporządkowane według klipów - kolejne zadania procesu roboczego korzystają z wczytanego już klipu
+    with context.Pool(workers) if workers > 1 else contextlib.nullcontext() as pool:
+        completed = pool.imap_unordered(_evaluate_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))) \
+            if pool is not None else map(_evaluate_job, jobs)
+        for config_index, result in completed:
+            results[config_index].append(result)
+
+    table = pd.DataFrame([summarize(params, config_results) for params, config_results in zip(configs, results)])
+    sort_by = [column for column in sort_by if column in table.columns]
+    if sort_by:
+        table = table.sort_values(sort_by, kind="stable", na_position="last").reset_index(drop=True)
+    elapsed = time.perf_counter() - start
+    print(f"Evaluated {len(jobs)} replays in {elapsed:.1f} s")
+    if output:
+        if output.endswith(".json"):
+            table.to_json(output, orient="records", indent=2)
+        else:
+            table.to_csv(output, index=False)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay tracking on recorded detections and sweep tracker parameters.")
+    parser.add_argument("--clips", type=str, nargs="+", required=True, help="Detection clips (.npz or MOT-style text with .meta.json) with <name>.gt.txt ground truth.")
+    parser.add_argument("--grid", type=str, default="{}", help="JSON object (or path to a JSON file) mapping tracker parameters to lists of values.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--output", type=str, default="sweep.csv", help="Path of the results file (.csv or .json).")
+    parser.add_argument("--top", type=int, default=10, help="Number of best configurations to print.")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.grid):
+        with open(args.grid) as file:
+            grid = json.load(file)
+    else:
+        grid = json.loads(args.grid)
+    table = sweep(args.clips, grid, args.workers, args.output)
+    print(table.head(args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import functools
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import multiprocessing
+from collections import deque
+import cv2
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from AnalyticsSink import TableWriter, SECOND_COLUMNS, TRAJECTORY_COLUMNS, analytics_format, trajectory_path
+from BatchProcessor import process_video, prepare_model, _worker_model_for
+from CarContainer import COUNTED_SPEED
+from OverlayRenderer import OverlayRenderer
+from TrackStore import HISTORY
+from VideoEncoder import VideoEncoder, FFmpegBackend
+from VideoProcessor import VideoProcessor
+
+SEGMENT_OVERLAP = 2.0   # Nakładanie się fragmentów w sekundach - rozbieg śledzenia i okno łączenia trajektorii
+STITCH_DISTANCE = 20    # Maksymalna średnia odległość (piksele) pozycji tego samego pojazdu w obu fragmentach
+MIN_STITCH_FRAMES = 3   # Minimalna liczba wspólnych klatek potrzebna do połączenia trajektorii
+MAX_FRAMES_MISSING = 10 # Liczba klatek, przez które rysowana jest ostatnia znana pozycja pojazdu (jak w VideoProcessor)
+
+
+def plan_segments(total_frames, fps, segments, overlap=SEGMENT_OVERLAP):
+    """
+    Podział nagrania na fragmenty o równej długości
+    Returns:
+        Lista (początek rozbiegu, początek fragmentu, koniec fragmentu) - klatki rozbiegu są przetwarzane
+        przez dwa sąsiednie fragmenty, a wyniki fragmentu obejmują klatki [początek, koniec)
+    """
+    segments = max(1, min(segments, total_frames // max(1, round(fps * overlap * 2))))    # Fragment dłuższy niż dwa rozbiegi
+    bounds = np.linspace(0, total_frames, segments + 1).round().astype(int)
+    warmup = round(fps * overlap)
+    return [(max(0, int(start) - warmup), int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _process_segment(job):
+    """
+    Przetworzenie jednego fragmentu w procesie roboczym - wyniki zapisywane są w katalogu roboczym
+    """
+    video_path, work_dir, index, (warmup_start, start, end), options = job
+    begin = time.perf_counter()
+    processor_options = dict(options["processor_options"])
+    if processor_options.get("detector") is None:
+        # Model procesu ładowany dopiero przy pierwszej klatce brakującej w pamięci podręcznej detekcji
+        processor_options["model_loader"] = functools.partial(_worker_model_for, options["model_path"],
+                                                              processor_options.get("backend", "torch"),
+                                                              processor_options.get("int8", False), video_path)
+    output_file = os.path.join(work_dir, f"segment{index:04d}.csv")
+    video_processor = VideoProcessor(
+        video_path,
+        options["drone_model"],
+        options["start_altitude"],
+        model_path=options["model_path"],
+        output_file=output_file,
+        overlay=False,
+        frame_range=(warmup_start, end),
+        **processor_options
+    )
+    frames = process_video(video_processor, verbose=False)
+    return index, output_file, frames, time.perf_counter() - begin
+
+
+def stitch_tracks(previous, current, overlap_frames):
+    """
+    Dopasowanie pojazdów fragmentu do pojazdów poprzedniego fragmentu na podstawie pozycji we wspólnych klatkach
+    Args:
+        previous: Trajektorie poprzedniego fragmentu (DataFrame w formacie TRAJECTORY_COLUMNS)
+        current: Trajektorie bieżącego fragmentu
+        overlap_frames: Zakres kolumny frame (od, do) przetwarzany przez oba fragmenty
+    Returns:
+        Słownik identyfikator w bieżącym fragmencie -> identyfikator w poprzednim fragmencie
+    """
+    first, last = overlap_frames
+    previous = previous[(previous["frame"] >= first) & (previous["frame"] <= last)]
+    current = current[(current["frame"] >= first) & (current["frame"] <= last)]
+    common = previous.merge(current, on="frame", suffixes=("_previous", "_current"))
+    if common.empty:
+        return {}
+    common["distance"] = np.hypot(common["x_previous"] - common["x_current"], common["y_previous"] - common["y_current"])
+    pairs = common.groupby(["id_current", "id_previous"])["distance"].agg(["mean", "count"]).reset_index()
+    # Pojazdy, które pojawiły się tuż przed końcem wspólnych klatek, mają mniej pozycji do porównania
+    required = np.minimum(MIN_STITCH_FRAMES, np.minimum(pairs["id_previous"].map(previous["id"].value_counts()),
+                                                        pairs["id_current"].map(current["id"].value_counts())))
+    pairs = pairs[(pairs["count"] >= required) & (pairs["mean"] < STITCH_DISTANCE)]
+    if pairs.empty:
+        return {}
+    current_ids, rows = np.unique(pairs["id_current"], return_inverse=True)
+    previous_ids, cols = np.unique(pairs["id_previous"], return_inverse=True)
+    cost = np.full((len(current_ids), len(previous_ids)), 1e9)
+    cost[rows, cols] = pairs["mean"].to_numpy()
+    row_ind, col_ind = linear_sum_assignment(cost)
+    return {int(current_ids[r]): int(previous_ids[c]) for r, c in zip(row_ind, col_ind) if cost[r, c] < 1e9}
+
+
+def stitch_segments(segments, plan, fps, counted_speed=COUNTED_SPEED):
+    """
+    Połączenie wyników fragmentów: wspólne identyfikatory pojazdów, licznik pojazdów i statystyki co sekundę
+    Args:
+        segments: Lista (statystyki co sekundę, trajektorie) kolejnych fragmentów
+        plan: Wynik plan_segments
+        counted_speed: Prędkość uśredniona (km/h), od której pojazd jest liczony
+    Returns:
+        Statystyki co sekundę, trajektorie z globalnymi identyfikatorami i liczba policzonych pojazdów
+    """
+    seconds, trajectories = [], []
+    previous, previous_ids = None, {}
+    next_id = 1
+    for (per_second, tracks), (warmup_start, start, end) in zip(segments, plan):
+        # Kolumna frame to liczba klatek przetworzonych po aktualizacji, więc klatka o indeksie i ma numer i + 1
+        matches = stitch_tracks(previous, tracks, (warmup_start + 1, start)) if previous is not None else {}
+        owned = tracks[(tracks["frame"] > start) & (tracks["frame"] <= end)].copy()
+        ids = {}
+        for local_id in pd.unique(owned["id"]):     # Nowe identyfikatory w kolejności pojawienia się pojazdów
+            matched = matches.get(int(local_id))
+            if matched is not None and matched in previous_ids:
+                ids[int(local_id)] = previous_ids[matched]
+            else:
+                ids[int(local_id)] = next_id
+                next_id += 1
+        owned["id"] = owned["id"].map(ids)
+        trajectories.append(owned)
+
+        # Zapis co sekundę odbywa się w klatkach będących wielokrotnością zaokrąglonej liczby klatek na sekundę
+        step = max(1, round(fps))
+        frames = (per_second["Time (s)"] * fps / step).round() * step
+        seconds.append(per_second[(frames > start) & (frames <= end)])
+        # Pojazdy widoczne tylko w rozbiegu zachowują identyfikator z poprzedniego fragmentu
+        inherited = {local: previous_ids[matched] for local, matched in matches.items() if matched in previous_ids}
+        previous, previous_ids = tracks, {**inherited, **ids}
+    trajectories = pd.concat(trajectories, ignore_index=True) if trajectories else pd.DataFrame(columns=TRAJECTORY_COLUMNS)
+    seconds = pd.concat(seconds, ignore_index=True) if seconds else pd.DataFrame(columns=SECOND_COLUMNS)
+    car_counter = trajectories.loc[trajectories["avg_speed_kmh"] > counted_speed, "id"].nunique()
+    return seconds, trajectories, int(car_counter)
+
+
+def _render_segment(job):
+    """
+    Rysowanie połączonych trajektorii (globalne identyfikatory i licznik) na klatkach jednego fragmentu
+    """
+    video_path, output_path, (start, end), tracks, counted_before, max_frames_missing, encoder_options = job
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    writer = VideoEncoder(output_path, fps, size, **dict(encoder_options, drop_frames=False))
+    renderer = OverlayRenderer()
+
+    rows = {frame: group for frame, group in tracks.groupby("frame")}
+    paths = {}  # Identyfikator -> ostatnie pozycje pojazdu
+    last_seen = {}  # Identyfikator -> (klatka, typ, pozycja, prędkość uśredniona)
+    car_counter = counted_before
+    altitude = float(tracks["altitude_m"].iloc[0]) if len(tracks) else 0.0
+    first = int(tracks["frame"].min()) if len(tracks) else start + 1
+    try:
+        for frame_number in range(min(first, start + 1), end + 1):
+            group = rows.get(frame_number)
+            if group is not None:
+                altitude = float(group["altitude_m"].iat[0])
+                for row in group.itertuples(index=False):
+                    if not row.counted:
+                        continue
+                    if row.id not in last_seen and frame_number > start:
+                        car_counter += 1    # Pierwsza klatka, w której pojazd został policzony
+                    paths.setdefault(row.id, deque(maxlen=HISTORY)).append((row.x, row.y))
+                    last_seen[row.id] = (frame_number, row.type, (row.x, row.y, row.width, row.height, row.angle),
+                                         row.avg_speed_kmh)
+            for car_id in [car_id for car_id, (seen, *_) in last_seen.items() if frame_number - seen > max_frames_missing]:
+                del last_seen[car_id], paths[car_id]
+            if frame_number <= start:
+                continue    # Odtworzenie stanu pojazdów sprzed początku fragmentu
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            cars = [(int(car_id), vehicle_type, position, np.array(paths[car_id]), float(speed), frame_number - seen)
+                    for car_id, (seen, vehicle_type, position, speed) in sorted(last_seen.items())]
+            writer.write(renderer.draw(frame, (altitude, car_counter, cars)))
+    finally:
+        cap.release()
+        writer.release()
+    return output_path
+
+
+def concatenate_videos(paths, output_path):
+    """
+    Połączenie nagrań fragmentów w jedno nagranie (ffmpeg bez ponownego kodowania lub OpenCV)
+    """
+    if FFmpegBackend.available():
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+            file.writelines(f"file '{os.path.abspath(path)}'\n" for path in paths)
+        try:
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", file.name,
+                            "-c", "copy", output_path], check=True)
+        finally:
+            os.remove(file.name)
+        return
+    writer = None
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if writer is None:
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), cap.get(cv2.CAP_PROP_FPS), size)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            writer.write(frame)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+
+def run_segments(video_path, output_file, drone_model, model_path, output_path=None, workers=1, segments=None,
+                 overlap=SEGMENT_OVERLAP, start_altitude=None, encoder_options=None, **processor_options):
+    """
+    Przetworzenie jednego nagrania we fragmentach równolegle w puli procesów i połączenie wyników
+    Args:
+        output_file: Plik statystyk co sekundę (.csv lub .parquet) - trajektorie zapisywane są obok (trajectory_path)
+        output_path: Opcjonalny plik nagrania z naniesionymi pojazdami (rysowanego z połączonych trajektorii)
+        workers: Liczba procesów roboczych
+        segments: Liczba fragmentów (domyślnie równa liczbie procesów)
+        overlap: Rozbieg fragmentu w sekundach (przetwarzany również przez poprzedni fragment)
+        processor_options: Dodatkowe argumenty VideoProcessor (batch_size, detection_stride, ...)
+    Returns:
+        Liczba policzonych pojazdów
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Failed to open the video")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    plan = plan_segments(total_frames, fps, segments or workers, overlap)
+    workers = max(1, min(workers, len(plan)))
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    work_dir = tempfile.mkdtemp(prefix=f"{name}.segments.", dir=os.path.dirname(os.path.abspath(output_file)))
+
+    # Fragmenty są krótkie i zapisywane w katalogu tymczasowym - bez punktów kontrolnych
+    processor_options = {key: value for key, value in processor_options.items()
+                         if key not in ("checkpoint_interval", "resume")}
+    tracker_options = processor_options.get("tracker_options") or {}
+    counted_speed = tracker_options.get("counted_speed", COUNTED_SPEED)
+    max_frames_missing = tracker_options.get("max_frames_missing", MAX_FRAMES_MISSING)
+    options = {
+        "drone_model": drone_model,
+        "start_altitude": start_altitude,
+        "model_path": model_path,
+        "processor_options": dict(processor_options, trajectories=True),    # Trajektorie są potrzebne do łączenia
+    }
+    if processor_options.get("detector") is None:
+        prepare_model(model_path, video_path, processor_options.get("backend", "torch"), processor_options.get("int8", False))
+    jobs = [(video_path, work_dir, index, bounds, options) for index, bounds in enumerate(plan)]
+    print(f"Processing {name} in {len(plan)} segments with {workers} workers...")
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")  # Bezpieczne dla CUDA i MPS
+    try:
+        results = [None] * len(plan)
+        with context.Pool(workers) as pool:
+            for index, segment_file, frames, seconds in pool.imap_unordered(_process_segment, jobs):
+                results[index] = segment_file
+                print(f"Segment {index + 1}/{len(plan)}: {frames} frames in {seconds:.1f} s")
+
+            segment_tables = [(pd.read_csv(path), pd.read_csv(trajectory_path(path))) for path in results]
+            per_second, trajectories, car_counter = stitch_segments(segment_tables, plan, fps, counted_speed)
+
+            file_format = analytics_format(output_file)
+            for path, columns, table in ((output_file, SECOND_COLUMNS, per_second),
+                                         (trajectory_path(output_file), TRAJECTORY_COLUMNS, trajectories)):
+                writer = TableWriter(path, columns, file_format)
+                writer.append(**{column: table[column].to_numpy() for column in columns})
+                writer.close()
+
+            if output_path:
+                # Rysowanie fragmentów z globalnymi identyfikatorami - bez ponownej detekcji.
+                # Pojazd jest rysowany od klatki, w której został policzony (jak w CarContainer)
+                trajectories["counted"] = (trajectories["avg_speed_kmh"] > counted_speed).groupby(trajectories["id"]).cummax()
+                counted = trajectories[trajectories["counted"]].groupby("id")["frame"].min()
+                render_jobs = []
+                for index, (_, segment_start, segment_end) in enumerate(plan):
+                    tracks = trajectories[(trajectories["frame"] > segment_start - HISTORY - max_frames_missing) &
+                                          (trajectories["frame"] <= segment_end)]
+                    counted_before = int((counted <= segment_start).sum())
+                    render_jobs.append((video_path, os.path.join(work_dir, f"segment{index:04d}.mp4"),
+                                        (segment_start, segment_end), tracks, counted_before, max_frames_missing,
+                                        encoder_options or {}))
+                concatenate_videos(pool.map(_render_segment, render_jobs), output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {total_frames} frames in {elapsed:.1f} s ({total_frames / max(elapsed, 1e-9):.1f} fps), "
+          f"{car_counter} vehicles counted")
+    return car_counter
@@ -0,0 +1,173 @@
+import numpy as np
+
+MAX_POINTS = 400    # Maksymalna liczba rysowanych punktów serii (dłuższe historie są zmniejszane algorytmem LTTB)
+LIMIT_HEADROOM = 1.5    # Zapas zakresu osi - pełne przerysowanie tylko przy jego przekroczeniu
+SPEED_LIMIT = 100   # Początkowy zakres osi prędkości (km/h)
+TITLE = "Speed Graph"
+VEHICLE_COLORS = ("tab:blue", "tab:orange", "tab:green", "tab:purple", "tab:brown", "tab:pink", "tab:gray", "tab:olive", "tab:cyan")
+FLEET_COLOR = "tab:red"
+
+
+def lttb(x, y, threshold):
+    """
+    Indeksy punktów serii wybranych algorytmem Largest-Triangle-Three-Buckets - zachowuje kształt wykresu
+    (ekstrema i zmiany trendu) przy stałej liczbie punktów
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, count - 1
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)  # Granice threshold - 2 kubełków środkowych
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]   # Ostatni kubełek - trójkąt z ostatnim punktem serii
+        # Pole trójkąta (wybrany punkt, punkt kubełka, średnia następnego kubełka)
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def downsample(x, y, max_points=MAX_POINTS):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    indices = lttb(x, y, max_points)
+    return x[indices], y[indices]
+
+
+class SpeedChart:
+    """
+    Wykres prędkości uśrednionej wielu pojazdów i średniej prędkości wszystkich pojazdów w kolejnych sekundach.
+    Linie tworzone są raz, a przy odświeżeniu zmieniane są tylko ich dane i rysowane na zapamiętanym tle (blitting).
+    Pełne przerysowanie (osie, legenda) następuje tylko przy zmianie listy pojazdów lub przekroczeniu zakresu osi
+    """
+    def __init__(self, figure, canvas, max_points=MAX_POINTS):
+        """
+        Args:
+            figure: Figure matplotlib
+            canvas: Płótno figury (np. FigureCanvasTkAgg) z obsługą copy_from_bbox i blit
+            max_points: Maksymalna liczba rysowanych punktów serii
+        """
+        self.figure = figure
+        self.canvas = canvas
+        self.max_points = max_points
+        figure.clear()
+        self.vehicle_ax, self.fleet_ax = figure.subplots(2, 1, gridspec_kw={"height_ratios": [2, 1]})
+        self.vehicle_ax.set_title(TITLE, fontsize=14, fontweight="bold")
+        self.vehicle_ax.set_ylabel("Velocity (km/h)", fontsize=12)
+        self.vehicle_ax.set_xlabel("Averaged samples", fontsize=10)
+        self.fleet_ax.set_ylabel("Avg (km/h)", fontsize=12)
+        self.fleet_ax.set_xlabel("Time (s)", fontsize=10)
+        for ax in (self.vehicle_ax, self.fleet_ax):
+            ax.set_xlim(0, 10)
+            ax.set_ylim(0, SPEED_LIMIT)
+        figure.tight_layout()
+
+        self.lines = {} # Identyfikator pojazdu -> linia
+        self.samples = {}   # Identyfikator pojazdu -> (długość historii, punkty po LTTB) - bez ponownego liczenia niezmienionej historii
+        self.fleet_line, = self.fleet_ax.plot([], [], color=FLEET_COLOR, linewidth=2, animated=True)
+        self.fleet_text = self.fleet_ax.text(0.01, 0.9, "", transform=self.fleet_ax.transAxes, va="top", animated=True)
+        self.background = None
+        canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _animated(self):
+        return [*self.lines.values(), self.fleet_line, self.fleet_text]
+
+    def _on_draw(self, event):
+        """
+        Zapamiętanie tła (osie, siatka, legenda) po pełnym przerysowaniu i narysowanie na nim linii
+        """
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self._animated():
+            self.figure.draw_artist(artist)
+
+    def set_vehicles(self, car_ids):
+        """
+        Ustawienie obserwowanych pojazdów - linie nowych pojazdów są tworzone, a pozostałych usuwane
+        Returns:
+            True, jeżeli lista pojazdów się zmieniła (wymagane pełne przerysowanie)
+        """
+        car_ids = list(dict.fromkeys(car_ids))
+        if list(self.lines) == car_ids:
+            return False
+        for car_id in [car_id for car_id in self.lines if car_id not in car_ids]:
+            self.lines.pop(car_id).remove()
+            self.samples.pop(car_id, None)
+        for car_id in car_ids:
+            if car_id not in self.lines:
+                color = VEHICLE_COLORS[car_id % len(VEHICLE_COLORS)]
+                self.lines[car_id], = self.vehicle_ax.plot([], [], color=color, linewidth=2,
+                                                           label=f"Vehicle ID {car_id}", animated=True)
+        self.lines = {car_id: self.lines[car_id] for car_id in car_ids}
+        legend = self.vehicle_ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if car_ids:
+            self.vehicle_ax.legend(handles=list(self.lines.values()), fontsize=9, loc="upper right", frameon=True,
+                                   ncol=1 + (len(car_ids) - 1) // 6)
+        return True
+
+    def _fit_limits(self, ax, x_max, y_max):
+        """
+        Powiększenie zakresu osi z zapasem, jeżeli dane go przekraczają
+        Returns:
+            True, jeżeli zakres został zmieniony (wymagane pełne przerysowanie)
+        """
+        changed = False
+        if x_max > ax.get_xlim()[1]:
+            ax.set_xlim(0, x_max * LIMIT_HEADROOM)
+            changed = True
+        if y_max > ax.get_ylim()[1]:
+            ax.set_ylim(0, np.ceil(y_max * LIMIT_HEADROOM / 10) * 10)
+            changed = True
+        return changed
+
+    def update(self, vehicle_speeds, fleet_times=(), fleet_speeds=()):
+        """
+        Odświeżenie wykresu
+        Args:
+            vehicle_speeds: Słownik identyfikator pojazdu -> historia prędkości uśrednionej (km/h)
+            fleet_times: Czas (s) kolejnych pomiarów średniej prędkości wszystkich pojazdów
+            fleet_speeds: Średnia prędkość wszystkich pojazdów (km/h)
+        """
+        redraw = self.set_vehicles(vehicle_speeds)
+        if self.vehicle_ax.get_title() != TITLE:    # Usunięcie komunikatu z show_message
+            self.vehicle_ax.set_title(TITLE, fontsize=14, fontweight="bold")
+            redraw = True
+        x_max, y_max = 0, 0
+        for car_id, speeds in vehicle_speeds.items():
+            count = len(speeds) if speeds is not None else 0
+            cached = self.samples.get(car_id)
+            if cached is None or cached[0] != count:
+                x, y = downsample(np.arange(count), speeds if count else [], self.max_points)
+                self.samples[car_id] = (count, x, y)
+                self.lines[car_id].set_data(x, y)
+            _, x, y = self.samples[car_id]
+            if len(x):
+                x_max, y_max = max(x_max, x[-1]), max(y_max, y.max())
+        redraw |= self._fit_limits(self.vehicle_ax, x_max, y_max)
+
+        x, y = downsample(fleet_times, fleet_speeds, self.max_points)
+        self.fleet_line.set_data(x, y)
+        self.fleet_text.set_text(f"Fleet avg: {y[-1]:.0f} km/h" if len(y) else "")
+        if len(x):
+            redraw |= self._fit_limits(self.fleet_ax, x[-1], y.max())
+
+        if redraw or self.background is None:
+            self.canvas.draw()  # Tło zapamiętywane w _on_draw
+            return
+        self.canvas.restore_region(self.background)
+        for artist in self._animated():
+            self.figure.draw_artist(artist)
+        self.canvas.blit(self.figure.bbox)
+
+    def show_message(self, text):
+        """
+        Komunikat w tytule wykresu (np. brak danych lub błąd) - pełne przerysowanie
+        """
+        self.vehicle_ax.set_title(text, fontsize=12)
+        self.canvas.draw()
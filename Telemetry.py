@@ -0,0 +1,124 @@
+import os
+import re
+import numpy as np
+
+# Pola odczytywane z pliku SRT drona DJI
+TELEMETRY_DTYPE = np.dtype([
+    ("frame", np.int64),    # Numer klatki (FrameCnt)
+    ("timestamp", np.float64),  # Początek napisu w sekundach od początku nagrania
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("altitude", np.float64),   # Wysokość zapisywana przez starsze drony (np. DJI air 2s)
+    ("rel_alt", np.float64),    # Wysokość względem miejsca startu
+    ("abs_alt", np.float64),    # Wysokość bezwzględna
+    ("iso", np.float64),
+    ("shutter", np.float64),    # Czas naświetlania w sekundach
+    ("fnum", np.float64),
+    ("ev", np.float64),
+    ("focal_len", np.float64),
+    ("ct", np.float64), # Temperatura barwowa
+])
+
+# Nazwy pól w pliku SRT, które różnią się między modelami i wersjami oprogramowania dronów
+FIELD_ALIASES = {"framecnt": "frame", "longtitude": "longitude"}
+
+_TIMECODE = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->")
+_FIELD = re.compile(r"(\w+)\s*:\s*(-?[\d.]+(?:/[\d.]+)?)")
+
+
+def _parse_value(value):
+    if "/" in value:    # Czas naświetlania zapisywany jako ułamek
+        numerator, denominator = value.split("/")
+        return float(numerator) / float(denominator)
+    return float(value)
+
+
+def parse_srt(srt_path):
+    """
+    Jednokrotny odczyt wszystkich pól telemetrii z pliku SRT do tablicy strukturalnej (jeden wiersz na napis)
+    """
+    try:
+        with open(srt_path, 'r', encoding='utf-8', errors='replace') as file:
+            text = file.read()
+    except FileNotFoundError:
+        raise ValueError(f"SRT file not found: {srt_path}")
+
+    blocks = re.split(r"\n\s*\n", text.replace("\r\n", "\n"))
+    telemetry = np.zeros(len(blocks), dtype=TELEMETRY_DTYPE)
+    telemetry["frame"] = -1
+    for name in TELEMETRY_DTYPE.names[1:]:
+        telemetry[name] = np.nan    # Brak pola w pliku SRT
+    count = 0
+    for block in blocks:
+        timecode = _TIMECODE.search(block)
+        if not timecode:
+            continue
+        hours, minutes, seconds, milliseconds = timecode.groups()
+        row = telemetry[count]
+        row["timestamp"] = int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(milliseconds) / 10 ** len(milliseconds)
+        for key, value in _FIELD.findall(block[timecode.end():]):
+            key = key.lower()
+            key = FIELD_ALIASES.get(key, key)
+            if key in TELEMETRY_DTYPE.names and key != "timestamp":
+                row[key] = _parse_value(value)
+        count += 1
+
+    telemetry = telemetry[:count]
+    if count == 0 or np.all(np.isnan(telemetry["latitude"])) or np.all(np.isnan(telemetry["longitude"])):
+        raise ValueError(f"No data found in the SRT file")
+    return telemetry
+
+
+def load_telemetry(srt_path, use_cache=True):
+    """
+    Odczyt telemetrii z pliku SRT z wykorzystaniem binarnego pliku pomocniczego (.telemetry.npy) przy kolejnych uruchomieniach
+    """
+    cache_path = srt_path + ".telemetry.npy"
+    if use_cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(srt_path):
+        try:
+            telemetry = np.load(cache_path)
+            if telemetry.dtype == TELEMETRY_DTYPE:
+                return telemetry
+        except (OSError, ValueError):
+            pass
+
+    telemetry = parse_srt(srt_path)
+    if use_cache:
+        try:
+            tmp_path = cache_path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.save(file, telemetry)
+            os.replace(tmp_path, cache_path)   # Zapis atomowy
+        except OSError as e:
+            print(f"Could not save telemetry cache: {e}")
+    return telemetry
+
+
+def align_to_frames(telemetry, total_frames, fps):
+    """
+    Interpolacja telemetrii do chwil kolejnych klatek nagrania (wartości spoza zakresu przyjmują skrajne wartości)
+    """
+    total_frames = max(int(total_frames), len(telemetry))
+    frame_times = np.arange(total_frames) / fps
+    aligned = np.zeros(total_frames, dtype=TELEMETRY_DTYPE)
+    aligned["frame"] = np.arange(total_frames)
+    aligned["timestamp"] = frame_times
+    times = telemetry["timestamp"]
+    for name in TELEMETRY_DTYPE.names[2:]:
+        values = telemetry[name]
+        valid = ~np.isnan(values)
+        if not valid.any():
+            aligned[name] = np.nan
+            continue
+        aligned[name] = np.interp(frame_times, times[valid], values[valid])
+    return aligned
+
+
+def altitudes(telemetry):
+    """
+    Wysokość drona - pole altitude, a jeżeli nie jest zapisywane to rel_alt
+    """
+    for name in ("altitude", "rel_alt"):
+        if not np.all(np.isnan(telemetry[name])):
+            return telemetry[name]
+    raise ValueError(f"No data found in the SRT file")
@@ -0,0 +1,88 @@
+import math
+import cv2
+import numpy as np
+
+VEHICLE_LENGTH = 4.5    # Typowa długość samochodu osobowego w metrach
+MIN_OBJECT_PX = 24  # Minimalna długość pojazdu (w pikselach wejścia modelu) pozwalająca na jego wykrycie
+MIN_TILE_SIZE = 320 # Minimalny rozmiar kafla w pikselach
+NMS_THRESHOLD = 0.5 # Próg pokrycia (względem mniejszej ramki) przy łączeniu detekcji z sąsiednich kafli
+
+
+def choose_tile_size(gsd, frame_width, frame_height, imgsz):
+    """
+    Dobór rozmiaru kafla tak, aby pojazd po przeskalowaniu do imgsz miał co najmniej MIN_OBJECT_PX pikseli
+    (None oznacza, że wystarczy detekcja na całej klatce)
+    """
+    vehicle_px = VEHICLE_LENGTH / gsd
+    if vehicle_px * imgsz / max(frame_width, frame_height) >= MIN_OBJECT_PX:
+        return None
+    tile_size = int(imgsz * vehicle_px / MIN_OBJECT_PX) // 32 * 32
+    return int(np.clip(tile_size, MIN_TILE_SIZE, min(frame_width, frame_height)))
+
+
+def tile_overlap(gsd, tile_size):
+    """
+    Zakładka pomiędzy kaflami - pojazd na granicy kafla mieści się w całości w sąsiednim kaflu
+    """
+    return min(tile_size // 2, math.ceil(1.5 * VEHICLE_LENGTH / gsd))
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    return starts + [length - tile_size]    # Ostatni kafel dosunięty do krawędzi klatki
+
+
+def tile_origins(frame_width, frame_height, tile_size, overlap, region=None, mask=None):
+    """
+    Lewe górne narożniki kafli pokrywających klatkę z pominięciem kafli poza regionem śledzenia lub maską dróg
+    Args:
+        region: Region śledzenia ((x1, y1), (x2, y2))
+        mask: Maska dróg (tablica bool o wymiarach klatki)
+    """
+    origins = []
+    for y in _tile_starts(frame_height, tile_size, overlap):
+        for x in _tile_starts(frame_width, tile_size, overlap):
+            if region is not None:
+                (x1, y1), (x2, y2) = region
+                if x + tile_size <= x1 or x >= x2 or y + tile_size <= y1 or y >= y2:
+                    continue
+            if mask is not None and not mask[y:y + tile_size, x:x + tile_size].any():
+                continue
+            origins.append((x, y))
+    return origins
+
+
+def rotated_intersection(box, other):
+    """
+    Pole przecięcia dwóch obróconych ramek (x, y, szerokość, wysokość, kąt w radianach)
+    """
+    x, y, w, h, r = box
+    xo, yo, wo, ho, ro = other
+    if math.hypot(x - xo, y - yo) > (max(w, h) + max(wo, ho)) / 2:   # Ramki nie mogą się przecinać
+        return 0.0
+    status, points = cv2.rotatedRectangleIntersection(((float(x), float(y)), (float(w), float(h)), math.degrees(r)),
+                                                      ((float(xo), float(yo)), (float(wo), float(ho)), math.degrees(ro)))
+    if status == cv2.INTERSECT_NONE or points is None:
+        return 0.0
+    return cv2.contourArea(cv2.convexHull(points))
+
+
+def rotated_nms(xywhr, confidences, threshold=NMS_THRESHOLD):
+    """
+    Usuwanie powielonych obróconych ramek (kąt w radianach), zwraca indeksy zachowanych ramek
+    """
+    order = np.argsort(-confidences)
+    kept = []
+    for i in order:
+        w, h = xywhr[i, 2:4]
+        duplicate = False
+        for j in kept:
+            wj, hj = xywhr[j, 2:4]
+            if rotated_intersection(xywhr[i], xywhr[j]) / max(min(w * h, wj * hj), 1e-6) > threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(i)
+    return np.array(kept, dtype=int)
@@ -0,0 +1,123 @@
+import os
+from threading import Lock
+import numpy as np
+
+# Nagłówek rekordu: identyfikator pojazdu, kod typu, znacznik zakończenia śledzenia i liczba zapisanych prędkości
+RECORD_HEADER = np.dtype([("id", "<i8"), ("type", "i1"), ("final", "?"), ("count", "<i4")])
+SPEED_DTYPE = np.dtype("<f4")
+INDEX_CAPACITY = 1024   # Początkowa liczba rekordów w indeksie (powiększana automatycznie)
+
+
+class TrackArchive:
+    """
+    Plik z historiami prędkości pojazdów dopisywanymi na końcu (append-only). Każdy rekord to nagłówek i fragment
+    historii uśrednionej prędkości - pojazd może mieć kilka rekordów, jeżeli jego historia nie mieściła się w pamięci.
+    W pamięci przechowywany jest tylko indeks (identyfikator, położenie i długość rekordu)
+    """
+    def __init__(self, path, state=None):
+        """
+        Args:
+            path: Ścieżka pliku (istniejący plik jest zastępowany)
+            state: Stan z get_state - rekordy dopisane po punkcie kontrolnym są usuwane, a zapis jest kontynuowany
+        """
+        self.path = path
+        self.lock = Lock()  # Odczyt z wątku interfejsu w trakcie zapisu z wątku przetwarzania
+        self.size = 0
+        self.records = 0
+        self.index_ids = np.zeros(INDEX_CAPACITY, dtype=np.int64)
+        self.index_offsets = np.zeros(INDEX_CAPACITY, dtype=np.int64)   # Położenie danych rekordu w pliku
+        self.index_counts = np.zeros(INDEX_CAPACITY, dtype=np.int32)
+        if state is None:
+            self.file = open(path, "wb")
+            return
+        if not os.path.isfile(path) or os.path.getsize(path) < state["size"]:
+            raise ValueError(f"Cannot resume: {path} is missing or shorter than at the checkpoint "
+                             f"- remove the checkpoint to start from the beginning")
+        self.file = open(path, "r+b")
+        self.file.truncate(state["size"])
+        self.file.seek(state["size"])
+        self.size = state["size"]
+        self.records = len(state["ids"])
+        while len(self.index_ids) < self.records:
+            self._grow_index()
+        self.index_ids[:self.records] = state["ids"]
+        self.index_offsets[:self.records] = state["offsets"]
+        self.index_counts[:self.records] = state["counts"]
+
+    def _grow_index(self):
+        extra = len(self.index_ids)
+        self.index_ids = np.concatenate([self.index_ids, np.zeros(extra, dtype=np.int64)])
+        self.index_offsets = np.concatenate([self.index_offsets, np.zeros(extra, dtype=np.int64)])
+        self.index_counts = np.concatenate([self.index_counts, np.zeros(extra, dtype=np.int32)])
+
+    def append(self, car_id, vehicle_type, speeds, final=False):
+        """
+        Dopisanie fragmentu historii prędkości pojazdu
+        Args:
+            vehicle_type: Kod typu pojazdu (indeks w VEHICLE_TYPES)
+            speeds: Kolejne prędkości uśrednione w km/h
+            final: Ostatni fragment - śledzenie pojazdu zostało zakończone
+        """
+        speeds = np.asarray(speeds, dtype=SPEED_DTYPE)
+        header = np.array([(car_id, vehicle_type, final, len(speeds))], dtype=RECORD_HEADER)
+        with self.lock:
+            if self.records == len(self.index_ids):
+                self._grow_index()
+            self.file.write(header.tobytes())
+            self.file.write(speeds.tobytes())
+            self.index_ids[self.records] = car_id
+            self.index_offsets[self.records] = self.size + RECORD_HEADER.itemsize
+            self.index_counts[self.records] = len(speeds)
+            self.records += 1
+            self.size += RECORD_HEADER.itemsize + speeds.nbytes
+
+    def read(self, car_id):
+        """
+        Cała zapisana historia prędkości pojazdu (pusta tablica dla nieznanego pojazdu)
+        """
+        with self.lock:
+            records = np.flatnonzero(self.index_ids[:self.records] == car_id)
+            if len(records) == 0:
+                return np.zeros(0)
+            if not self.file.closed:
+                self.file.flush()   # Odczyt danych pozostających w buforze zapisu
+            offsets, counts = self.index_offsets[records], self.index_counts[records]
+        parts = []
+        with open(self.path, "rb") as file:
+            for offset, count in zip(offsets, counts):
+                file.seek(offset)
+                parts.append(np.fromfile(file, dtype=SPEED_DTYPE, count=count))
+        return np.concatenate(parts).astype(float)
+
+    def get_state(self):
+        """
+        Rozmiar pliku i indeks rekordów (dane są przekazywane na dysk przed zapisem punktu kontrolnego)
+        """
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+            return {"size": self.size, "ids": self.index_ids[:self.records].copy(),
+                    "offsets": self.index_offsets[:self.records].copy(), "counts": self.index_counts[:self.records].copy()}
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    @staticmethod
+    def load(path):
+        """
+        Odczyt wszystkich rekordów pliku - słownik identyfikator -> (kod typu, historia prędkości)
+        """
+        tracks = {}
+        data = np.fromfile(path, dtype=np.uint8)
+        offset = 0
+        while offset < len(data):
+            header = data[offset:offset + RECORD_HEADER.itemsize].view(RECORD_HEADER)[0]
+            offset += RECORD_HEADER.itemsize
+            size = int(header["count"]) * SPEED_DTYPE.itemsize
+            speeds = data[offset:offset + size].view(SPEED_DTYPE).astype(float)
+            offset += size
+            vehicle_type, history = tracks.get(int(header["id"]), (int(header["type"]), np.zeros(0)))
+            tracks[int(header["id"])] = (vehicle_type, np.concatenate([history, speeds]))
+        return tracks
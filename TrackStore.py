@@ -0,0 +1,315 @@
+import numpy as np
+from MotionModel import QuadraticMotionModel
+
+HISTORY = 10    # Liczba zapamiętywanych pozycji i prędkości dla pojazdu
+REAL_SPEED_HISTORY = 256    # Liczba prędkości uśrednionych przechowywanych w pamięci dla pojazdu
+MIN_REAL_SPEED_HISTORY = 16 # Najkrótsza historia prędkości uśrednionych przy ograniczonym budżecie pamięci
+VEHICLE_TYPES = ('small', 'large')  # Kody typów pojazdów przechowywane w tablicy types
+# Tablice z jednym wierszem na pojazd
+ARRAYS = ("positions", "position_heads", "position_counts", "approximated", "approximated_counts",
+          "speeds", "speed_heads", "speed_counts", "active", "ids", "types", "is_detected",
+          "frames_since_seen", "speed", "real_speed", "detection_counter",
+          "real_speed_histories", "real_speed_counts", "real_speed_totals")
+
+
+def window_fps(frame_times, history, fps):
+    """
+    Liczba klatek na sekundę w oknie ostatnich history klatek wyznaczona z rzeczywistych czasów klatek
+    (strumień na żywo z odrzucanymi klatkami) - przy krótszej historii czasów stałe fps
+    """
+    if frame_times is None or len(frame_times) < history or frame_times[-1] <= frame_times[-history]:
+        return fps
+    return (history - 1) / (frame_times[-1] - frame_times[-history])
+
+
+class TrackStore:
+    """
+    Stan wszystkich śledzonych pojazdów przechowywany w tablicach NumPy (jeden wiersz na pojazd).
+    Historie pozycji i prędkości są buforami cyklicznymi o stałym rozmiarze
+    """
+    def __init__(self, capacity=64, history=HISTORY, motion_model=None, real_speed_history=REAL_SPEED_HISTORY,
+                 memory_budget=None):
+        """
+        Args:
+            capacity: Początkowa liczba miejsc na pojazdy (powiększana automatycznie)
+            history: Długość historii pozycji i prędkości
+            motion_model: Model ruchu do aproksymacji i przewidywania pozycji (domyślnie QuadraticMotionModel)
+            real_speed_history: Liczba prędkości uśrednionych przechowywanych w pamięci dla pojazdu
+                                (starsze są przekazywane do funkcji spill)
+            memory_budget: Maksymalny rozmiar historii prędkości uśrednionych w bajtach - przy powiększaniu magazynu
+                           historia jest skracana, a starsze prędkości przekazywane wcześniej do funkcji spill
+        """
+        self.capacity = capacity
+        self.history = history
+        self.real_speed_limit = real_speed_history
+        self.memory_budget = memory_budget
+        self.spill = None   # Funkcja spill(slot, prędkości, final) zapisująca starszą lub zakończoną historię prędkości
+        self.motion_model = motion_model if motion_model is not None else QuadraticMotionModel(history)
+
+        # Historia pozycji (x, y, szerokość, wysokość, kąt) jako bufor cykliczny
+        self.positions = np.zeros((capacity, history, 5))
+        self.position_heads = np.zeros(capacity, dtype=np.int64)    # Indeks kolejnego zapisu
+        self.position_counts = np.zeros(capacity, dtype=np.int64)   # Liczba zapisanych pozycji
+
+        # Aproksymowane pozycje (x, y) uporządkowane od najstarszej i wyrównane do końca okna
+        self.approximated = np.zeros((capacity, history, 2))
+        self.approximated_counts = np.zeros(capacity, dtype=np.int64)
+
+        # Historia prędkości jako bufor cykliczny
+        self.speeds = np.zeros((capacity, history))
+        self.speed_heads = np.zeros(capacity, dtype=np.int64)
+        self.speed_counts = np.zeros(capacity, dtype=np.int64)
+
+        # Wartości skalarne dla każdego pojazdu
+        self.active = np.zeros(capacity, dtype=bool)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.types = np.zeros(capacity, dtype=np.int8)
+        self.is_detected = np.zeros(capacity, dtype=bool)
+        self.frames_since_seen = np.zeros(capacity, dtype=np.int64)
+        self.speed = np.zeros(capacity)
+        self.real_speed = np.zeros(capacity)
+        self.detection_counter = np.zeros(capacity, dtype=np.int64)
+
+        # Historia uśrednionej prędkości - ostatnie real_speed_limit wartości uporządkowane od najstarszej
+        self.real_speed_histories = np.zeros((capacity, real_speed_history))
+        self.real_speed_counts = np.zeros(capacity, dtype=np.int64)    # Liczba wartości w pamięci
+        self.real_speed_totals = np.zeros(capacity, dtype=np.int64)    # Liczba wszystkich wartości (również zapisanych przez spill)
+        self._fit_budget()
+
+    def _grow(self):
+        """
+        Podwojenie liczby miejsc na pojazdy
+        """
+        extra = self.capacity
+        for name in ARRAYS:
+            array = getattr(self, name)
+            padding = np.zeros((extra, *array.shape[1:]), dtype=array.dtype)
+            setattr(self, name, np.concatenate([array, padding]))
+        self.capacity += extra
+        self._fit_budget()
+
+    def _fit_budget(self):
+        """
+        Skrócenie historii prędkości uśrednionych, jeżeli przy obecnej liczbie miejsc przekracza budżet pamięci
+        """
+        if not self.memory_budget:
+            return
+        itemsize = self.real_speed_histories.itemsize
+        limit = max(MIN_REAL_SPEED_HISTORY, int(self.memory_budget // (self.capacity * itemsize)))
+        if limit >= self.real_speed_limit:
+            return
+        for slot in np.flatnonzero(self.active & (self.real_speed_counts > limit)):
+            self.spill_history(slot, keep=limit // 2)
+        self.real_speed_histories = self.real_speed_histories[:, :limit].copy()
+        self.real_speed_limit = limit
+
+    def get_state(self):
+        """
+        Kopia wszystkich tablic do zapisu punktu kontrolnego
+        """
+        return dict({name: getattr(self, name).copy() for name in ARRAYS}, real_speed_limit=self.real_speed_limit)
+
+    def set_state(self, state):
+        for name in ARRAYS:
+            setattr(self, name, np.array(state[name]))
+        self.capacity = len(self.active)
+        self.real_speed_limit = state["real_speed_limit"]
+
+    def allocate(self, position, vehicle_type):
+        """
+        Zajęcie miejsca dla nowego pojazdu, zwraca indeks wiersza
+        """
+        free = np.flatnonzero(~self.active)
+        if len(free) == 0:
+            self._grow()
+            free = np.flatnonzero(~self.active)
+        slot = int(free[0])
+
+        self.active[slot] = True
+        self.ids[slot] = 0
+        self.types[slot] = VEHICLE_TYPES.index(vehicle_type)
+        self.is_detected[slot] = False
+        self.frames_since_seen[slot] = 0
+        self.speed[slot] = 0.0
+        self.real_speed[slot] = 0.0
+        self.detection_counter[slot] = 0
+        self.real_speed_counts[slot] = 0
+        self.real_speed_totals[slot] = 0
+        self.speeds[slot] = 0.0
+        self.speed_heads[slot] = 0
+        self.speed_counts[slot] = 0
+        self.approximated_counts[slot] = 0
+        self.set_positions(slot, np.asarray([position], dtype=float))
+        return slot
+
+    def release(self, slots):
+        """
+        Zwolnienie miejsc usuniętych pojazdów - pozostała historia prędkości jest przekazywana do funkcji spill
+        """
+        for slot in np.atleast_1d(slots):
+            if self.real_speed_totals[slot]:
+                self.spill_history(slot, final=True)
+        self.active[slots] = False
+
+    def spill_history(self, slot, keep=0, final=False):
+        """
+        Przekazanie najstarszej historii prędkości uśrednionych do funkcji spill (w pamięci zostaje keep ostatnich wartości)
+        Args:
+            final: Śledzenie pojazdu zostało zakończone
+        """
+        count = self.real_speed_counts[slot]
+        spilled = count - keep
+        if self.spill is not None and (spilled > 0 or final):
+            self.spill(slot, self.real_speed_histories[slot, :spilled].copy(), final)
+        if spilled > 0:
+            self.real_speed_histories[slot, :keep] = self.real_speed_histories[slot, spilled:count]
+            self.real_speed_counts[slot] = keep
+
+    def get_real_speeds(self, slot):
+        """
+        Historia prędkości uśrednionych pojazdu przechowywana w pamięci, uporządkowana od najstarszej
+        """
+        return self.real_speed_histories[slot, :self.real_speed_counts[slot]]
+
+    def active_slots(self):
+        return np.flatnonzero(self.active)
+
+    def get_positions(self, slot):
+        """
+        Historia pozycji pojazdu uporządkowana od najstarszej
+        """
+        count = self.position_counts[slot]
+        order = (self.position_heads[slot] - count + np.arange(count)) % self.history
+        return self.positions[slot, order]
+
+    def set_positions(self, slot, positions):
+        """
+        Zastąpienie całej historii pozycji (zachowywane są ostatnie pozycje)
+        """
+        positions = positions[-self.history:]
+        count = len(positions)
+        self.positions[slot, :count] = positions
+        self.position_heads[slot] = count % self.history
+        self.position_counts[slot] = count
+
+    def current_positions(self, slots):
+        """
+        Ostatnie pozycje (x, y, szerokość, wysokość, kąt) wielu pojazdów
+        """
+        return self.positions[slots, (self.position_heads[slots] - 1) % self.history]
+
+    def get_approximated(self, slot):
+        return self.approximated[slot, self.history - self.approximated_counts[slot]:]
+
+    def set_approximated(self, slot, approximated):
+        count = len(approximated)
+        self.approximated[slot, self.history - count:] = approximated
+        self.approximated_counts[slot] = count
+
+    def windows(self, slots):
+        """
+        Ostatnie pozycje (x, y) wielu pojazdów wyrównane do końca okna - tablica (pojazdy, history, 2).
+        Początkowe wiersze pojazdów z krótszą historią nie mają znaczenia (ich wagi w modelu ruchu są zerowe)
+        """
+        order = (self.position_heads[slots, None] - self.history + np.arange(self.history)) % self.history
+        return self.positions[np.asarray(slots)[:, None], order, :2]
+
+    def predict_positions(self, slots):
+        """
+        Przewidywane pozycje (x, y) wielu pojazdów w kolejnej klatce
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        return self.motion_model.predict(self.windows(slots), self.position_counts[slots], self.frames_since_seen[slots])
+
+    def update_positions(self, slots, positions):
+        """
+        Dopisanie nowych pozycji wielu pojazdów, aproksymacja ruchu i reset licznika zgubionych pozycji
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        positions = np.asarray(positions, dtype=float)
+        frames_since_seen = self.frames_since_seen[slots]
+
+        # Dopisanie pozycji do buforów cyklicznych
+        heads = self.position_heads[slots]
+        self.positions[slots, heads] = positions
+        self.position_heads[slots] = (heads + 1) % self.history
+        self.position_counts[slots] = np.minimum(self.position_counts[slots] + 1, self.history)
+
+        # Wyznaczenie aproksymowanych pozycji
+        counts = self.position_counts[slots]
+        self.approximated[slots] = self.motion_model.smooth(self.windows(slots), counts, frames_since_seen)
+        self.approximated_counts[slots] = counts
+
+        # Jeśli pojazd był zgubiony, to następuje poprawa histori pozycji
+        corrected = (frames_since_seen > 1) & (counts >= self.history)
+        for slot, position, missing in zip(slots[corrected], positions[corrected], frames_since_seen[corrected]):
+            positions_history = self.get_positions(slot)[:-1]
+            last_values = self.get_approximated(slot)[:-2][-missing+1:]
+            last_values = np.hstack([last_values, np.tile(position[2:], (len(last_values), 1))])
+            self.set_positions(slot, np.vstack([positions_history, last_values, position]))
+
+        # Reset licznika zgubionych pozycji
+        self.frames_since_seen[slots] = 0
+
+    def get_speeds(self, slot):
+        """
+        Historia prędkości pojazdu uporządkowana od najstarszej
+        """
+        count = self.speed_counts[slot]
+        order = (self.speed_heads[slot] - count + np.arange(count)) % self.history
+        return self.speeds[slot, order]
+
+    def increment_missing_frames(self):
+        """
+        Zwiększenie licznika zgubionych pozycji wszystkich aktywnych pojazdów
+        """
+        self.frames_since_seen[self.active] += 1
+
+    def remove_missing(self, max_frames_missing):
+        """
+        Usunięcie pojazdów zgubionych przez co najmniej max_frames_missing klatek, zwraca zwolnione indeksy
+        """
+        removed = np.flatnonzero(self.active & (self.frames_since_seen >= max_frames_missing))
+        self.release(removed)
+        return removed
+
+    def calculate_speeds(self, slots, fps, scale):
+        """
+        Obliczenie prędkości dla wielu pojazdów jednocześnie na podstawie aproksymowanych pozycji
+        Args:
+            slots: Indeksy pojazdów zaktualizowanych w bieżącej klatce
+            fps: Liczba klatek na sekundę (przy odrzucanych klatkach - wynik window_fps dla czasów bieżącego okna)
+            scale: Poziome i pionowe GSD do przeliczania pikseli na metry
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        slots = slots[self.position_counts[slots] >= self.history]   # Minimum 10 pozycji aby obliczyć prędkość
+        if len(slots) == 0:
+            return
+
+        # Średnia różnica kolejnych aproksymowanych pozycji (w pikselach na klatkę)
+        full = self.approximated_counts[slots] >= self.history
+        velocities = np.zeros((len(slots), 2))
+        velocities[full] = np.diff(self.approximated[slots[full]], axis=1).mean(axis=1)
+        speeds = np.linalg.norm(velocities * scale, axis=1) * fps * 3.6 # Prędkość w km/h
+        self.speed[slots] = speeds
+
+        # Aktualizacja historii prędkości
+        heads = self.speed_heads[slots]
+        self.speeds[slots, heads] = speeds
+        self.speed_heads[slots] = (heads + 1) % self.history
+        self.speed_counts[slots] = np.minimum(self.speed_counts[slots] + 1, self.history)
+
+        # Aktualizacja prędkości uśrednionej co 10 detekcji
+        self.detection_counter[slots] += 1
+        averaged = slots[self.detection_counter[slots] >= self.history]
+        if len(averaged) == 0:
+            return
+        self.real_speed[averaged] = self.speeds[averaged].sum(axis=1) / self.speed_counts[averaged]
+        self.detection_counter[averaged] = 0
+
+        # Przy pełnej historii połowa najstarszych wartości jest przekazywana do funkcji spill
+        for slot in averaged[self.real_speed_counts[averaged] >= self.real_speed_limit]:
+            self.spill_history(slot, keep=self.real_speed_limit // 2)
+        self.real_speed_histories[averaged, self.real_speed_counts[averaged]] = self.real_speed[averaged]
+        self.real_speed_counts[averaged] += 1
+        self.real_speed_totals[averaged] += 1
@@ -1,15 +1,18 @@
+import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import cv2
 from PIL import Image, ImageTk
-from threading import Thread
+from threading import Thread, Event, Lock
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import seaborn as sns
 from VideoProcessor import VideoProcessor
+from SpeedChart import SpeedChart
+from FramePipeline import FramePipeline
+from VideoEncoder import VideoEncoder, segment_path
+from Checkpoint import CHECKPOINT_INTERVAL
 import time
-from queue import Queue
-import numpy as np
 
 # Słownik modeli dronów
 DRONES = {
@@ -17,6 +20,37 @@ DRONES = {
     "DJI air 2s": "DJI air 2s"
 }
 
+DISPLAY_INTERVAL = 33   # Odstęp odświeżania podglądu w ms
+PROGRESS_INTERVAL = 0.2 # Odstęp aktualizacji paska postępu w sekundach
+GRAPH_INTERVAL = 1000   # Odstęp odświeżania wykresu prędkości w ms
+
+
+class LatestFrame:
+    """
+    Bufor jednej klatki do wyświetlenia - wątek przetwarzania nigdy nie czeka na odświeżenie interfejsu,
+    a niewyświetlona klatka jest zastępowana nowszą
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.frame = None
+        self.dropped = 0    # Liczba klatek zastąpionych przed wyświetleniem
+
+    def publish(self, frame):
+        with self.lock:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+
+    def take(self):
+        with self.lock:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def clear(self):
+        with self.lock:
+            self.frame = None
+            self.dropped = 0
+
 
 class VideoApp:
     """
@@ -31,11 +65,22 @@ class VideoApp:
         self.video_path = None  # Ścieżka do nagrania
         self.output_path = None # Ścieżka do zapisu przetworzonego nagrania
         self.video_processor = None # Obiekt do przetwarzania klatek nagrania 
-        self.frame_queue = Queue(maxsize=2) # Kolejka klatek do wyświetlania
+        self.display_frame = LatestFrame()  # Ostatnia przetworzona klatka do wyświetlenia
+        self.worker_done = Event()  # Zakończenie wątku przetwarzania
+        self.worker_error = None
+        self.frame_image = None # Obraz Tk używany ponownie dla kolejnych klatek
+        self.canvas_item = None # Element canvas wyświetlający klatkę
+        self.canvas_size = None
+        self.progress_time = 0.0    # Czas ostatniej aktualizacji paska postępu
+        self.total_frames = 0
+        self.frame_count = 0
         self.fps = 0    # Wskaznik fps
-        self.prev_time = time.time()
+        self.prev_time = time.perf_counter()
+        self.prev_frame_count = 0   # Liczba klatek przy poprzedniej aktualizacji wskaźnika fps
         self.output_writer = None   # Obiekt zapisu filmu
+        self.pipeline = None    # Potokowe przetwarzanie nagrania
         self.start_coordiantes = None   # Wysokość startowa drona
+        self.current_car_ids = None # Pojazdy na wykresie prędkości
 
         # Konfiguracja motywu dla wykresu
         sns.set_theme(style="darkgrid")
@@ -64,11 +109,11 @@ class VideoApp:
         self.drone_model_menu = ttk.OptionMenu(settings_frame, self.drone_model_var, list(DRONES.keys())[0], *DRONES.keys())
         self.drone_model_menu.grid(row=2, column=1, padx=5, pady=5)
 
-        # UI: Wybór ID pojazdu
-        ttk.Label(settings_frame, text="Car ID:").grid(row=3, column=0, sticky="w", pady=5)
-        self.selected_car_id = tk.StringVar(value="0")
-        self.car_id_spinbox = ttk.Spinbox(settings_frame, from_=0, to=1000, width=20, textvariable=self.selected_car_id, wrap=True)
-        self.car_id_spinbox.grid(row=3, column=1, padx=5, pady=5)
+        # UI: Wybór ID pojazdów (oddzielone przecinkami)
+        ttk.Label(settings_frame, text="Car IDs:").grid(row=3, column=0, sticky="w", pady=5)
+        self.selected_car_ids = tk.StringVar(value="1")
+        self.car_ids_entry = ttk.Entry(settings_frame, width=20, textvariable=self.selected_car_ids)
+        self.car_ids_entry.grid(row=3, column=1, padx=5, pady=5)
 
         # UI: Wybór wysokości startowej
         ttk.Label(settings_frame, text="Start altitude:").grid(row=4, column=0, sticky="w", pady=5)
@@ -76,9 +121,21 @@ class VideoApp:
         self.start_coordiantes_entry = ttk.Entry(settings_frame, textvariable=self.start_coordiantes, width=20)
         self.start_coordiantes_entry.grid(row=4, column=1, padx=5, pady=5)
 
+        # UI: Przetwarzanie potokowe
+        self.pipeline_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame, text="Pipelined processing", variable=self.pipeline_var).grid(row=5, column=0, columnspan=2, sticky="w", pady=5)
+
+        # UI: Wznowienie od punktu kontrolnego
+        self.resume_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame, text="Resume", variable=self.resume_var).grid(row=5, column=2, sticky="w", pady=5)
+
+        # UI: Zapis punktów kontrolnych (<nagranie>.checkpoint.npz obok nagrania)
+        self.checkpoint_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame, text="Save checkpoints", variable=self.checkpoint_var).grid(row=6, column=0, columnspan=2, sticky="w", pady=5)
+
         # Panel kontrolny
         control_frame = ttk.Frame(settings_frame, padding=(10, 10))
-        control_frame.grid(row=5, column=0, columnspan=3, pady=10)
+        control_frame.grid(row=7, column=0, columnspan=3, pady=10)
         self.start_btn = ttk.Button(control_frame, text="Start", command=self.start_processing, state=tk.DISABLED)
         self.start_btn.grid(row=0, column=0, padx=5)
         self.stop_btn = ttk.Button(control_frame, text="Stop", command=self.stop_processing, state=tk.DISABLED)
@@ -87,16 +144,16 @@ class VideoApp:
         ttk.Button(control_frame, text="Exit", command=self.quit_app).grid(row=0, column=3, padx=5)
 
         # UI: Pasek ładowania
-        ttk.Label(settings_frame, text="Processing Progress:").grid(row=6, column=0, sticky="w", pady=5)
+        ttk.Label(settings_frame, text="Processing Progress:").grid(row=8, column=0, sticky="w", pady=5)
         self.progress_var = tk.IntVar()
         self.progress_bar = ttk.Progressbar(settings_frame, orient="horizontal", length=300, mode="determinate", variable=self.progress_var)
-        self.progress_bar.grid(row=6, column=1, columnspan=2, pady=5)
+        self.progress_bar.grid(row=8, column=1, columnspan=2, pady=5)
         self.progress_label = ttk.Label(settings_frame, text="0%")
-        self.progress_label.grid(row=7, column=1, columnspan=2, pady=5)
+        self.progress_label.grid(row=9, column=1, columnspan=2, pady=5)
 
         # Wskaźnik fps
         self.fps_label = ttk.Label(settings_frame, text="FPS: 0")
-        self.fps_label.grid(row=8, column=0, columnspan=3, pady=5)
+        self.fps_label.grid(row=10, column=0, columnspan=3, pady=5)
 
 
         # Canvas na do wyświetlania nagrania
@@ -108,13 +165,11 @@ class VideoApp:
         graph_frame.grid(row=2, column=0, sticky="nw", padx=5, pady=5)
 
         self.figure = Figure(figsize=(5, 4), dpi=90)
-        self.ax = self.figure.add_subplot()
-        self.ax.set_xticklabels([])
-        self.ax.set_yticklabels([])
         
         # Dodanie wykresu do interfejsu
         self.graph_canvas = FigureCanvasTkAgg(self.figure, master=graph_frame)
         self.graph_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.speed_chart = SpeedChart(self.figure, self.graph_canvas)   # Linie aktualizowane bez przebudowy wykresu
 
         # Ustawienie proporcji siatki
         root.columnconfigure(1, weight=1)
@@ -159,12 +214,12 @@ class VideoApp:
             
     def update_progress_bar(self, current, total):
         """
-        Aktualizacja paska postępu
+        Aktualizacja paska postępu (wywoływana tylko w wątku Tk)
         """ 
-        progress = int((current / total) * 100)
-        self.progress_var.set(progress)
-        self.progress_label.config(text=f"{progress}%")
-        self.root.update_idletasks()
+        progress = int((current / max(total, 1)) * 100)
+        if progress != self.progress_var.get():
+            self.progress_var.set(progress)
+            self.progress_label.config(text=f"{progress}%")
 
     def load_video_processor(self):
         """
@@ -179,18 +234,24 @@ class VideoApp:
             self.video_processor = VideoProcessor(  # Inicjalizacja VideoProcessor
                 self.video_path, selected_drone,
                 altitude,
-                model_path="models/drone7liten-obb-dota_and_data22.pt"   
+                model_path="models/drone7liten-obb-dota_and_data22.pt",
+                checkpoint_interval=CHECKPOINT_INTERVAL if self.checkpoint_var.get() else None,
+                checkpoint_path=os.path.splitext(self.video_path)[0] + ".checkpoint.npz",   # Obok nagrania
+                resume=self.resume_var.get()
             )
             if self.output_path:
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                self.output_writer = cv2.VideoWriter(
-                    self.output_path, 
-                    fourcc, 
+                self.output_writer = VideoEncoder( # Kodowanie w osobnym wątku
+                    segment_path(self.output_path, self.video_processor.start_frame),
                     self.video_processor.fps, 
-                    (self.video_processor.frame_width, self.video_processor.frame_height)
+                    (self.video_processor.frame_width, self.video_processor.frame_height),
+                    profiler=self.video_processor.profiler
                 )
             else:
                 self.output_writer = None   # Brak zapisu nagranie, kiedy nie podano ściezki zapisu
+            if self.pipeline_var.get():
+                self.pipeline = FramePipeline(self.video_processor, self.output_writer) # Zapis nagrania w ostatnim etapie potoku
+            else:
+                self.pipeline = None
             return True
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load video processor: {e}")
@@ -203,143 +264,175 @@ class VideoApp:
         if not self.load_video_processor():
             return
         self.total_frames = self.video_processor.get_total_frame_count()
-        self.frame_count = 0
+        self.frame_count = self.video_processor.start_frame    # Po wznowieniu postęp liczony od punktu kontrolnego
+        self.display_frame.clear()
+        self.worker_done.clear()
+        self.update_display_size()
         self.is_processing = True
         self.start_btn.config(state=tk.DISABLED)
         self.stop_btn.config(state=tk.NORMAL)
         Thread(target=self.process_video, daemon=True).start()  # Utworzenie wątku do przetwarzania nagrania
         self.update_canvas()    # Wywołanie rekurencyjnej funkcji do wyświetlania klatek
+        self.prev_time, self.prev_frame_count = time.perf_counter(), self.frame_count
         self.update_fps_label() # Wywołanie rekurencyjnej funkcji do wskaznika fps
 
     def process_video(self):
         """
-        Przetwarzanie nagrania
+        Przetwarzanie nagrania w wątku roboczym - bez wywołań Tk, klatki są tylko publikowane do wyświetlenia
         """
         try:
             while self.is_processing:   # Flaga przetwarzania nagrania
-                frame, is_frame_available = self.video_processor.process_frame()    # Przetworzenie kolejnej klatki nagrania
+                source = self.pipeline or self.video_processor
+                frame, is_frame_available = source.process_frame()    # Przetworzenie kolejnej klatki nagrania
                 if is_frame_available:  #Sprawdzenie czy jest to koniec nagrania lub uszkodzone nagranie
-                    if self.output_writer:
-                        self.output_writer.write(frame) # Ewentualny zapis do pliku
-                    frame = self.scale_frame_for_display(frame) # Przeskalowanie klatki
-                    if not self.frame_queue.full(): 
-                        self.frame_queue.put(frame) # Wysłanie klatki do kolejki
+                    if self.output_writer and not self.pipeline:
+                        with self.video_processor.profiler.stage("write"):
+                            self.output_writer.write(frame) # Ewentualny zapis do pliku
+                    self.display_frame.publish(frame)   # Zastąpienie niewyświetlonej klatki najnowszą
                     self.frame_count += 1
-
-                    self.update_progress_bar(self.frame_count, self.total_frames)
-                    current_time = time.time()
-                    fps = 1.0 / (current_time - self.prev_time)
-                    self.prev_time = current_time
-                    self.fps = fps
                 else:
                     break
+        except Exception as e:
+            self.worker_error = e
         finally:
             self.is_processing = False
-            if self.output_writer:
-                self.output_writer.release() # Zwolnienie klasy do nagrywania
-            self.video_processor.release()  # Zwolnienie danych w VideoProcessor
-            self.start_btn.config(state=tk.NORMAL)
-            self.stop_btn.config(state=tk.DISABLED)
+            try:
+                try:
+                    if self.pipeline:
+                        self.pipeline.stop()    # Zatrzymanie etapów potoku przed zwolnieniem zasobów
+                    if self.output_writer:
+                        self.output_writer.release() # Zwolnienie klasy do nagrywania
+                finally:
+                    self.video_processor.finish()  # Zwolnienie danych w VideoProcessor (także po błędzie kodera)
+            finally:
+                self.worker_done.set()  # Przyciski są przywracane w wątku Tk
+
+    def finish_processing(self):
+        """
+        Przywrócenie interfejsu po zakończeniu wątku przetwarzania (wątek Tk)
+        """
+        self.update_progress_bar(self.frame_count, self.total_frames)
+        self.start_btn.config(state=tk.NORMAL)
+        self.stop_btn.config(state=tk.DISABLED)
+        if self.worker_error:
+            error, self.worker_error = self.worker_error, None
+            messagebox.showerror("Error", f"Processing failed: {error}")
 
     def update_fps_label(self):
         """
-        Aktualizacja wskaznika fps
+        Aktualizacja wskaznika fps (średnia z ostatniej sekundy) i najwolniejszego etapu przetwarzania
         """
-        self.fps_label.config(text=f"FPS: {self.fps:.2f}")
+        current_time = time.perf_counter()
+        self.fps = (self.frame_count - self.prev_frame_count) / max(current_time - self.prev_time, 1e-9)
+        self.prev_time, self.prev_frame_count = current_time, self.frame_count
+        text = f"FPS: {self.fps:.2f}"
+        stages = self.video_processor.profiler.summary()["stages"] if self.video_processor else {}
+        if stages:
+            name, stats = max(stages.items(), key=lambda item: item[1]["p50_ms"])
+            text += f" | slowest: {name} {stats['p50_ms']:.1f} ms"
+        if self.display_frame.dropped:
+            text += f" | skipped in preview: {self.display_frame.dropped}"
+        self.fps_label.config(text=text)
         if self.is_processing:
             self.root.after(1000, self.update_fps_label)
 
-    def scale_frame_for_display(self, frame):
-            """
-            Skalowanie klatki do wymiarów okna
-            """
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            if canvas_width == 0 or canvas_height == 0:
-                return frame
-            frame_height, frame_width = frame.shape[:2]
-            scale = min(canvas_width / frame_width, canvas_height / frame_height)   # Obliczanie współczynnika skalowania
-            new_width = int(frame_width * scale)    # Nowa szerokość klatki po skalowaniu
-            new_height = int(frame_height * scale)  # Nowa wysokość klatki po skalowaniu
-            resized_frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-            #resized_frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            delta_w = canvas_width - new_width
-            delta_h = canvas_height - new_height
-            top, bottom = delta_h // 2, delta_h - (delta_h // 2)
-            left, right = delta_w // 2, delta_w - (delta_w // 2)
-            # Dodanie czarnych pasków na dole i na górze klatki
-            return cv2.copyMakeBorder(resized_frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-    
+    def fit_to_canvas(self, frame_width, frame_height, canvas_width, canvas_height):
+        """
+        Wymiary klatki przeskalowanej do wymiarów okna z zachowaniem proporcji
+        """
+        scale = min(canvas_width / frame_width, canvas_height / frame_height)   # Obliczanie współczynnika skalowania
+        return max(1, int(frame_width * scale)), max(1, int(frame_height * scale))
+
+    def update_display_size(self):
+        """
+        Odczyt wymiarów okna podglądu (wątek Tk). Bez zapisu nagrania pojazdy są rysowane od razu w rozdzielczości podglądu
+        """
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if canvas_size == self.canvas_size or min(canvas_size) <= 1:
+            return
+        self.canvas_size = canvas_size
+        if self.video_processor and not self.output_writer:
+            self.video_processor.display_size = self.fit_to_canvas(
+                self.video_processor.frame_width, self.video_processor.frame_height, *canvas_size
+            )
+
+    def show_frame(self, frame):
+        """
+        Wyświetlenie klatki - jeden obiekt PhotoImage i jeden element canvas są używane ponownie
+        """
+        frame_height, frame_width = frame.shape[:2]
+        size = self.fit_to_canvas(frame_width, frame_height, *self.canvas_size)
+        if size != (frame_width, frame_height):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        center = (self.canvas_size[0] // 2, self.canvas_size[1] // 2)   # Czarne pasy to tło canvas
+        if self.frame_image is None or (self.frame_image.width(), self.frame_image.height()) != size:
+            self.frame_image = ImageTk.PhotoImage(image=image)
+            if self.canvas_item is None:
+                self.canvas_item = self.canvas.create_image(*center, anchor=tk.CENTER, image=self.frame_image)
+            else:
+                self.canvas.itemconfig(self.canvas_item, image=self.frame_image)
+        else:
+            self.frame_image.paste(image)
+        self.canvas.coords(self.canvas_item, *center)
+
     def update_canvas(self):
         """
-        Wyswietlanie przetworzonych klatek nagrania
+        Wyswietlanie najnowszej przetworzonej klatki, paska postępu i obsługa zakończenia przetwarzania (wątek Tk)
         """
-        if not self.frame_queue.empty():
-            frame = self.frame_queue.get()
-            photo = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            img = ImageTk.PhotoImage(image=Image.fromarray(photo))
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=img)
-            self.frame_image = img
-        if self.is_processing:
-            self.root.after(33, self.update_canvas) # Odświeżanie co 33 ms
-   
+        self.update_display_size()
+        frame = self.display_frame.take()
+        if frame is not None and self.canvas_size:
+            self.show_frame(frame)
+        now = time.perf_counter()
+        if now - self.progress_time >= PROGRESS_INTERVAL:
+            self.progress_time = now
+            self.update_progress_bar(self.frame_count, self.total_frames)
+        if self.worker_done.is_set():
+            self.finish_processing()
+            return
+        self.root.after(DISPLAY_INTERVAL, self.update_canvas)
 
     def show_speed_graph(self):
         """
-        Inicjalizacja wykresu prędkości dla podanego ID
+        Inicjalizacja wykresu prędkości dla podanych ID (oddzielonych przecinkami, bez ID - tylko średnia prędkość)
         """
         self.stop_graph_refresh()
-        car_id = self.selected_car_id.get()
-        if not car_id:
-            messagebox.showerror("Error", "Enter your vehicle ID")
-            return
         try:
-            car_id_int = int(car_id)
-            self.current_car_id = car_id_int
-            self.is_refreshing_graph = True
-            self.refresh_speed_graph(car_id_int)
+            car_ids = tuple(int(car_id) for car_id in self.selected_car_ids.get().replace(",", " ").split())
         except ValueError:
-            messagebox.showerror("Error", "Vehicle ID must be a number")
-        except Exception as e:
-            messagebox.showerror("Error", f"Chart failed to display: {e}")
+            messagebox.showerror("Error", "Vehicle IDs must be numbers separated by commas")
+            return
+        self.current_car_ids = car_ids
+        self.is_refreshing_graph = True
+        self.refresh_speed_graph(car_ids)
 
-    def refresh_speed_graph(self, car_id):
+    def refresh_speed_graph(self, car_ids):
         """
-        Wyświetlanie wykresu prędkości
+        Odświeżenie wykresu prędkości - zmieniane są tylko dane istniejących linii. Dane pochodzą wyłącznie
+        z kopii publikowanej przez wątek śledzenia (VideoProcessor.publish_speed_snapshot)
         """
-        if not self.is_refreshing_graph or self.current_car_id != car_id:
+        if not self.is_refreshing_graph or self.current_car_ids != car_ids:
             return
         try:
-            speed_data = self.video_processor.get_speed_history(car_id)
-            if not speed_data:
-                self.ax.clear()
-                self.ax.set_title(f"No data available for vehicle ID {car_id}")
+            video_processor = self.video_processor
+            if video_processor is None:
+                self.speed_chart.show_message("No data available")
             else:
-                avg_speed = np.mean(speed_data)
-                
-                timestamps = [i for i in range(len(speed_data))]
-                self.ax.clear()
-                sns.lineplot(
-                    x=timestamps,
-                    y=speed_data,
-                    ax=self.ax,
-                    label=f"Vehicle ID {car_id}",
-                    color="tab:blue",
-                    linewidth=2.5
-                )
-                
-                self.ax.axhline(y=avg_speed, color='red', linestyle='--', label=f"Avg Speed: {int(avg_speed)} km/h")
-                self.ax.set_ylabel("Velocity (km/h)", fontsize=12)
-                self.ax.set_title("Speed Graph", fontsize=14, fontweight="bold")
-                self.ax.set_ylim(0, 100)
-                self.ax.legend(fontsize=10, loc="upper right", frameon=True)
-                self.ax.set_xticklabels([])
-            self.graph_canvas.draw()
+                if video_processor.watched_car_ids != car_ids:
+                    video_processor.watched_car_ids = car_ids   # Historie publikowane od kolejnej sekundy nagrania
+                    if self.worker_done.is_set():
+                        video_processor.publish_speed_snapshot()    # Przetwarzanie zakończone - brak wątku śledzenia
+                snapshot = video_processor.speed_snapshot
+                if snapshot is None:
+                    self.speed_chart.show_message("Waiting for data")
+                else:
+                    vehicle_speeds, fleet_times, fleet_speeds = snapshot
+                    self.speed_chart.update({car_id: vehicle_speeds.get(car_id) for car_id in car_ids},
+                                            fleet_times, fleet_speeds)
         except Exception as e:
-            self.ax.clear()
-            self.ax.set_title(f"Error: {e}")
-            self.graph_canvas.draw()
-        self.root.after(1000, lambda: self.refresh_speed_graph(car_id)) # Odświeżanie wykresu co sekundę (rekurencja)
+            self.speed_chart.show_message(f"Error: {e}")
+        self.root.after(GRAPH_INTERVAL, lambda: self.refresh_speed_graph(car_ids)) # Odświeżanie wykresu co sekundę (rekurencja)
 
     def stop_processing(self):
         """
@@ -353,7 +446,7 @@ class VideoApp:
         Zatrzymanie odświeżania wykresu
         """
         self.is_refreshing_graph = False
-        self.current_car_id = None
+        self.current_car_ids = None
 
     def quit_app(self):
         """
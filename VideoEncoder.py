@@ -0,0 +1,199 @@
+import os
+import shutil
+import subprocess
+import time
+from queue import Queue, Full
+from threading import Thread
+import cv2
+
+ENCODER_QUEUE_SIZE = 8  # Maksymalna liczba klatek oczekujących na zakodowanie
+
+_END = object()    # Znacznik końca zapisu
+
+
+def segment_path(path, start_frame):
+    """
+    Ścieżka nagrania wynikowego po wznowieniu przetwarzania od klatki start_frame (np. out.mp4 -> out.from001234.mp4)
+    """
+    if not start_frame:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.from{start_frame:06d}{extension}"
+
+
+class OpenCVBackend:
+    """
+    Zapis nagrania przez cv2.VideoWriter
+    """
+    def __init__(self, path, fps, frame_size, fourcc="mp4v"):
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size)
+        if not self.writer.isOpened():
+            raise ValueError(f"Failed to open video writer: {path}")
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+
+class FFmpegBackend:
+    """
+    Zapis nagrania przez proces ffmpeg - surowe klatki BGR przekazywane są przez potok
+    """
+    def __init__(self, path, fps, frame_size, codec="libx264", preset="veryfast", crf=23, ffmpeg="ffmpeg"):
+        if not self.available(ffmpeg):
+            raise ValueError(f"{ffmpeg} not found - install ffmpeg or use the opencv backend")
+        width, height = frame_size
+        command = [
+            ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps}", "-i", "-",
+            "-c:v", codec, "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p", path,
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    @staticmethod
+    def available(ffmpeg="ffmpeg"):
+        return shutil.which(ffmpeg) is not None
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg failed: {self.process.stderr.read().decode(errors='replace').strip()}")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {self.process.stderr.read().decode(errors='replace').strip()}")
+
+
+class VideoEncoder:
+    """
+    Zapis nagrania w osobnym wątku z ograniczoną kolejką klatek. Interfejs write/release jak cv2.VideoWriter.
+    Opcjonalnie zapisuje pomniejszoną kopię ("proxy") i co n-tą klatkę do szybkiego przeglądania wyników
+    """
+    def __init__(self, path, fps, frame_size, backend="auto", proxy_scale=1.0, decimation=1,
+                 queue_size=ENCODER_QUEUE_SIZE, drop_frames=False, profiler=None):
+        """
+        Args:
+            path: Ścieżka pliku wynikowego
+            fps: Liczba klatek na sekundę nagrania źródłowego
+            frame_size: Wymiary klatek przekazywanych do write (szerokość, wysokość)
+            backend: "opencv", "ffmpeg" albo "auto" (ffmpeg, jeżeli jest zainstalowany)
+            proxy_scale: Skala rozdzielczości zapisywanego nagrania (1.0 - rozdzielczość źródłowa)
+            decimation: Zapisywana jest co n-ta klatka (liczba klatek na sekundę zapisu jest odpowiednio mniejsza)
+            queue_size: Maksymalna liczba klatek oczekujących na zakodowanie
+            drop_frames: Odrzucanie klatek przy pełnej kolejce zamiast wstrzymywania przetwarzania
+                (nagranie traci zgodność z czasem - tylko dla kopii do przeglądania)
+            profiler: Opcjonalny Profiler do pomiaru czasu kodowania i liczników kolejki
+        """
+        self.decimation = max(1, int(decimation))
+        self.drop_frames = drop_frames
+        self.profiler = profiler
+        width, height = frame_size
+        if proxy_scale != 1.0:
+            # Parzyste wymiary są wymagane przez większość kodeków (yuv420p)
+            width, height = max(2, int(width * proxy_scale) // 2 * 2), max(2, int(height * proxy_scale) // 2 * 2)
+        self.input_size = tuple(frame_size)
+        self.output_size = (width, height)
+        output_fps = fps / self.decimation
+
+        if backend == "auto":
+            backend = "ffmpeg" if FFmpegBackend.available() else "opencv"
+        if backend == "ffmpeg":
+            self.backend = FFmpegBackend(path, output_fps, self.output_size)
+        elif backend == "opencv":
+            self.backend = OpenCVBackend(path, output_fps, self.output_size)
+        else:
+            raise ValueError(f"Unknown encoder backend: {backend}")
+        self.backend_name = backend
+
+        # Statystyki kolejki
+        self.frames_in = 0  # Klatki przekazane do write
+        self.frames_written = 0
+        self.frames_dropped = 0 # Klatki odrzucone przy pełnej kolejce
+        self.frames_skipped = 0 # Klatki pominięte przez decymację
+        self.max_queue_depth = 0
+        self.encode_time = 0.0
+        self.error = None
+
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        """
+        Przekazanie klatki do zapisu (bez blokowania, jeżeli drop_frames=True)
+        """
+        if self.error:
+            raise self.error
+        self.frames_in += 1
+        if (self.frames_in - 1) % self.decimation:
+            self.frames_skipped += 1
+            return
+        try:
+            self.queue.put(frame, block=not self.drop_frames)
+        except Full:
+            self.frames_dropped += 1
+            if self.profiler:
+                self.profiler.count("encoder_dropped_frames")
+            return
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if self.profiler:
+            self.profiler.gauge("encoder_queue_depth", depth)
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is _END:
+                return
+            if self.error:
+                continue    # Opróżnianie kolejki po błędzie
+            start = time.perf_counter()
+            try:
+                if (frame.shape[1], frame.shape[0]) != self.output_size:
+                    frame = cv2.resize(frame, self.output_size, interpolation=cv2.INTER_AREA)
+                self.backend.write(frame)
+            except Exception as e:
+                self.error = e
+                continue
+            elapsed = time.perf_counter() - start
+            self.encode_time += elapsed
+            self.frames_written += 1
+            if self.profiler:
+                self.profiler.record("encode", elapsed)
+
+    def stats(self):
+        """
+        Statystyki zapisu (liczba klatek zapisanych, odrzuconych, pominiętych i maksymalna głębokość kolejki)
+        """
+        return {
+            "backend": self.backend_name,
+            "output_size": list(self.output_size),
+            "frames_in": self.frames_in,
+            "frames_written": self.frames_written,
+            "frames_dropped": self.frames_dropped,
+            "frames_skipped": self.frames_skipped,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "mean_encode_ms": round(self.encode_time / max(self.frames_written, 1) * 1000, 3),
+        }
+
+    def release(self):
+        """
+        Zapis pozostałych klatek z kolejki i zamknięcie pliku
+        """
+        if self.thread is None:
+            return
+        self.queue.put(_END)
+        self.thread.join()
+        self.thread = None
+        self.backend.close()
+        if self.error:
+            raise self.error
@@ -1,19 +1,27 @@
 import cv2
-import math
 from ultralytics import YOLO
 from CarContainer import CarContainer
 import torch
-import re
 import os
+import hashlib
 import numpy as np
-import csv
+import psutil
+import time
+from collections import deque
+from Telemetry import load_telemetry, align_to_frames, altitudes
+from Profiler import Profiler
+from AnalyticsSink import AnalyticsSink, trajectory_path
+from TrackArchive import TrackArchive
+from Checkpoint import save_checkpoint, load_checkpoint
+from LiveSource import LatestFrameGrabber, LIVE_FPS
+from DetectorBackend import export_model, warm_up
+from DetectionCache import DetectionCache, DEFAULT_DETECTION_CACHE, cache_key, video_hash, arrays_to_detections
+from TiledDetection import choose_tile_size, tile_overlap, tile_origins, rotated_nms, VEHICLE_LENGTH, MIN_OBJECT_PX, MIN_TILE_SIZE, NMS_THRESHOLD
 from GeoCord import (
     transform_coordinates,
     calculate_bbox,
     calculate_dimensions,
-    generate_wcs_url,
-    download_ascii_grid,
-    parse_ascii_grid
+    TerrainCache
 )
 # Słownik z parametrami dronów
 DRONES = {
@@ -29,22 +37,119 @@ DRONES = {
     },
 }
 
+IMGSZ = 1280    # Rozdzielczość wejściowa modelu
+CONFIDENCE = 0.70   # Minimalna pewność detekcji
+BATCH_MEMORY_FACTOR = 8 # Szacunkowy mnożnik pamięci aktywacji względem tensora wejściowego
+STRIDE_DISPLACEMENT = 20    # Maksymalne przesunięcie pojazdu (w pikselach) pomiędzy klatkami z detekcją
+CROWDED_TRACKS = 50 # Liczba pojazdów, powyżej której odstęp między detekcjami jest zmniejszany
+MIN_PROPAGATION_HISTORY = 10    # Historia pozycji potrzebna do uzupełnienia klatek bez detekcji (nie dłuższa niż okno historii)
+FLOW_SCALE = 0.25   # Skala klatki w skali szarości używanej do przepływu optycznego
+MAX_FRAMES_MISSING = 10 # Liczba klatek, po której zgubiony pojazd przestaje być śledzony
+STATS_INTERVAL = 10 # Odstęp (w sekundach nagrania) pomiędzy zapisami statystyk wydajności
+FLEET_HISTORY = 4 * 3600    # Liczba ostatnich sekund średniej prędkości pojazdów przechowywanych dla wykresu
+UNDECODED_FRAME = np.zeros((0, 0, 3), dtype=np.uint8)  # Klatka niedekodowana - detekcje pochodzą z pamięci podręcznej
+
+def select_device():
+    """
+    Wybór urządzenia do detekcji
+    """
+    return torch.device(
+        "cuda" if torch.cuda.is_available() else
+        "mps" if torch.backends.mps.is_available() else
+        "cpu"
+        )
+
+
+def load_model(model_path, device=None, backend="torch", int8=False, calibration_video=None, warmup_batch=1):
+    """
+    Załadowanie modelu YOLO (może być współdzielony przez kolejne nagrania)
+    Args:
+        backend: "torch" (PyTorch), "onnx" (ONNX Runtime) lub "openvino" - model eksportowany przy pierwszym użyciu
+        int8: Model kwantyzowany INT8 kalibrowany na klatkach nagrania calibration_video (tylko onnx i openvino)
+        warmup_batch: Rozmiar paczki wywołań rozgrzewających (0 - bez rozgrzewania)
+    """
+    if int8 and backend == "torch":
+        raise ValueError("INT8 quantization requires the onnx or openvino backend")
+    try:
+        if backend == "torch":
+            model = YOLO(model_path,verbose=False).to(device if device is not None else select_device())
+        else:
+            model = YOLO(export_model(model_path, backend, IMGSZ, int8, calibration_video), task="obb", verbose=False)
+    except Exception as e:
+        raise ValueError(f"Failed to load the model: {e}")
+    if warmup_batch:
+        warm_up(model, IMGSZ, CONFIDENCE, warmup_batch)
+    return model
+
+
 class VideoProcessor:
     """
     Klasa odpowiedzialna za przetwarzanie klatek nagrania i detekcję pojazdów
     """
-    def __init__(self, video_path, drone_model, altitude, model_path):
+    def __init__(self, video_path, drone_model, altitude, model_path, batch_size=1, terrain_cache=None,
+                 detection_stride=1, optical_flow=False, tiled=False, road_mask_path=None, model=None,
+                 output_file="traffic_analysis.csv", detector=None, stats_path=None, prometheus_path=None,
+                 profile_stacks=None, overlay=True, trajectories=True, memory_budget=None, checkpoint_interval=None,
+                 resume=False, frame_range=None, backend="torch", int8=False, detection_cache_dir=DEFAULT_DETECTION_CACHE,
+                 tracker_options=None, live=False, model_loader=None, checkpoint_path=None):
         """
         Args:
             video_path: Ścieżka do pliku wideo
             drone_model: Model drona
             altitude: Początkowa wysokość drona
             model_path: Ścieżka do modelu YOLO
+            batch_size: Liczba kolejnych klatek przetwarzanych przez model w jednym wywołaniu
+            terrain_cache: Pamięć podręczna numerycznego modelu terenu (domyślnie TerrainCache w katalogu użytkownika)
+            detection_stride: Maksymalny odstęp między klatkami z detekcją (1 - detekcja na każdej klatce)
+            optical_flow: Korekta pozycji w klatkach bez detekcji przepływem optycznym
+            tiled: Detekcja na nakładających się kaflach dobieranych do GSD (małe pojazdy z dużej wysokości)
+            road_mask_path: Opcjonalny obraz maski dróg - kafle bez dróg są pomijane
+            model: Wcześniej załadowany model YOLO (pomija ładowanie z model_path)
+            output_file: Plik statystyk co sekundę nagrania (.csv lub .parquet)
+            detector: Zastępczy detektor - funkcja przyjmująca listę klatek i zwracająca listy (pozycja, typ pojazdu)
+                      (np. detektor testowy w Benchmark.py, model YOLO nie jest wtedy ładowany)
+            stats_path: Plik statystyk etapów i śledzenia (.json lub .csv) zapisywany co STATS_INTERVAL sekund nagrania
+            prometheus_path: Plik tekstowy Prometheus (katalog textfile collector node exportera)
+            profile_stacks: Plik wyników próbkującego profilera stosu wywołań (None - profiler wyłączony)
+            overlay: Rysowanie pojazdów na klatkach (False - tylko analiza, bez zapisu i podglądu nagrania)
+            trajectories: Zapis trajektorii pojazdów do pliku <output_file>.tracks.csv / .tracks.parquet
+            memory_budget: Budżet pamięci historii prędkości śledzonych pojazdów w MB (None - bez ograniczenia).
+                           Historie zakończonych pojazdów i starsze prędkości zapisywane są w pliku <output_file>.history.bin
+            checkpoint_interval: Odstęp w sekundach pomiędzy zapisami punktu kontrolnego (None - bez punktów kontrolnych)
+            resume: Kontynuacja przetwarzania od zapisanego punktu kontrolnego (jeżeli istnieje)
+            frame_range: Przetwarzanie tylko klatek [początek, koniec) - fragment nagrania (np. w SegmentProcessor)
+            backend: Silnik wnioskowania modelu YOLO - "torch", "onnx" lub "openvino" (DetectorBackend)
+            int8: Model kwantyzowany INT8 (kalibracja na klatkach przetwarzanego nagrania przy pierwszym eksporcie)
+            detection_cache_dir: Katalog pamięci podręcznej detekcji (None - bez pamięci podręcznej). Klatki zapisane
+                                 w pamięci podręcznej nie są przetwarzane przez model, a bez rysowania i przepływu
+                                 optycznego nie są też dekodowane
+            tracker_options: Parametry śledzenia przekazywane do CarContainer (progi odległości, region, próg
+                             prędkości liczonych pojazdów, max_frames_missing, okno i stopień modelu ruchu)
+            live: Strumień na żywo (adres RTSP/UDP, potok lub plik odtwarzany w tempie nagrania) - przetwarzana jest
+                  zawsze najnowsza klatka, a starsze są odrzucane. Bez pliku SRT wysokość drona jest stała (altitude)
+            model_loader: Funkcja zwracająca model zamiast ładowania z model_path (np. model współdzielony przez
+                          nagrania procesu roboczego) - wywoływana, jak load_model, dopiero przy pierwszej klatce
+                          brakującej w pamięci podręcznej detekcji
+            checkpoint_path: Plik punktu kontrolnego (domyślnie <output_file>.checkpoint.npz)
         """
+        # Pomiar czasu etapów przetwarzania
+        self.profiler = Profiler()
+        self.stats_path = stats_path
+        self.prometheus_path = prometheus_path
+        self.profile_stacks = profile_stacks
+        self.overlay = overlay
+        self.display_size = None    # Rozdzielczość podglądu - klatki są pomniejszane przed rysowaniem (None - rozdzielczość nagrania)
+        if profile_stacks:
+            self.profiler.start_sampling()
+
+        self.video_path = video_path
         self.cap = cv2.VideoCapture(video_path)
         if not self.cap.isOpened():
             raise ValueError("Failed to open the video")
         self.start_altitude = altitude
+        self.live = live
+        if live and resume:
+            raise ValueError("Live streams cannot be resumed from a checkpoint")
 
         # Pobranie parametrów dla zadanego modelu drona
         self.drone = self._select_drone(drone_model)
@@ -52,88 +157,168 @@ class VideoProcessor:
         self.sensor_width = self.drone["sensor_width"]
         self.sensor_height = self.drone["sensor_height"]
 
-        self.height_file = "heights.asc"    # Plik z numerycznym modelem terenu
-        self.output_file = "traffic_analysis.csv"   # Plik do zapisu danych z analizy
+        # Punkt kontrolny wczytywany przed otwarciem plików wynikowych (zapis jest kontynuowany, a nie rozpoczynany od nowa)
+        self.checkpoint_path = checkpoint_path or os.path.splitext(output_file)[0] + ".checkpoint.npz"
+        self.checkpoint_interval = None if live else checkpoint_interval   # Strumienia na żywo nie można wznowić
+        self.last_checkpoint = time.monotonic()
+        self.end_of_video = False
+        self.decoded_frames = 0 # Liczba odczytanych klatek (od klatki punktu kontrolnego włącznie)
+        checkpoint = self._load_checkpoint() if resume else None
 
-        with open(self.output_file, 'w') as file:   # Usuwanie zawartości i zapis nagłówka
-            writer = csv.writer(file)
-            writer.writerow(["Time (s)", "Avg Speed (km/h)", "Traffic Density"])
-
-        # Wybór urządzenia
-        self.device = torch.device(
-            "cuda" if torch.cuda.is_available() else
-            "mps" if torch.backends.mps.is_available() else
-            "cpu"
-            )
-        # Załadowanie modelu YOLO
-        try:
-            self.model = YOLO(model_path,verbose=False).to(self.device)
-        except Exception as e:
-            raise ValueError(f"Failed to load the model: {e}")
+        self.terrain_cache = terrain_cache  # Kafle numerycznego modelu terenu (tworzone przy pierwszym użyciu)
+        self.output_file = output_file   # Plik do zapisu danych z analizy
+        self.trajectory_file = trajectory_path(output_file) if trajectories else None
+        self.analytics = AnalyticsSink(output_file, self.trajectory_file,   # Buforowany zapis wyników analizy
+                                       state=checkpoint["analytics"] if checkpoint else None)
 
         self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if live and not self.fps > 0:
+            self.fps = LIVE_FPS
         self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE,5)
-
-        srt_path = self._get_srt_path(video_path)
-        self.latitude = self._parse_srt_field(srt_path, r"\[latitude:\s*([\d.]+)\]")    # Odczytanie szerokości geograficznej
-        self.longitude = self._parse_srt_field(srt_path, r"\[longitude:\s*([\d.]+)\]")  # Odczytanie długości geograficznej
-
-        
-        try:    # Sprawdzenie czy dane są zapisane jako altitude, a jezeli nie to odczytywane są dane z rel_alt
-            self.altitudes = self._parse_srt_field(srt_path, r"\[altitude:\s*([\d.]+)\]")
-        except ValueError:
-            self.altitudes = self._parse_srt_field(srt_path, r"\[rel_alt:\s*([\d.]+)")
-        if len(self.latitude) < self.total_frames:
-            self.latitude += [self.latitude[-1]] * (self.total_frames - len(self.latitude))
-        if len(self.longitude) < self.total_frames:
-            self.longitude += [self.longitude[-1]] * (self.total_frames - len(self.longitude))
-        if len(self.altitudes) < self.total_frames:
-            self.altitudes += [self.altitudes[-1]] * (self.total_frames - len(self.altitudes))
-
-        # Obliczanie rzeczywistych wysokości drona
-        self.coordinates = list(zip(self.latitude, self.longitude))
-        self.real_altitudes = np.array(self._fetch_real_altitudes(self.height_file))
-        if self.start_altitude:
-            self.real_altitudes[0] = self.start_altitude
-        if self.real_altitudes[0]:
-            self.real_altitudes = (np.array(self.altitudes) + (self.real_altitudes[0] - self.real_altitudes)).tolist()  # Korekta wysokości
+        self.total_frames = max(0, int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)))   # 0 - strumień bez końca
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1 if live else 5)   # Bufor strumienia zwiększa opóźnienie
+        self.batch_size = 1 if live else self._limit_batch_size(batch_size)    # Paczka czekałaby na kolejne klatki
+
+        # Strumień na żywo - odczyt najnowszej klatki w osobnym wątku (uruchamiany przy odczycie pierwszej klatki)
+        self.grabber = None
+        self.capture_time = None    # Chwila odebrania bieżącej klatki (pomiar opóźnienia)
+        self.frame_time = None  # Czas bieżącej klatki w strumieniu w sekundach
+        self.source_frame_idx = 0   # Numer bieżącej klatki źródła (z odrzuconymi klatkami)
+        self.last_second = 0    # Ostatnia pełna sekunda strumienia zapisana w statystykach
+        self.fleet_speeds = deque(maxlen=FLEET_HISTORY) # (sekunda, średnia prędkość pojazdów) - wykres w VideoApp
+        self.watched_car_ids = ()   # Pojazdy, których historie prędkości są publikowane dla wykresu (VideoApp)
+        self.speed_snapshot = None  # Niezmienna kopia prędkości dla wątku interfejsu (publish_speed_snapshot)
+        self.finished_speed_histories = {}  # Historie pojazdów, które opuściły kadr (odczytywane z archiwum raz)
+        self.processed_frames = deque()  # Klatki przetworzone w ramach ostatniej paczki
+        self.unwritten_frames = 0   # Klatki śledzone, ale niezapisane przy zatrzymaniu potoku (FramePipeline)
+
+        if live and not os.path.isfile(os.path.splitext(video_path)[0] + ".srt"):
+            if not altitude:
+                raise ValueError("Live streams without an SRT file require the drone altitude")
+            self.real_altitudes = [altitude]    # Stała wysokość drona
         else:
-            self.real_altitudes = self.altitudes
+            srt_path = self._get_srt_path(video_path)
+            # Jednokrotny odczyt telemetrii i dopasowanie jej do klatek nagrania
+            self.telemetry = align_to_frames(load_telemetry(srt_path), self.total_frames, self.fps)
+            self.latitude = self.telemetry["latitude"].tolist()  # Szerokość geograficzna
+            self.longitude = self.telemetry["longitude"].tolist()    # Długość geograficzna
+            self.altitudes = altitudes(self.telemetry).tolist()  # Wysokość z pola altitude lub rel_alt
+
+            # Obliczanie rzeczywistych wysokości drona
+            self.coordinates = list(zip(self.latitude, self.longitude))
+            self.real_altitudes = np.array(self._fetch_real_altitudes())
+            if self.start_altitude:
+                self.real_altitudes[0] = self.start_altitude
+            if self.real_altitudes[0]:
+                self.real_altitudes = (np.array(self.altitudes) + (self.real_altitudes[0] - self.real_altitudes)).tolist()  # Korekta wysokości
+            else:
+                self.real_altitudes = self.altitudes
 
         # Inicjalizacja kontenera do śledzenia pojazdów
+        self.history_file = os.path.splitext(output_file)[0] + ".history.bin"
         self.car_container = CarContainer(
             self.fps, self.frame_width, self.frame_height,
-            self.focal_length, self.sensor_width, self.sensor_height,max_frames_missing=10
+            self.focal_length, self.sensor_width, self.sensor_height,
+            archive=TrackArchive(self.history_file, state=checkpoint["archive"] if checkpoint else None), # Historie prędkości zakończonych pojazdów na dysku
+            memory_budget=memory_budget * 1024 * 1024 if memory_budget else None,
+            **dict({"max_frames_missing": MAX_FRAMES_MISSING}, **(tracker_options or {}))
         )
         self.current_frame_idx = 0
+
+        # Detekcja co k-tą klatkę z przewidywaniem pozycji pomiędzy nimi
+        self.detection_stride = max(1, int(detection_stride))
+        self.current_stride = self.detection_stride
+        self.optical_flow = optical_flow
+        self.frames_since_keyframe = 0
+        self.previous_gray = None   # Pomniejszona klatka w skali szarości do przepływu optycznego
+        self.detected_frames = 0    # Liczba klatek przetworzonych przez model
+        self.propagated_frames = 0  # Liczba klatek bez detekcji
+
+        # Detekcja na kaflach
+        self.tiled = tiled
+        self.road_mask = None
+        if road_mask_path:
+            mask = cv2.imread(road_mask_path, cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                raise ValueError(f"Failed to read road mask: {road_mask_path}")
+            self.road_mask = cv2.resize(mask, (self.frame_width, self.frame_height), interpolation=cv2.INTER_NEAREST) > 0
+        self.tile_cache = {}    # Położenia kafli dla danego rozmiaru kafla
+        self.max_tiles_per_call = self._limit_batch_size(64)
+
+        # Pamięć podręczna detekcji poprzednich przetworzeń nagrania tym samym modelem
+        self.detection_cache = None
+        if detector is None and detection_cache_dir and model_path and os.path.isfile(model_path) and not live:
+            key = cache_key(video_path, model_path, CONFIDENCE, IMGSZ, **self._detection_options(backend, int8, road_mask_path))
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            self.detection_cache = DetectionCache(os.path.join(detection_cache_dir, f"{name}-{key}"), self.total_frames)
+        # Bez rysowania i przepływu optycznego klatki są potrzebne tylko do detekcji brakujących w pamięci podręcznej.
+        # Niepełna pamięć podręczna (np. po przetwarzaniu z odstępem między detekcjami) - dekodowanie sekwencyjne
+        # zamiast odczytu każdej brakującej klatki z przewijaniem
+        self.decode_frames = not (self.detection_cache is not None and self.detection_cache.is_complete()
+                                  and not overlay and not optical_flow)
+        self.video_frames = None    # Rzeczywista liczba klatek nagrania (znana po dojściu do końca nagrania)
+        self.random_cap = None  # Odczyt pojedynczych klatek, gdy nagranie nie jest dekodowane
+
+        # Wybór urządzenia i załadowanie modelu YOLO (przy pamięci podręcznej dopiero przy pierwszej brakującej klatce)
+        self.device = select_device()
+        self.detector = detector
+        self.model = model
+        self.model_loader = model_loader
+        self.model_options = (model_path, self.device, backend, int8, video_path, self.batch_size)
+        if detector is None and model is None and self.detection_cache is None:
+            self._load_model()
+
+        self.tracked_since_keyframe = 0 # Klatki śledzone od ostatniej detekcji (stan wyboru klatek kluczowych w punkcie kontrolnym)
+        self.end_frame = None   # Klatka, na której kończy się przetwarzanie fragmentu nagrania
+        if frame_range:
+            start, self.end_frame = frame_range
+            if start and not checkpoint:
+                self.current_frame_idx = self.decoded_frames = start    # Czas i wysokość drona liczone od początku nagrania
+                self._seek(start)
+        if checkpoint:
+            self._restore_checkpoint(checkpoint)
+        self.start_frame = self.current_frame_idx   # Pierwsza przetwarzana klatka (> 0 po wznowieniu)
     
+    def _detection_options(self, backend, int8, road_mask_path):
+        """
+        Ustawienia wpływające na detekcje w kluczu pamięci podręcznej detekcji. Przy detekcji na kaflach rozmiar
+        i zakładka kafli zależą od GSD (wysokości drona w kolejnych klatkach i parametrów kamery), a ich położenie
+        od regionu śledzenia i zawartości maski dróg
+        """
+        options = dict(backend=backend, int8=int8, tiled=self.tiled, road_mask=None)
+        if self.tiled:
+            options.update(
+                altitudes=hashlib.sha256(np.asarray(self.real_altitudes, dtype=np.float64).tobytes()).hexdigest()[:16],
+                camera=[self.focal_length, self.sensor_width, self.sensor_height],
+                region=self.car_container.region,
+                tiling=[VEHICLE_LENGTH, MIN_OBJECT_PX, MIN_TILE_SIZE, NMS_THRESHOLD],
+                road_mask=video_hash(road_mask_path) if road_mask_path else None    # Skrót zawartości pliku maski
+            )
+        return options
+
+    def _load_model(self):
+        if self.model_loader is not None:
+            self.model = self.model_loader()
+            return self.model
+        model_path, device, backend, int8, calibration_video, warmup_batch = self.model_options
+        self.model = load_model(model_path, device, backend, int8, calibration_video, warmup_batch)
+        return self.model
+
+    def _limit_batch_size(self, batch_size):
+        """
+        Ograniczenie rozmiaru paczki do dostępnej pamięci operacyjnej
+        """
+        frame_bytes = self.frame_width * self.frame_height * 3  # Zdekodowana klatka BGR
+        tensor_bytes = IMGSZ * IMGSZ * 3 * 4 * BATCH_MEMORY_FACTOR    # Tensor wejściowy float32 wraz z aktywacjami sieci
+        available = psutil.virtual_memory().available * 0.5 # Pozostawienie połowy pamięci dla systemu i reszty aplikacji
+        return max(1, min(int(batch_size), int(available // (frame_bytes + tensor_bytes))))
+
     def _select_drone(self, model_name):
         if model_name in DRONES:
             return DRONES[model_name]
         raise ValueError(f"Model {model_name} not found")
 
-    def _parse_srt_field(self, srt_path, pattern):
-        """
-        Odczyt danych z pliku SRT na podstawie wzorca
-        """
-        values = []
-        try:
-            with open(srt_path, 'r') as file:
-                for line in file:
-                    match = re.search(pattern, line)
-                    if match:
-                        value = float(match.group(1))
-                        values.append(value)
-        except FileNotFoundError:
-            raise ValueError(f"SRT file not found: {srt_path}")
-
-        if len(values) == 0:
-            raise ValueError(f"No data found in the SRT file")
-        return values
-
     def _get_srt_path(self, video_path):
         """
         Odczyt ścieżki do pliku SRT na podstawie ścieżki do nagrania (nazwa nagrania + rozszerzenie .srt)
@@ -143,7 +328,7 @@ class VideoProcessor:
             raise FileNotFoundError(f"No .srt file found for video: {video_path}")
         return srt_path
     
-    def _fetch_real_altitudes(self, output_file):
+    def _fetch_real_altitudes(self):
         """
         Pobieranie rzeczywistej wysokości na podstawie współrzędnych
         """
@@ -156,70 +341,530 @@ class VideoProcessor:
                     heights = [0] * len(transformed_coords)
                     return heights
             # Jezeli przekroczono zakres lub podano wysokość startową następuje pobranie numerycznego modelu terenu
-            url = generate_wcs_url(bbox, width, height)
-            download_ascii_grid(url, output_file)
-            heights = parse_ascii_grid(output_file, transformed_coords, bbox)
-    
-            return heights
+            if self.terrain_cache is None:
+                self.terrain_cache = TerrainCache()
+            return self.terrain_cache.heights_at(transformed_coords)  # Pobierane są tylko brakujące kafle
         except Exception as e:
             print(f"Error fetching real altitudes: {e}")
             return []
 
-    def process_frame(self):
+    def read_frame(self):
         """
-        Przetwarzanie pojedynczczej klatki w celu detekcji obiektów
+        Dekodowanie kolejnej klatki nagrania (None na końcu nagrania)
         """
-        ret, frame = self.cap.read()
+        if self.end_frame is not None and self.decoded_frames >= self.end_frame:
+            self.end_of_video = True
+            return None
+        if self.live:
+            return self._read_latest_frame()
+        if not self.decode_frames:
+            if self.decoded_frames >= self.detection_cache.frame_count:
+                self.end_of_video = True
+                self.video_frames = self.decoded_frames
+                return None
+            self.decoded_frames += 1
+            return UNDECODED_FRAME
+        with self.profiler.stage("decode"):
+            ret, frame = self.cap.read()
         if not ret:
-            return None, False
-        
-        drone_real_height = self.real_altitudes[self.current_frame_idx]
-        self.car_container.update_drone_height(drone_real_height)
-        self.car_container.increment_missing_frames()   # Inkrementacja licznika zgubionych pozycji dla kazdego pojazdu
-
-        self.current_frame_idx += 1
-        results_t = self.model(frame, conf=0.70, imgsz=1280, stream=False, verbose = False)
-        results = [t.cpu().numpy() for t in results_t]
-        # Przetwarzanie rezultatów detekcji
-        for result in results:
-            if hasattr(result, 'obb') and result.obb is not None:
-                for box in result.obb:
-                    x_center, y_center, width, height, theta = box.xywhr[0]
-                    class_id = int(box.cls[0])
-                    vehicle_type = {9: 'large', 10: 'small'}.get(class_id)  # Sprawdzenie czy wykryty obiekt nalezy do klasy 9 albo 10
-                    if not vehicle_type:
-                        continue
-
-                    position = (x_center, y_center, width, height, math.degrees(theta))
-                    self.car_container.update_or_add_car(position, vehicle_type)     # Aktualizacja pozycji lub dodanie nowego pojazdu
-
-        if len(self.car_container.cars) > 100:
-            self.car_container.cars = self.car_container.cars[-100:]
-        self.car_container.remove_missing_cars()    # Usunięcie zgubionych pojazdów
-        if self.current_frame_idx % round(self.fps) == 0:
-            self.avg_speed_and_traffic(self.output_file)    # Zapis do pliku informacji co sekundę nagrania
-        processed_frame = self.car_container.draw_cars(frame)
-        return processed_frame, True
-
-    def avg_speed_and_traffic(self, output_filepath):
-        seconds = self.current_frame_idx / self.fps
-        detected_cars = [car for car in self.car_container.cars if car.is_detected and len(car.real_speed_history) > 2]
-        if not detected_cars:
-            avg_speed = 0.0
+            self.end_of_video = True
+            self.video_frames = self.decoded_frames
+            return None
+        self.decoded_frames += 1
+        return frame
+
+    def _read_latest_frame(self):
+        """
+        Najnowsza klatka strumienia na żywo - klatki odebrane w trakcie przetwarzania poprzedniej są odrzucane
+        """
+        if self.grabber is None:
+            self.grabber = LatestFrameGrabber(self.cap, realtime=os.path.isfile(self.video_path), fps=self.fps)
+        with self.profiler.stage("wait"):   # Oczekiwanie na kolejną klatkę źródła
+            grabbed = self.grabber.read()
+        if grabbed is None:
+            self.end_of_video = True
+            return None
+        frame, self.capture_time, self.frame_time, self.source_frame_idx = grabbed
+        self.decoded_frames += 1
+        return frame
+
+    def live_stats(self):
+        """
+        Statystyki strumienia na żywo - klatki odebrane, odrzucone i udział odrzuconych oraz opóźnienie od odebrania
+        klatki do zakończenia jej przetwarzania (ms)
+        """
+        stats = self.grabber.stats() if self.grabber is not None else {"frames_grabbed": 0, "frames_dropped": 0, "drop_rate": 0.0}
+        latency = self.profiler.summary()["stages"].get("latency", {})
+        stats.update({f"latency_{name}": value for name, value in latency.items() if name.endswith("_ms")})
+        return stats
+
+    def _load_checkpoint(self):
+        """
+        Odczyt punktu kontrolnego tego nagrania (None, jeżeli nie istnieje)
+        """
+        if not os.path.isfile(self.checkpoint_path):
+            print(f"No checkpoint found at {self.checkpoint_path}, starting from the beginning")
+            return None
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if checkpoint["video"] != os.path.basename(self.video_path) or checkpoint["total_frames"] != total_frames:
+            raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to a different video")
+        return checkpoint
+
+    def _restore_checkpoint(self, checkpoint):
+        """
+        Odtworzenie stanu śledzenia i przewinięcie nagrania do klatki zapisanej w punkcie kontrolnym
+        """
+        self.car_container.set_state(checkpoint["tracks"])
+        self.current_frame_idx = checkpoint["frame_index"]
+        self.current_stride = checkpoint["current_stride"]
+        self.tracked_since_keyframe = self.frames_since_keyframe = checkpoint["frames_since_keyframe"]
+        self.detected_frames = checkpoint["detected_frames"]
+        self.propagated_frames = checkpoint["propagated_frames"]
+        self.previous_gray = checkpoint.get("previous_gray")
+        self._seek(self.current_frame_idx)
+        self.decoded_frames = self.current_frame_idx
+
+    def _seek(self, frame_idx):
+        """
+        Przewinięcie nagrania tak, aby kolejną odczytaną klatką była klatka frame_idx
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        if int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_idx:
+            return
+        # Nagranie nie obsługuje dokładnego przewijania - pominięcie klatek od początku bez ich konwersji
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.video_path)
+        for _ in range(frame_idx):
+            self.cap.grab()
+
+    def save_checkpoint(self):
+        """
+        Zapis stanu przetwarzania - śledzone pojazdy, liczniki, położenie zapisu wyników i indeks klatki
+        (wywoływany pomiędzy klatkami, gdy wszystkie odczytane klatki zostały już śledzone)
+        """
+        with self.profiler.stage("checkpoint"):
+            if self.detection_cache is not None:
+                self.detection_cache.flush()    # Detekcje wykonane przed punktem kontrolnym nie są powtarzane po wznowieniu
+            state = {
+                "video": os.path.basename(self.video_path),
+                "total_frames": self.total_frames,
+                "frame_index": self.current_frame_idx,
+                "current_stride": self.current_stride,
+                "frames_since_keyframe": self.tracked_since_keyframe,
+                "detected_frames": self.detected_frames,
+                "propagated_frames": self.propagated_frames,
+                "tracks": self.car_container.get_state(),
+                "analytics": self.analytics.get_state(),
+                "archive": self.car_container.archive.get_state(),
+            }
+            if self.previous_gray is not None:
+                state["previous_gray"] = self.previous_gray
+            save_checkpoint(self.checkpoint_path, state)
+        self.last_checkpoint = time.monotonic()
+
+    def checkpoint_due(self):
+        """
+        Sprawdzenie, czy od poprzedniego punktu kontrolnego minęło checkpoint_interval sekund
+        """
+        return bool(self.checkpoint_interval) and time.monotonic() - self.last_checkpoint >= self.checkpoint_interval
+
+    def checkpoint_if_due(self):
+        """
+        Zapis punktu kontrolnego, jeżeli od poprzedniego minęło checkpoint_interval sekund
+        """
+        if self.checkpoint_due():
+            self.save_checkpoint()
+
+    def detect(self, frame):
+        """
+        Detekcja pojazdów na klatce, zwraca listę (pozycja, typ pojazdu)
+        """
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames, frame_indices=None):
+        """
+        Detekcja pojazdów na kilku klatkach w jednym wywołaniu modelu, zwraca listy detekcji w kolejności klatek
+        Args:
+            frame_indices: Indeksy klatek w nagraniu - detekcje odczytywane z pamięci podręcznej i zapisywane do niej
+        """
+        profiler = self.profiler
+        if self.detector is not None:
+            with profiler.stage("inference"):
+                return self.detector(frames)
+        if self.detection_cache is None or frame_indices is None:
+            return [arrays_to_detections(xywhr, classes) for xywhr, _, classes in self._detect_arrays(frames)]
+
+        detections = [None] * len(frames)
+        missing = []
+        with profiler.stage("cache"):
+            for i, frame_idx in enumerate(frame_indices):
+                arrays = self.detection_cache.get(frame_idx)
+                if arrays is None:
+                    missing.append(i)
+                else:
+                    detections[i] = arrays_to_detections(arrays[0], arrays[2])
+        if missing:
+            missing_frames = [self._decode_at(frame_indices[i]) if frames[i] is UNDECODED_FRAME else frames[i] for i in missing]
+            for i, (xywhr, confidences, classes) in zip(missing, self._detect_arrays(missing_frames)):
+                self.detection_cache.put(frame_indices[i], xywhr, confidences, classes)
+                detections[i] = arrays_to_detections(xywhr, classes)
+        return detections
+
+    def _detect_arrays(self, frames):
+        """
+        Detekcja modelem YOLO, zwraca tablice (xywhr, pewność, klasa) w kolejności klatek
+        """
+        if self.model is None:
+            self._load_model()
+        if self.tiled:
+            return self._detect_tiled(frames)
+        profiler = self.profiler
+        with profiler.stage("inference"):
+            results_t = self.model(frames, conf=CONFIDENCE, imgsz=IMGSZ, stream=False, verbose = False)
+        with profiler.stage("copy"):    # Kopiowanie wyników z GPU
+            results_t = [t.cpu().numpy() for t in results_t]
+        with profiler.stage("postprocess"):
+            return [self._result_arrays(t) for t in results_t]
+
+    def _decode_at(self, frame_idx):
+        """
+        Odczyt pojedynczej klatki brakującej w pamięci podręcznej, gdy nagranie nie jest dekodowane
+        """
+        with self.profiler.stage("decode"):
+            if self.random_cap is None:
+                self.random_cap = cv2.VideoCapture(self.video_path)
+            self.random_cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            ret, frame = self.random_cap.read()
+        if not ret:
+            raise ValueError(f"Failed to read frame {frame_idx}")
+        return frame
+
+    def _tiles(self):
+        """
+        Położenia i rozmiar kafli dla aktualnego GSD (None - detekcja na całej klatce)
+        """
+        container = self.car_container
+        if hasattr(container, "gsd_horizontal"):
+            gsd = container.gsd_horizontal
         else:
-            avg_speed = np.mean([car.real_speed for car in detected_cars])
-        traffic = len(detected_cars)
-        with open(output_filepath, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([round(seconds), round(avg_speed, 2), traffic])
+            gsd, _ = container.calculate_gsd(self._drone_height())
+        tile_size = choose_tile_size(gsd, self.frame_width, self.frame_height, IMGSZ)
+        if tile_size is None:
+            return None, None
+        if tile_size not in self.tile_cache:
+            overlap = tile_overlap(gsd, tile_size)
+            self.tile_cache[tile_size] = tile_origins(
+                self.frame_width, self.frame_height, tile_size, overlap, container.region, self.road_mask
+            )
+        return self.tile_cache[tile_size], tile_size
+
+    def _detect_tiled(self, frames):
+        """
+        Detekcja na nakładających się kaflach wszystkich klatek i połączenie wyników z usunięciem powtórzeń na granicach kafli
+        """
+        origins, tile_size = self._tiles()
+        if origins is None:
+            origins, tile_size = [(0, 0)], None
+        tiles = []
+        for frame in frames:
+            for x, y in origins:
+                tiles.append(frame if tile_size is None else frame[y:y + tile_size, x:x + tile_size])
+
+        results = []
+        for start in range(0, len(tiles), self.max_tiles_per_call):  # Kafle przetwarzane w jak największych paczkach
+            chunk = tiles[start:start + self.max_tiles_per_call]
+            with self.profiler.stage("inference"):
+                chunk_results = self.model(chunk, conf=CONFIDENCE, imgsz=IMGSZ, stream=False, verbose = False)
+            with self.profiler.stage("copy"):
+                results += [t.cpu().numpy() for t in chunk_results]
+
+        with self.profiler.stage("postprocess"):
+            return [self._merge_tiles(origins, results[i * len(origins):(i + 1) * len(origins)]) for i in range(len(frames))]
+
+    def _merge_tiles(self, origins, results):
+        """
+        Połączenie detekcji z kafli jednej klatki, zwraca tablice (xywhr, pewność, klasa)
+        """
+        xywhr, confidences, classes = [], [], []
+        for (x, y), result in zip(origins, results):
+            boxes, conf, cls = self._result_arrays(result)
+            boxes[:, :2] += (x, y)    # Przesunięcie do współrzędnych całej klatki
+            xywhr.append(boxes)
+            confidences.append(conf)
+            classes.append(cls)
+        xywhr, confidences, classes = np.concatenate(xywhr), np.concatenate(confidences), np.concatenate(classes)
+        keep = rotated_nms(xywhr, confidences) if len(origins) > 1 else np.arange(len(xywhr))
+        return xywhr[keep], confidences[keep], classes[keep]
+
+    @staticmethod
+    def _result_arrays(result):
+        """
+        Tablice (xywhr, pewność, klasa) z rezultatu detekcji jednej klatki
+        """
+        if not hasattr(result, 'obb') or result.obb is None:
+            return np.zeros((0, 5)), np.zeros(0), np.zeros(0, dtype=int)
+        xywhr = np.array(result.obb.xywhr, dtype=float).reshape(-1, 5)
+        confidences = np.array(result.obb.conf, dtype=float).reshape(-1)
+        classes = np.array(result.obb.cls).reshape(-1).astype(int)
+        return xywhr, confidences, classes
+
+    def is_keyframe(self):
+        """
+        Sprawdzenie, czy kolejna klatka ma zostać przetworzona przez model (wywoływane raz na klatkę)
+        """
+        if self.frames_since_keyframe == 0 or self.frames_since_keyframe >= self.current_stride:
+            self.frames_since_keyframe = 1
+            return True
+        self.frames_since_keyframe += 1
+        return False
+
+    def _update_stride(self):
+        """
+        Dobór odstępu między detekcjami na podstawie liczby pojazdów i ich prędkości w pikselach na klatkę
+        """
+        if self.detection_stride == 1:
+            return
+        store = self.car_container.store
+        slots = np.flatnonzero(store.active & (store.frames_since_seen == 0))
+        if len(slots) == 0:
+            self.current_stride = self.detection_stride
+            return
+        # Nowe pojazdy wymagają detekcji w kolejnych klatkach (krótsze okno historii z tracker_options - pełne okno)
+        if np.any(store.position_counts[slots] < min(MIN_PROPAGATION_HISTORY, store.history)):
+            self.current_stride = 1
+            return
+        velocity = (store.approximated[slots, -1] - store.approximated[slots, 0]) / (store.history - 1)  # Piksele na klatkę
+        displacement = np.linalg.norm(velocity, axis=1).max()
+        stride = int(STRIDE_DISPLACEMENT // max(displacement, 1e-6))
+        if len(slots) > CROWDED_TRACKS:
+            stride //= 2
+        max_stride = min(self.detection_stride, self.car_container.max_frames_missing - 1)  # Pojazd nie może zostać usunięty między detekcjami
+        self.current_stride = int(np.clip(stride, 1, max_stride))
+
+    def _flow_positions(self, frame):
+        """
+        Funkcja wyznaczająca pozycje pojazdów przepływem optycznym (Lucas-Kanade) na pomniejszonej klatce
+        """
+        gray = cv2.cvtColor(cv2.resize(frame, None, fx=FLOW_SCALE, fy=FLOW_SCALE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        previous_gray, self.previous_gray = self.previous_gray, gray
+        store = self.car_container.store
+
+        def measure(slots):
+            points = store.current_positions(slots)[:, :2]
+            if previous_gray is None:
+                return points, np.zeros(len(slots), dtype=bool)
+            start = (points * FLOW_SCALE).astype(np.float32).reshape(-1, 1, 2)
+            end, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, gray, start, None, winSize=(15, 15), maxLevel=2)
+            return end.reshape(-1, 2) / FLOW_SCALE, status.reshape(-1).astype(bool)
+        return measure
+
+    def _drone_height(self):
+        """
+        Wysokość drona w bieżącej klatce (w strumieniu na żywo - według numeru klatki źródła)
+        """
+        index = self.source_frame_idx if self.live else self.current_frame_idx
+        return self.real_altitudes[min(index, len(self.real_altitudes) - 1)]
+
+    def track(self, detections, frame=None):
+        """
+        Aktualizacja śledzonych pojazdów na podstawie detekcji z kolejnej klatki
+        (detections=None oznacza klatkę bez detekcji - pozycje są przewidywane modelem ruchu)
+        """
+        with self.profiler.stage("track"):
+            drone_real_height = self._drone_height()
+            self.car_container.update_drone_height(drone_real_height)
+            if self.live:
+                self.car_container.set_frame_time(self.frame_time)  # Prędkości z rzeczywistych odstępów między klatkami
+            self.car_container.increment_missing_frames()   # Inkrementacja licznika zgubionych pozycji dla kazdego pojazdu
+
+            self.current_frame_idx += 1
+            measure = self._flow_positions(frame) if self.optical_flow and frame is not None else None
+            if detections is None:
+                self.car_container.propagate_cars(measure)  # Przewidywanie pozycji pojazdów bez uruchamiania modelu
+                self.propagated_frames += 1
+                self.tracked_since_keyframe += 1
+            else:
+                self.car_container.update_cars(detections)   # Aktualizacja pozycji lub dodanie nowych pojazdów
+                self.detected_frames += 1
+                self.tracked_since_keyframe = 1
+                self._update_stride()
+
+            self.car_container.remove_missing_cars()    # Usunięcie zgubionych pojazdów
+            seconds = self.frame_time if self.live else self.current_frame_idx / self.fps
+            if self.analytics.trajectories is not None:
+                self.analytics.add_trajectories(self.current_frame_idx, seconds,
+                                                *self.car_container.get_measured_tracks(), drone_real_height)
+        if self.live:
+            # Zapis co sekundę strumienia - liczba przetworzonych klatek na sekundę zmienia się przy odrzucaniu klatek
+            second = int(seconds)
+            if second > self.last_second:
+                if second // STATS_INTERVAL > self.last_second // STATS_INTERVAL:
+                    self.export_stats()
+                self.last_second = second
+                self.avg_speed_and_traffic(second)
+            return
+        if self.current_frame_idx % round(self.fps) == 0:
+            self.avg_speed_and_traffic()    # Zapis informacji co sekundę nagrania
+        if self.current_frame_idx % (round(self.fps) * STATS_INTERVAL) == 0:
+            self.export_stats()
+
+    def render(self, frame, draw_state=None):
+        """
+        Rysowanie pojazdów na klatce (draw_state pozwala rysować stan zapamiętany wcześniej)
+        Przy ustawionym display_size zwracana jest pomniejszona klatka
+        """
+        if not self.overlay:
+            return frame
+        with self.profiler.stage("draw"):
+            resolution_scale = 1.0
+            if self.display_size and self.display_size != (frame.shape[1], frame.shape[0]):
+                # Rysowanie w rozdzielczości podglądu jest tańsze niż rysowanie na pełnej klatce
+                resolution_scale = self.display_size[0] / frame.shape[1]
+                frame = cv2.resize(frame, self.display_size, interpolation=cv2.INTER_AREA)
+            return self.car_container.draw_cars(frame, draw_state, resolution_scale)
+
+    def collect_stats(self):
+        """
+        Aktualizacja liczników śledzenia w profilerze, zwraca podsumowanie statystyk
+        """
+        profiler = self.profiler
+        profiler.counters.update(self.car_container.track_stats)
+        profiler.counters["detector_frames"] = self.detected_frames
+        profiler.counters["propagated_frames"] = self.propagated_frames
+        profiler.gauge("active_tracks", len(self.car_container.car_views))
+        profiler.gauge("frame_index", self.current_frame_idx)
+        profiler.gauge("detection_stride", self.current_stride)
+        if self.grabber is not None:
+            grabber_stats = self.grabber.stats()
+            profiler.counters["live_dropped_frames"] = grabber_stats["frames_dropped"]
+            profiler.gauge("live_drop_rate", grabber_stats["drop_rate"])
+        return profiler.summary()
+
+    def export_stats(self):
+        """
+        Zapis statystyk wydajności do plików wskazanych w konstruktorze
+        """
+        if not (self.stats_path or self.prometheus_path):
+            return
+        self.collect_stats()
+        try:
+            if self.stats_path:
+                if self.stats_path.endswith(".csv"):
+                    self.profiler.export_csv(self.stats_path)
+                else:
+                    self.profiler.export_json(self.stats_path)
+            if self.prometheus_path:
+                video = os.path.splitext(os.path.basename(self.video_path))[0]
+                self.profiler.export_prometheus(self.prometheus_path, labels={"video": video})
+        except OSError as e:
+            print(f"Could not save performance stats: {e}")
+
+    def process_frame(self):
+        """
+        Przetwarzanie pojedynczczej klatki w celu detekcji obiektów
+        """
+        if not self.processed_frames:
+            self.checkpoint_if_due()    # Wszystkie klatki poprzedniej paczki zostały już zwrócone do zapisu
+            frames = []
+            while len(frames) < self.batch_size:   # Dekodowanie paczki kolejnych klatek
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                frames.append(frame)
+            if not frames:
+                return None, False
+
+            # Model przetwarza tylko klatki kluczowe, pozostałe są śledzone modelem ruchu
+            first_idx = self.decoded_frames - len(frames)
+            keyframes = [self.is_keyframe() for _ in frames]
+            indices = [first_idx + i for i, key in enumerate(keyframes) if key]
+            detections = iter(self.detect_batch([frame for frame, key in zip(frames, keyframes) if key], indices) if indices else [])
+
+            # Śledzenie odbywa się w kolejności klatek, osobno dla każdej klatki z paczki
+            for frame, key in zip(frames, keyframes):
+                self.track(next(detections) if key else None, frame)
+                self.processed_frames.append(self.render(frame))
+                if self.live:
+                    self.profiler.record("latency", time.monotonic() - self.capture_time)
+        return self.processed_frames.popleft(), True
+
+    def avg_speed_and_traffic(self, seconds=None):
+        if seconds is None:
+            seconds = self.current_frame_idx / self.fps
+        avg_speed, traffic = self.car_container.get_average_speed(min_history=2)
+        self.analytics.add_second(round(seconds), round(avg_speed, 2), traffic)
+        self.fleet_speeds.append((round(seconds), avg_speed))
+        self.publish_speed_snapshot()
 
 
     def get_total_frame_count(self):
-        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        """
+        Liczba klatek nagrania (przy frame_range - indeks klatki kończącej fragment, None - strumień na żywo)
+        """
+        if self.live:
+            return None
+        return min(self.total_frames, self.end_frame) if self.end_frame is not None else self.total_frames
 
-    def release(self):
+    def finish(self):
+        """
+        Zamknięcie nagrania i zapis końcowych statystyk (bez okien OpenCV - również na serwerach bez interfejsu graficznego)
+        """
+        if self.grabber is not None:
+            self.grabber.stop()
         self.cap.release()
+        if self.random_cap is not None:
+            self.random_cap.release()
+        if self.detection_cache is not None:
+            if self.video_frames is None and self.decoded_frames >= self.total_frames:
+                self.video_frames = self.decoded_frames
+            self.detection_cache.close(self.video_frames)
+        if self.checkpoint_interval:
+            finished = self.end_of_video or self.current_frame_idx >= self.get_total_frame_count()
+            if finished and self.current_frame_idx >= self.decoded_frames:
+                if os.path.isfile(self.checkpoint_path):
+                    os.remove(self.checkpoint_path)    # Nagranie przetworzone do końca
+            elif not self.processed_frames and not self.unwritten_frames:
+                # Zatrzymanie przetwarzania - zapis stanu przed zamknięciem plików (tylko gdy wszystkie śledzone
+                # klatki zostały zapisane, w przeciwnym razie po wznowieniu brakowałoby ich w nagraniu)
+                self.save_checkpoint()
+        self.publish_speed_snapshot()   # Stan końcowy dla wykresu
+        self.analytics.close()  # Zapis pozostałych wierszy z bufora
+        self.car_container.close()  # Zapis historii prędkości śledzonych pojazdów
+        self.export_stats()
+        if self.profile_stacks:
+            self.profiler.stop_sampling()
+            self.profiler.sampler.export(self.profile_stacks)
+
+    def release(self):
+        self.finish()
         cv2.destroyAllWindows()
 
     def get_speed_history(self, car_id):
-        return self.car_container.get_speed_history(car_id)
\ No newline at end of file
+        return self.car_container.get_speed_history(car_id)
+
+    def get_fleet_speed_history(self):
+        """
+        Czasy (s) i średnie prędkości wszystkich pojazdów z ostatnich FLEET_HISTORY sekund nagrania
+        """
+        fleet_speeds = np.array(list(self.fleet_speeds), dtype=float).reshape(-1, 2)  # Kopia - dopisywana w wątku przetwarzania
+        return fleet_speeds[:, 0], fleet_speeds[:, 1]
+
+    def publish_speed_snapshot(self):
+        """
+        Publikacja kopii historii prędkości obserwowanych pojazdów (watched_car_ids) i średniej prędkości wszystkich
+        pojazdów. Wywoływana w wątku śledzenia co sekundę nagrania, więc wątek interfejsu odczytuje tylko
+        niezmienne tablice, a nie struktury śledzenia zmieniane w trakcie przetwarzania
+        """
+        vehicle_speeds = {}
+        for car_id in self.watched_car_ids:
+            history = self.finished_speed_histories.get(car_id)
+            if history is None:
+                history = np.array(self.get_speed_history(car_id) or [], dtype=float)
+                history.flags.writeable = False
+                if len(history) and not self.car_container.is_tracked(car_id):
+                    self.finished_speed_histories[car_id] = history # Historia już się nie zmienia
+            vehicle_speeds[car_id] = history
+        fleet_times, fleet_speeds = self.get_fleet_speed_history()
+        fleet_times.flags.writeable = fleet_speeds.flags.writeable = False
+        self.speed_snapshot = (vehicle_speeds, fleet_times, fleet_speeds)   # Podmiana całej krotki jednym przypisaniem
\ No newline at end of file
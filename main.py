@@ -1,52 +1,147 @@
 import argparse
 from VideoProcessor import VideoProcessor
-import cv2
+from BatchProcessor import process_video, run_batch
+from SegmentProcessor import run_segments
+from DetectionCache import DEFAULT_DETECTION_CACHE
+from Replay import export_clip
+import json
+import os
+import time
 
 def main():
     parser = argparse.ArgumentParser(description="Process video to analyze car speeds.")
     parser.add_argument("--video_path", type=str, required=False, help="Path to the input video file.")
     parser.add_argument("--output_path", type=str, required=False, help="Path to save the processed video.")
-    parser.add_argument("--drone_model", type=str, choices=["DJI mini 4 pro", "DJI air 2s"], required=False, help="Drone model used for video recording.")
+    parser.add_argument("--input_dir", type=str, required=False, help="Directory with video/SRT pairs to process in batch mode.")
+    parser.add_argument("--output_dir", type=str, required=False, help="Directory for per-video CSV and video outputs in batch mode.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes in batch or segment mode.")
+    parser.add_argument("--segments", type=int, required=False, help="Split --video_path into N overlapping segments processed by --workers processes.")
+    parser.add_argument("--no_video", action="store_true", help="Skip writing processed videos in batch mode.")
+    parser.add_argument("--model_path", type=str, default="models/drone7liten-obb-dota_and_data22.pt", help="Path to the YOLO model.")
+    parser.add_argument("--drone_model", type=str, choices=["DJI mini 4 pro", "DJI air 2s"], default="DJI mini 4 pro", help="Drone model used for video recording.")
     parser.add_argument("--start_altitude", type=float, required=False, help="Starting altitude of the drone (in meters).")
+    parser.add_argument("--backend", choices=["torch", "onnx", "openvino"], default="torch", help="Inference backend; onnx and openvino models are exported once and cached.")
+    parser.add_argument("--int8", action="store_true", help="Use an INT8 model calibrated on frames of the video (onnx and openvino backends).")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of frames passed to the detector in one call.")
+    parser.add_argument("--no_detection_cache", action="store_true", help="Always run the detector instead of reusing cached detections of this video.")
+    parser.add_argument("--detection_stride", type=int, default=1, help="Maximum number of frames between detector runs; tracks are propagated in between.")
+    parser.add_argument("--optical_flow", action="store_true", help="Refine propagated tracks with sparse optical flow.")
+    parser.add_argument("--tiled", action="store_true", help="Detect on overlapping tiles sized from the ground sampling distance.")
+    parser.add_argument("--road_mask", type=str, required=False, help="Image mask of roads; tiles without roads are skipped.")
+    parser.add_argument("--encoder", choices=["auto", "opencv", "ffmpeg"], default="auto", help="Video encoder backend (auto uses ffmpeg when installed).")
+    parser.add_argument("--proxy_scale", type=float, default=1.0, help="Scale of the output video resolution, e.g. 0.5 for a review copy.")
+    parser.add_argument("--output_decimation", type=int, default=1, help="Write every n-th frame to the output video.")
+    parser.add_argument("--drop_frames", action="store_true", help="Drop output frames instead of waiting when the encoder falls behind (review copies only; timing in the video is lost).")
+    parser.add_argument("--stats_path", type=str, required=False, help="Write per-stage timings and tracker counters to this .json or .csv file.")
+    parser.add_argument("--prometheus_path", type=str, required=False, help="Write metrics to this Prometheus textfile (node exporter textfile collector).")
+    parser.add_argument("--profile_stacks", type=str, required=False, help="Run the sampling profiler and write collapsed stacks to this file.")
+    parser.add_argument("--analytics_format", choices=["csv", "parquet"], default="csv", help="File format of per-second stats and vehicle trajectories.")
+    parser.add_argument("--no_trajectories", action="store_true", help="Skip writing per-vehicle trajectories next to the per-second stats.")
+    parser.add_argument("--memory_budget", type=float, required=False, help="Memory budget (MB) for in-memory speed histories; older history is spilled to disk.")
+    parser.add_argument("--checkpoint_interval", type=float, required=False, help="Save a resumable checkpoint every N seconds.")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint saved by an interrupted run.")
+    parser.add_argument("--pipeline", action="store_true", help="Run decode, detection, tracking, rendering and encoding as parallel stages.")
+    parser.add_argument("--live", action="store_true", help="Treat --video_path as a live stream (RTSP/UDP URL or pipe; local files are replayed in real time) and always process the newest frame.")
+    parser.add_argument("--tracker_options", type=str, required=False, help="JSON object of tracker parameters, e.g. '{\"near_threshold\": 15, \"max_frames_missing\": 8}'.")
+    parser.add_argument("--replay_clip", type=str, required=False, help="Save the cached detections of --video_path as a clip for Replay.py (.npz or .txt).")
     
     args = parser.parse_args()
-    video_path = "/Users/maciejlower/Downloads/OneDrive_3_7/DJI_20240709125210_0005_D.MP4"
-    output_path = "/Users/maciejlower/Downloads/OneDrive_3_7/MainOut10-1-poprawione.MP4"
-    drone_model = "DJI mini 4 pro"
-    start_altitude = None
+    processor_options = dict(
+        batch_size=args.batch_size,
+        detection_stride=args.detection_stride,
+        optical_flow=args.optical_flow,
+        tiled=args.tiled,
+        road_mask_path=args.road_mask,
+        trajectories=not args.no_trajectories,
+        memory_budget=args.memory_budget,
+        checkpoint_interval=args.checkpoint_interval,
+        resume=args.resume,
+        backend=args.backend,
+        int8=args.int8,
+        detection_cache_dir=None if args.no_detection_cache else DEFAULT_DETECTION_CACHE,
+        tracker_options=json.loads(args.tracker_options) if args.tracker_options else None
+    )
+    encoder_options = dict(
+        backend=args.encoder,
+        proxy_scale=args.proxy_scale,
+        decimation=args.output_decimation,
+        drop_frames=args.drop_frames
+    )
+    profiling_options = dict(
+        stats_path=args.stats_path,
+        prometheus_path=args.prometheus_path,
+        profile_stacks=args.profile_stacks
+    )
+    if args.input_dir:
+        failures = run_batch(
+            args.input_dir,
+            args.output_dir or os.path.join(args.input_dir, "output"),
+            args.drone_model,
+            args.model_path,
+            workers=args.workers,
+            start_altitude=args.start_altitude,
+            save_video=not args.no_video,
+            pipeline=args.pipeline,
+            encoder_options=encoder_options,
+            analytics_format=args.analytics_format,
+            **processor_options
+        )
+        raise SystemExit(1 if failures else 0)
+
+    if not args.video_path:
+        parser.error("--video_path or --input_dir is required")
+    if args.live and (args.segments or args.pipeline or args.resume):
+        parser.error("--live cannot be combined with --segments, --pipeline or --resume")
+    output_file = os.path.splitext(args.video_path)[0] + "." + args.analytics_format
+    if args.live and not os.path.isfile(args.video_path):
+        output_file = time.strftime("live_%Y%m%d_%H%M%S.") + args.analytics_format # Adres strumienia nie jest ścieżką pliku
+    if args.segments:
+        run_segments(
+            args.video_path,
+            output_file,
+            args.drone_model,
+            args.model_path,
+            output_path=args.output_path,
+            workers=args.workers,
+            segments=args.segments,
+            start_altitude=args.start_altitude,
+            encoder_options=encoder_options,
+            **processor_options
+        )
+        return
+
     try:
         video_processor = VideoProcessor(
-            video_path, 
-            drone_model, 
-            start_altitude, 
-            model_path="models/drone7liten-obb-dota_and_data22.pt"
+            args.video_path, 
+            args.drone_model, 
+            args.start_altitude, 
+            model_path=args.model_path,
+            output_file=output_file,
+            overlay=bool(args.output_path),    # Bez zapisu nagrania pojazdy nie są rysowane
+            live=args.live,
+            **processor_options,
+            **profiling_options
         )
         
-        if output_path:
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            output_writer = cv2.VideoWriter(
-                output_path,
-                fourcc,
-                video_processor.fps,
-                (video_processor.frame_width, video_processor.frame_height)
-            )
-        
         print("Starting video processing...")
-        total_frames = video_processor.get_total_frame_count()
-        for frame_count in range(total_frames):
-            frame, is_frame_available = video_processor.process_frame()
-            if not is_frame_available:
-                break
-            
-            if output_writer:
-                output_writer.write(frame)
-
-            print(f"Processed frame {frame_count + 1}/{total_frames}")
-        
-        if output_writer:
-            output_writer.release()
+        try:
+            process_video(video_processor, args.output_path, args.pipeline, encoder_options=encoder_options)
+        except KeyboardInterrupt:
+            if not args.live:
+                raise
+            print("Live stream processing stopped.")  # Wyniki zostały zapisane przy zamknięciu przetwarzania
 
         print("Video processing completed.")
+        if args.live:
+            stats = video_processor.live_stats()
+            print(f"Dropped {stats['frames_dropped']}/{stats['frames_grabbed']} frames ({stats['drop_rate']:.1%}), "
+                  f"latency p50 {stats.get('latency_p50_ms', 0):.0f} ms, p95 {stats.get('latency_p95_ms', 0):.0f} ms")
+        if args.replay_clip:
+            export_clip(video_processor, args.replay_clip)
+            print(f"Replay clip saved to {args.replay_clip}")
+        if video_processor.propagated_frames:
+            processed = video_processor.detected_frames + video_processor.propagated_frames
+            print(f"Detector ran on {video_processor.detected_frames}/{processed} frames")
     except Exception as e:
         print(f"An error occurred: {e}")
 
@@ -0,0 +1,95 @@
+import numpy as np
+from MotionModel import QuadraticMotionModel, KalmanMotionModel
+from TrackStore import HISTORY
+
+MAX_FRAMES_MISSING = 10 # Jak w VideoProcessor (import VideoProcessor wymaga modelu YOLO)
+
+
+def polyfit_smooth(positions, frames_since_seen):
+    """
+    Aproksymowane pozycje liczone dopasowaniem np.polyfit (wcześniejsza implementacja Car)
+    """
+    if len(positions) < 3:
+        return positions
+    time_indices = np.arange(len(positions))
+    if len(positions) > 3:
+        time_indices[-1] += frames_since_seen - 1
+    coeffs_x = np.polyfit(time_indices, positions[:, 0], 2)
+    coeffs_y = np.polyfit(time_indices, positions[:, 1], 2)
+    time_indices = np.arange(len(positions)) + frames_since_seen - 1
+    return np.column_stack([np.polyval(coeffs_x, time_indices), np.polyval(coeffs_y, time_indices)])
+
+
+def polyfit_predict(positions, frames_since_seen):
+    """
+    Przewidywana pozycja liczona dopasowaniem np.polyfit (wcześniejsza implementacja Car)
+    """
+    if len(positions) < 2:
+        return positions[-1]
+    if len(positions) == 2:
+        return positions[-1] + positions[-1] - positions[-2]
+    time_indices = np.arange(len(positions))
+    coeffs_x = np.polyfit(time_indices, positions[:, 0], 2)
+    coeffs_y = np.polyfit(time_indices, positions[:, 1], 2)
+    next_time_index = time_indices[-1] + frames_since_seen
+    return np.array([np.polyval(coeffs_x, next_time_index), np.polyval(coeffs_y, next_time_index)])
+
+
+def windows_for(positions):
+    """
+    Okna (pojazdy, HISTORY, 2) z pozycjami wyrównanymi do końca okna
+    """
+    windows = np.zeros((len(positions), HISTORY, 2))
+    for i, track in enumerate(positions):
+        windows[i, HISTORY - len(track):] = track
+    return windows
+
+
+def test_matches_polyfit():
+    model = QuadraticMotionModel(history=HISTORY)
+    rng = np.random.default_rng(0)
+    tracks, counts, gaps = [], [], []
+    for count in range(1, HISTORY + 1):
+        for gap in range(MAX_FRAMES_MISSING + 1):
+            # Ruch jednostajnie przyspieszony z szumem detekcji (piksele)
+            t = np.arange(count)[:, None]
+            tracks.append(rng.uniform(0, 3840, 2) + rng.uniform(-20, 20, 2) * t + rng.uniform(-1, 1, 2) * t ** 2
+                          + rng.normal(0, 2, (count, 2)))
+            counts.append(count)
+            gaps.append(gap)
+    windows = windows_for(tracks)
+    smoothed = model.smooth(windows, np.array(counts), np.array(gaps))
+    predicted = model.predict(windows, np.array(counts), np.array(gaps))
+    for i, (track, count, gap) in enumerate(zip(tracks, counts, gaps)):
+        assert np.allclose(smoothed[i, HISTORY - count:], polyfit_smooth(track, gap)), (count, gap)
+        assert np.allclose(predicted[i], polyfit_predict(track, gap)), (count, gap)
+
+
+def test_kalman_constant_velocity():
+    model = KalmanMotionModel(history=HISTORY)
+    velocity = np.array([15.0, -7.0])   # Piksele na klatkę
+    for count in range(3, HISTORY + 1):
+        track = np.array([100.0, 200.0]) + velocity * np.arange(count)[:, None]
+        windows = windows_for([track])
+        # Przewidywanie przez przerwę w detekcjach - ruch jednostajny jest ekstrapolowany liniowo
+        for gap in range(1, MAX_FRAMES_MISSING + 1):
+            predicted = model.predict(windows, np.array([count]), np.array([gap]))[0]
+            error = np.linalg.norm(predicted - (track[-1] + velocity * gap))
+            assert error < 0.02 * np.linalg.norm(velocity * gap), (count, gap)  # Poniżej 2% drogi przebytej w przerwie
+        smoothed = model.smooth(windows, np.array([count]), np.array([1]))[0, HISTORY - count:]
+        assert np.allclose(smoothed, track, atol=0.05), count
+
+
+def test_kalman_reduces_noise():
+    model = KalmanMotionModel(history=HISTORY)
+    rng = np.random.default_rng(0)
+    track = np.array([100.0, 200.0]) + np.array([15.0, -7.0]) * np.arange(HISTORY)[:, None]
+    windows = track + rng.normal(0, 2, (2000, HISTORY, 2))
+    counts, gaps = np.full(len(windows), HISTORY), np.ones(len(windows), dtype=int)
+    smoothed = model.smooth(windows, counts, gaps)
+    raw_error = np.sqrt(np.mean((windows[:, -1] - track[-1]) ** 2))
+    smoothed_error = np.sqrt(np.mean((smoothed[:, -1] - track[-1]) ** 2))
+    assert smoothed_error < 0.9 * raw_error
+    # Mniejszy błąd detekcji - większe zaufanie do pomiarów
+    trusting = KalmanMotionModel(history=HISTORY, measurement_noise=1e-4).smooth(windows, counts, gaps)
+    assert np.allclose(trusting[:, -1], windows[:, -1], atol=0.5)